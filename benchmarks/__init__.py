@@ -0,0 +1,4 @@
+import os
+
+# The widgets need a Qt application, also when there is no display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
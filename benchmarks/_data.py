@@ -0,0 +1,119 @@
+"""
+Synthetic images, masks, point sets and transforms for the benchmarks.
+"""
+from pathlib import Path
+
+import numpy as np
+from napari.layers import Image
+
+# Image shapes, from 256 kB to about 200 MB of float32 pixels
+SHAPES_2D = [(256, 256), (1024, 1024), (4096, 4096)]
+SHAPES_3D = [(64, 64, 64), (128, 128, 128), (384, 384, 384)]
+
+
+def synthetic_array(shape, shift: float = 0.0) -> np.ndarray:
+    """
+    Returns a smooth blob with a ripple texture, shifted by `shift` pixels
+    along each axis.
+    """
+    coordinates = [
+        (np.arange(size, dtype=np.float32) - size / 2 - shift) / size
+        for size in shape
+    ]
+    grids = np.meshgrid(*coordinates, indexing="ij", sparse=True)
+    distance = sum(grid**2 for grid in grids)
+    ripple = 1.0
+    for grid in grids:
+        ripple = ripple * np.sin(12 * grid)
+    return (np.exp(-8 * distance) + 0.2 * ripple).astype(np.float32)
+
+
+def image_layers(shape):
+    """
+    Returns a fixed and a moving image layer of `shape`.
+    """
+    shift = max(shape) / 32
+    return Image(synthetic_array(shape)), Image(synthetic_array(shape, shift))
+
+
+def mask_layer(shape):
+    """
+    Returns a mask layer that excludes the border of each axis.
+    """
+    mask = np.zeros(shape, np.uint8)
+    mask[tuple(slice(size // 8, size - size // 8) for size in shape)] = 1
+    return Image(mask)
+
+
+def write_point_sets(shape, directory: Path):
+    """
+    Writes corresponding fixed and moving point set files, and returns their
+    paths.
+    """
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0.25, 0.75, (8, len(shape))) * np.asarray(shape)
+    shift = max(shape) / 32
+    paths = []
+    for name, offset in [("fixed", 0.0), ("moving", shift)]:
+        path = Path(directory) / f"{name}_points.txt"
+        # elastix expects the coordinates in x, y(, z) order
+        lines = [" ".join(map(str, point[::-1] + offset)) for point in points]
+        path.write_text(f"point\n{len(points)}\n" + "\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
+
+
+def write_transform(kind: str, shape, directory: Path) -> Path:
+    """
+    Writes a "rigid" or "bspline" transform parameter file for images of
+    `shape`, and returns its path.
+    """
+    import itk
+
+    dimension = len(shape)
+    size = list(shape[::-1])
+    parameter_map = {
+        "FixedImageDimension": [str(dimension)],
+        "MovingImageDimension": [str(dimension)],
+        "FixedInternalImagePixelType": ["float"],
+        "MovingInternalImagePixelType": ["float"],
+        "Size": [str(value) for value in size],
+        "Index": ["0"] * dimension,
+        "Spacing": ["1"] * dimension,
+        "Origin": ["0"] * dimension,
+        "Direction": [str(float(value)) for value in np.eye(dimension).flat],
+        "UseDirectionCosines": ["true"],
+        "InitialTransformParameterFileName": ["NoInitialTransform"],
+        "HowToCombineTransforms": ["Compose"],
+        "Resampler": ["DefaultResampler"],
+        "ResampleInterpolator": ["FinalBSplineInterpolator"],
+        "FinalBSplineInterpolationOrder": ["3"],
+        "DefaultPixelValue": ["0"],
+        "ResultImagePixelType": ["float"],
+    }
+    if kind == "rigid":
+        angles = [0.05] if dimension == 2 else [0.05, 0.0, 0.05]
+        parameters = angles + [2.0] * dimension
+        parameter_map["Transform"] = ["EulerTransform"]
+        parameter_map["CenterOfRotationPoint"] = [str(value / 2) for value in size]
+    else:
+        grid_spacing = max(shape) / 8
+        grid_size = [int(np.ceil(value / grid_spacing)) + 3 for value in size]
+        rng = np.random.default_rng(0)
+        parameters = rng.normal(0, grid_spacing / 16, dimension * np.prod(grid_size))
+        parameter_map["Transform"] = ["BSplineTransform"]
+        parameter_map["GridSize"] = [str(value) for value in grid_size]
+        parameter_map["GridSpacing"] = [str(grid_spacing)] * dimension
+        parameter_map["GridOrigin"] = [str(-grid_spacing)] * dimension
+        parameter_map["GridDirection"] = parameter_map["Direction"]
+        parameter_map["BSplineTransformSplineOrder"] = ["3"]
+        parameter_map["UseCyclicTransform"] = ["false"]
+    parameters = list(parameters)
+    parameter_map["NumberOfParameters"] = [str(len(parameters))]
+    parameter_map["TransformParameters"] = [str(float(value)) for value in parameters]
+
+    parameter_object = itk.ParameterObject.New()
+    parameter_object.AddParameterMap(parameter_map)
+    path = Path(directory) / f"TransformParameters.{kind}.txt"
+    parameter_object.WriteParameterFile(str(path))
+    return path
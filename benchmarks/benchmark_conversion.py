@@ -0,0 +1,48 @@
+"""
+Overhead of converting layers to ITK images and back, separately from
+elastix itself.
+"""
+import numpy as np
+from napari.layers import Image
+
+from ._data import SHAPES_2D, SHAPES_3D, synthetic_array
+
+SHAPES = SHAPES_2D + SHAPES_3D
+
+
+class Conversion:
+    params = (["float32", "uint16"], SHAPES)
+    param_names = ["dtype", "shape"]
+    timeout = 300
+
+    def setup(self, dtype, shape):
+        import itk
+
+        data = synthetic_array(shape)
+        self.layer = Image((data * 1000).astype(dtype))
+        self.image = itk.image_view_from_array(data)
+
+    def time_image_from_image_layer(self, dtype, shape):
+        from itk_napari_conversion import image_from_image_layer
+
+        image_from_image_layer(self.layer).astype(np.float32)
+
+    def peakmem_image_from_image_layer(self, dtype, shape):
+        from itk_napari_conversion import image_from_image_layer
+
+        image_from_image_layer(self.layer).astype(np.float32)
+
+    def time_image_view_from_layer(self, dtype, shape):
+        from elastix_napari.conversion import image_view_from_layer
+
+        image_view_from_layer(self.layer, np.float32)
+
+    def peakmem_image_view_from_layer(self, dtype, shape):
+        from elastix_napari.conversion import image_view_from_layer
+
+        image_view_from_layer(self.layer, np.float32)
+
+    def time_image_layer_from_image(self, dtype, shape):
+        from itk_napari_conversion import image_layer_from_image
+
+        image_layer_from_image(self.image)
@@ -0,0 +1,87 @@
+"""
+Wall time and peak memory of registrations through the registration widget.
+
+The number of iterations is limited, so that the benchmarks measure the
+throughput per iteration and the overhead around elastix, rather than the
+convergence of the optimizer.
+"""
+import tempfile
+
+from elastix_napari import elastix_registration
+
+from ._data import SHAPES_2D, SHAPES_3D, image_layers, mask_layer, write_point_sets
+
+PRESETS = ["translation", "rigid", "affine", "bspline"]
+SHAPES = SHAPES_2D[:2] + SHAPES_3D[:2]
+MAX_ITERATIONS = 64
+
+
+def register(fixed, moving, **kwargs):
+    return elastix_registration.elastix_registration()(
+        fixed,
+        moving,
+        advanced=True,
+        max_iterations=MAX_ITERATIONS,
+        use_cache=False,
+        **kwargs,
+    )
+
+
+class Registration:
+    params = (PRESETS, SHAPES)
+    param_names = ["preset", "shape"]
+    timeout = 600
+
+    def setup(self, preset, shape):
+        self.fixed, self.moving = image_layers(shape)
+
+    def time_registration(self, preset, shape):
+        register(self.fixed, self.moving, preset=preset)
+
+    def peakmem_registration(self, preset, shape):
+        register(self.fixed, self.moving, preset=preset)
+
+
+class MaskedRegistration:
+    params = SHAPES
+    param_names = ["shape"]
+    timeout = 600
+
+    def setup(self, shape):
+        self.fixed, self.moving = image_layers(shape)
+        self.mask = mask_layer(shape)
+
+    def time_masked_registration(self, shape):
+        register(
+            self.fixed,
+            self.moving,
+            preset="rigid",
+            use_masks=True,
+            fixed_mask=self.mask,
+        )
+
+
+class PointSetRegistration:
+    params = SHAPES
+    param_names = ["shape"]
+    timeout = 600
+
+    def setup(self, shape):
+        self.fixed, self.moving = image_layers(shape)
+        self.directory = tempfile.TemporaryDirectory()
+        self.fixed_point_set, self.moving_point_set = write_point_sets(
+            shape, self.directory.name
+        )
+
+    def teardown(self, shape):
+        self.directory.cleanup()
+
+    def time_point_set_registration(self, shape):
+        register(
+            self.fixed,
+            self.moving,
+            preset="rigid",
+            use_corresponding_points=True,
+            fixed_point_set=self.fixed_point_set,
+            moving_point_set=self.moving_point_set,
+        )
@@ -0,0 +1,74 @@
+"""
+Scaling of registration and transformix with the number of threads, from one
+thread up to all cores, and the throughput of a batch of registrations that
+divides the cores over one or more processes.
+"""
+import tempfile
+
+import numpy as np
+
+from elastix_napari import elastix_registration, transformix_widget
+from elastix_napari.batch import batch_registration
+from elastix_napari.conversion import image_view_from_layer
+from elastix_napari.engine import create_parameter_object
+from elastix_napari.threads import available_cores
+
+from ._data import image_layers, write_transform
+
+CORES = available_cores()
+THREADS = sorted({2**power for power in range(CORES.bit_length())} | {CORES})
+SHAPE = (64, 64, 64)
+BATCH_SIZE = 4
+MAX_ITERATIONS = 64
+
+
+class ThreadScaling:
+    params = THREADS
+    param_names = ["threads"]
+    timeout = 600
+
+    def setup(self, threads):
+        self.fixed, self.moving = image_layers(SHAPE)
+        self.directory = tempfile.TemporaryDirectory()
+        self.transform_file = write_transform("bspline", SHAPE, self.directory.name)
+
+    def teardown(self, threads):
+        self.directory.cleanup()
+
+    def time_registration(self, threads):
+        elastix_registration.elastix_registration()(
+            self.fixed,
+            self.moving,
+            preset="bspline",
+            advanced=True,
+            max_iterations=MAX_ITERATIONS,
+            use_cache=False,
+            number_of_threads=threads,
+        )
+
+    def time_transformix(self, threads):
+        result = transformix_widget.create_transformix_widget()(
+            image=self.moving,
+            transform_file=self.transform_file,
+            number_of_threads=threads,
+        )
+        np.asarray(result.data)
+
+
+class BatchThroughput:
+    params = [workers for workers in (1, 2, BATCH_SIZE) if workers <= CORES] or [1]
+    param_names = ["max_workers"]
+    timeout = 1200
+
+    def setup(self, max_workers):
+        fixed, moving = image_layers(SHAPE)
+        self.fixed = image_view_from_layer(fixed, np.float32)
+        self.moving = [image_view_from_layer(moving, np.float32)] * BATCH_SIZE
+        self.parameter_object = create_parameter_object(
+            "rigid", advanced=True, max_iterations=MAX_ITERATIONS
+        )
+
+    def time_batch_registration(self, max_workers):
+        batch_registration(
+            self.fixed, self.moving, self.parameter_object, max_workers=max_workers
+        )
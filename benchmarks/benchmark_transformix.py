@@ -0,0 +1,90 @@
+"""
+Wall time and peak memory of transformix through the transformix widget,
+resampling the whole image at once, block by block in parallel (tiled), or
+block by block on demand (lazy, computed completely here).
+"""
+import tempfile
+
+import numpy as np
+
+from elastix_napari import transformix_widget
+
+from ._data import SHAPES_2D, SHAPES_3D, image_layers, write_transform
+
+MODES = ["whole", "tiled", "lazy"]
+SHAPES = SHAPES_2D + SHAPES_3D[:2]
+
+
+class Transformix:
+    params = (["rigid", "bspline"], MODES, SHAPES)
+    param_names = ["transform", "mode", "shape"]
+    timeout = 600
+
+    def setup(self, transform, mode, shape):
+        _, self.moving = image_layers(shape)
+        self.directory = tempfile.TemporaryDirectory()
+        self.transform_file = write_transform(
+            transform, shape, self.directory.name
+        )
+
+    def teardown(self, transform, mode, shape):
+        self.directory.cleanup()
+
+    def _transform(self, mode):
+        result = transformix_widget.create_transformix_widget()(
+            image=self.moving,
+            transform_file=self.transform_file,
+            tiled=mode == "tiled",
+            lazy_output=mode == "lazy",
+        )
+        return np.asarray(result.data)
+
+    def time_transformix(self, transform, mode, shape):
+        self._transform(mode)
+
+    def peakmem_transformix(self, transform, mode, shape):
+        self._transform(mode)
+
+
+class TiledBSplineTransformix:
+    """
+    Peak memory of a B-spline transform of a 256^3 image, resampled as a
+    whole, or in blocks of 64^3, two at a time. transformix only computes the
+    B-spline coefficients of the footprint of each block, so that tiling
+    needs less memory than the coefficients of the whole input.
+    """
+
+    params = ["whole", "tiled"]
+    param_names = ["mode"]
+    timeout = 600
+    shape = (256, 256, 256)
+
+    def setup(self, mode):
+        import itk
+
+        _, moving = image_layers(self.shape)
+        self.image = itk.image_view_from_array(moving.data)
+        self.directory = tempfile.TemporaryDirectory()
+        self.parameter_object = itk.ParameterObject.New()
+        self.parameter_object.ReadParameterFile(
+            str(write_transform("bspline", self.shape, self.directory.name))
+        )
+
+    def teardown(self, mode):
+        self.directory.cleanup()
+
+    def _transform(self, mode):
+        import itk
+        from elastix_napari.tiling import tiled_transformix
+
+        if mode == "whole":
+            return itk.transformix_filter(self.image, self.parameter_object)
+        return tiled_transformix(
+            self.image, self.parameter_object, block_size=64, max_workers=2
+        )
+
+    def time_transformix(self, mode):
+        self._transform(mode)
+
+    def peakmem_transformix(self, mode):
+        self._transform(mode)
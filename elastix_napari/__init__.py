@@ -1,3 +1,13 @@
+"""
+napari plugin to register images with elastix and transform them with
+transformix.
+
+Only the widget modules import napari; the modules that register and
+transform images do not, so that worker processes start quickly, and they
+can be used on headless servers. The widgets only import ITK and elastix
+when they run, as loading them takes seconds, and start loading them in the
+background when they are created (see workers.preload_in_background).
+"""
 __author__ = "Niels Dekker"
 __email__ = "N.Dekker@lumc.nl"
 
@@ -0,0 +1,250 @@
+"""Registers many moving images to one fixed image in a process pool."""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Iterator, List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+import itk
+
+from elastix_napari.processes import (
+    CANCEL_POLL_INTERVAL,
+    call_in_process,
+    process_pool,
+    worker_state,
+)
+from elastix_napari.threads import threads_per_worker
+
+
+class BatchResult(NamedTuple):
+    index: int
+    name: str
+    result_image: "itk.Image"
+    result_transform_parameters: "itk.ParameterObject"
+    elapsed: float
+    error: str
+
+
+def parameter_object_to_dicts(parameter_object: "itk.ParameterObject") -> List[dict]:
+    """
+    Converts a parameter object to a list of plain dictionaries, which can be
+    sent to other processes.
+    """
+    parameter_maps = []
+    for index in range(parameter_object.GetNumberOfParameterMaps()):
+        parameter_map = parameter_object.GetParameterMap(index)
+        parameter_maps.append(
+            {key: list(parameter_map[key]) for key in parameter_map.keys()}
+        )
+    return parameter_maps
+
+
+def parameter_object_from_dicts(parameter_maps: List[dict]) -> "itk.ParameterObject":
+    parameter_object = itk.ParameterObject.New()
+    for parameter_map in parameter_maps:
+        parameter_object.AddParameterMap(parameter_map)
+    return parameter_object
+
+
+def arguments_to_dicts(kwargs: dict) -> dict:
+    """
+    Converts the images, parameter objects and point containers among the
+    keyword arguments of itk.elastix_registration_method to plain values,
+    which can be sent to other processes (see arguments_from_dicts).
+    """
+    converted = {}
+    for key, value in kwargs.items():
+        if isinstance(value, itk.ImageBase):
+            value = {"image": itk.dict_from_image(value)}
+        elif isinstance(value, itk.ParameterObject):
+            value = {"parameter_maps": parameter_object_to_dicts(value)}
+        elif key in ("fixed_points", "moving_points"):
+            value = {"points": itk.array_from_vector_container(value)}
+        converted[key] = value
+    return converted
+
+
+def arguments_from_dicts(kwargs: dict) -> dict:
+    converted = {}
+    for key, value in kwargs.items():
+        if isinstance(value, dict) and "image" in value:
+            value = itk.image_from_dict(value["image"])
+        elif isinstance(value, dict) and "parameter_maps" in value:
+            value = parameter_object_from_dicts(value["parameter_maps"])
+        elif isinstance(value, dict) and "points" in value:
+            points = np.asarray(value["points"], np.float32)
+            point_set = itk.PointSet[itk.F, points.shape[1]].New()
+            point_set.SetPoints(itk.vector_container_from_array(points.ravel()))
+            value = point_set.GetPoints()
+        converted[key] = value
+    return converted
+
+
+def _register_arguments(images, kwargs):
+    images = [itk.image_from_dict(image) for image in images]
+    kwargs = arguments_from_dicts(kwargs)
+    result_image, result_transform_parameters = itk.elastix_registration_method(
+        *images, **kwargs
+    )
+    parameter_object = kwargs["parameter_object"]
+    last = parameter_object.GetNumberOfParameterMaps() - 1
+    if parameter_object.HasParameter(
+        last, "WriteResultImage"
+    ) and parameter_object.GetParameter(last, "WriteResultImage") == ("false",):
+        # elastix then does not resample the result image either, so it is
+        # resampled in memory, with a transform that writes its result image
+        result_transform_parameters.SetParameter("WriteResultImage", "true")
+        result_image = itk.transformix_filter(
+            images[1],
+            result_transform_parameters,
+            log_to_console=False,
+            number_of_work_units=kwargs.get("number_of_threads", 0),
+        )
+    return (
+        itk.dict_from_image(result_image),
+        parameter_object_to_dicts(result_transform_parameters),
+    )
+
+
+def registration_in_process(
+    *args, cancelled: threading.Event = None, **kwargs
+) -> Tuple["itk.Image", "itk.ParameterObject"]:
+    """
+    Runs itk.elastix_registration_method in a new process, which is
+    terminated when `cancelled` is set (see processes.call_in_process), so
+    that a cancelled registration stops using the cores right away. When the
+    last parameter map has WriteResultImage "false", the result image is
+    resampled without writing it to the output directory.
+    """
+    result_image, result_maps = call_in_process(
+        _register_arguments,
+        [itk.dict_from_image(image) for image in args],
+        arguments_to_dicts(kwargs),
+        cancelled=cancelled,
+    )
+    return itk.image_from_dict(result_image), parameter_object_from_dicts(result_maps)
+
+
+def _default_name(moving_image, index: int) -> str:
+    if isinstance(moving_image, (str, os.PathLike)):
+        return os.path.basename(os.fspath(moving_image))
+    return f"moving image {index}"
+
+
+def _worker_state(fixed_image, fixed_mask, parameter_maps) -> dict:
+    return {
+        "fixed_image": itk.image_from_dict(fixed_image),
+        "fixed_mask": itk.image_from_dict(fixed_mask) if fixed_mask else None,
+        "parameter_object": parameter_object_from_dicts(parameter_maps),
+    }
+
+
+def _register(index, name, moving_image, kwargs):
+    start = time.perf_counter()
+    try:
+        if isinstance(moving_image, (str, os.PathLike)):
+            moving_image = itk.imread(str(moving_image), itk.F)
+        else:
+            moving_image = itk.image_from_dict(moving_image).astype(itk.F)
+
+        if worker_state["fixed_mask"] is not None:
+            kwargs = dict(kwargs, fixed_mask=worker_state["fixed_mask"])
+
+        result_image, result_transform_parameters = itk.elastix_registration_method(
+            worker_state["fixed_image"],
+            moving_image,
+            parameter_object=worker_state["parameter_object"],
+            **kwargs,
+        )
+        return (
+            index,
+            name,
+            itk.dict_from_image(result_image),
+            parameter_object_to_dicts(result_transform_parameters),
+            time.perf_counter() - start,
+            None,
+        )
+    except Exception as error:
+        return index, name, None, None, time.perf_counter() - start, str(error)
+
+
+def iter_batch_registration(
+    fixed_image: "itk.Image",
+    moving_images: Sequence[Union["itk.Image", str, os.PathLike]],
+    parameter_object: "itk.ParameterObject",
+    fixed_mask: "itk.Image" = None,
+    names: Sequence[str] = None,
+    max_workers: int = None,
+    cancelled: threading.Event = None,
+    **kwargs,
+) -> Iterator[BatchResult]:
+    """
+    Registers each of the moving images (or image files) to the fixed image,
+    using up to `max_workers` processes. Yields a BatchResult per job, in the
+    order in which the jobs finish. A failing job does not stop the batch;
+    its error message is stored in the result instead. When `cancelled` is
+    set, or the generator is closed, the jobs that have not started are
+    cancelled, and no more results are yielded. Additional keyword arguments
+    are passed to itk.elastix_registration_method. Unless `number_of_threads`
+    is passed, the processes share the cores equally. At most two jobs per
+    process are submitted ahead, so that only their moving images are copied.
+    """
+    if names is None:
+        names = [
+            _default_name(moving_image, index)
+            for index, moving_image in enumerate(moving_images)
+        ]
+    kwargs.setdefault("log_to_console", False)
+    workers = min(max_workers or os.cpu_count() or 1, max(len(moving_images), 1))
+    kwargs.setdefault("number_of_threads", threads_per_worker(workers))
+
+    fixed_image = itk.dict_from_image(fixed_image.astype(itk.F))
+    if fixed_mask is not None:
+        fixed_mask = itk.dict_from_image(fixed_mask.astype(itk.UC))
+
+    with process_pool(
+        workers,
+        _worker_state,
+        (fixed_image, fixed_mask, parameter_object_to_dicts(parameter_object)),
+    ) as executor:
+        jobs = list(enumerate(zip(names, moving_images)))
+        jobs.reverse()
+        pending = set()
+        try:
+            while jobs or pending:
+                # Images are only copied for the jobs that are about to run
+                while jobs and len(pending) < 2 * workers:
+                    index, (name, moving_image) = jobs.pop()
+                    if not isinstance(moving_image, (str, os.PathLike)):
+                        moving_image = itk.dict_from_image(moving_image)
+                    pending.add(
+                        executor.submit(_register, index, name, moving_image, kwargs)
+                    )
+                done, pending = wait(
+                    pending, CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                if cancelled is not None and cancelled.is_set():
+                    return
+                for future in done:
+                    index, name, result_image, result_maps, elapsed, error = (
+                        future.result()
+                    )
+                    if error is None:
+                        result_image = itk.image_from_dict(result_image)
+                        result_maps = parameter_object_from_dicts(result_maps)
+                    yield BatchResult(
+                        index, name, result_image, result_maps, elapsed, error
+                    )
+        finally:
+            # Only wait for the jobs that are running, which elastix cannot
+            # interrupt
+            executor.shutdown(cancel_futures=True)
+
+
+def batch_registration(*args, **kwargs) -> List[BatchResult]:
+    """
+    Like iter_batch_registration, but returns the results of all jobs in the
+    order of the moving images.
+    """
+    return sorted(iter_batch_registration(*args, **kwargs), key=lambda r: r.index)
@@ -0,0 +1,167 @@
+import os
+import threading
+from typing import TYPE_CHECKING, List
+from magicgui import magic_factory
+import numpy as np
+from pathlib import Path
+
+# For IDE type support and autocompletion
+# https://napari.org/stable/plugins/building_a_plugin/best_practices.html#don-t-require-napari-if-not-necessary
+if TYPE_CHECKING:
+    import napari
+
+from napari.utils import notifications
+from magicgui.widgets import ProgressBar, PushButton
+from elastix_napari.transforms import transform_registry
+from elastix_napari.workers import (
+    add_progress_listener,
+    cancel_workers,
+    preload_in_background,
+    remove_progress_listener,
+    start_worker,
+)
+
+
+def on_init(widget):
+    """
+    Initializes widget layout.
+    Updates widget layout according to user input.
+    """
+    widget.native.setStyleSheet("QWidget{font-size: 12pt;}")
+
+    widget.parameterfile.visible = False
+
+    @widget.preset.changed.connect
+    def on_preset_changed(value):
+        widget.parameterfile.visible = value == "custom"
+
+    cancel_button = PushButton(text="cancel")
+    cancel_button.tooltip = "Cancel the batches that are still running"
+    cancel_button.changed.connect(lambda: cancel_workers("batch"))
+    widget.append(cancel_button)
+
+    progress_bar = ProgressBar(value=0, min=0, max=1, label="finished jobs")
+    progress_bar.visible = False
+    widget.append(progress_bar)
+
+    def on_progress(progress):
+        finished, total = progress
+        progress_bar.visible = True
+        progress_bar.max = max(total, 1)
+        progress_bar.value = finished
+
+    add_progress_listener("batch", on_progress)
+    widget.native.destroyed.connect(
+        lambda: remove_progress_listener("batch", on_progress)
+    )
+
+    widget.native.layout().addStretch()
+
+    preload_in_background()
+
+
+@magic_factory(
+    widget_init=on_init,
+    layout="vertical",
+    call_button="register all",
+    preset={
+        "choices": ["translation", "rigid", "affine", "bspline", "custom"],
+        "tooltip": "Select a preset parameter file or select "
+        "the 'custom' option to load a custom one",
+    },
+    moving_files={
+        "mode": "rm",
+        "filter": "*.mha;*.mhd;*.nii;*.nii.gz;*.nrrd;*.tif;*.tiff",
+        "tooltip": "Optionally select moving image files to register as well",
+    },
+    parameterfile={
+        "filter": "*.txt;*.toml",
+        "tooltip": "Load a custom parameter file",
+    },
+    max_workers={
+        "min": 1,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of registrations that run at the same time",
+    },
+)
+def elastix_batch_registration(
+    fixed_image: "napari.layers.Image" = None,
+    moving_images: List["napari.layers.Image"] = (),
+    moving_files: List[Path] = (),
+    preset: str = "rigid",
+    parameterfile: Path = "",
+    max_workers: int = 2,
+    viewer: "napari.viewer.Viewer" = None,
+):
+    """
+    Registers each of the moving images to the fixed image, running several
+    registrations in parallel. Failing registrations are reported, without
+    stopping the others.
+    """
+    if fixed_image is None or (not moving_images and not moving_files):
+        notifications.show_error("No images selected for registration.")
+        return None
+
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.batch import iter_batch_registration
+    from elastix_napari.conversion import image_view_from_layer
+    from elastix_napari.engine import create_parameter_object
+
+    try:
+        parameter_object = create_parameter_object(preset, [parameterfile])
+    except ValueError:
+        notifications.show_error("Parameter file not found or not valid")
+        return None
+
+    names = [layer.name for layer in moving_images] + [
+        Path(path).name for path in moving_files
+    ]
+    jobs = [
+        image_view_from_layer(layer, np.float32) for layer in moving_images
+    ] + [str(path) for path in moving_files]
+    fixed = image_view_from_layer(fixed_image, np.float32)
+    finished = []
+    cancelled = threading.Event()
+
+    def register():
+        layers = []
+        for result in iter_batch_registration(
+            fixed,
+            jobs,
+            parameter_object,
+            names=names,
+            max_workers=max_workers,
+            cancelled=cancelled,
+        ):
+            finished.append(result)
+            if result.error is not None:
+                notifications.show_warning(
+                    f"Registration of {result.name} failed after "
+                    f"{result.elapsed:.1f} s: {result.error}"
+                )
+                continue
+            layer = image_layer_from_image(result.result_image)
+            layer.name = f"{result.name} {preset} Registration"
+            layer.metadata["elapsed"] = result.elapsed
+            layer.metadata["transform"] = transform_registry.add(
+                layer.name, result.result_transform_parameters
+            )
+            layers.append(layer)
+
+        notifications.show_info(
+            f"Registered {len(layers)} of {len(jobs)} images in "
+            f"{sum(result.elapsed for result in finished):.1f} s of job time"
+        )
+        return layers
+
+    if viewer is None:
+        return register()
+
+    start_worker(
+        viewer,
+        register,
+        "batch",
+        monitor=lambda: (len(finished), len(jobs)),
+        cancelled=cancelled,
+    )
+    return None
@@ -0,0 +1,159 @@
+"""Caches registration results, keyed on the content of the inputs."""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_from_dicts, parameter_object_to_dicts
+
+DEFAULT_MAX_BYTES = 1024**3
+
+# Arguments of itk.elastix_registration_method that do not affect the result
+_UNKEYED_ARGUMENTS = ["output_directory", "log_to_console", "log_to_file"]
+
+
+def _update_with_array(digest, array: np.ndarray):
+    array = np.ascontiguousarray(array)
+    digest.update(str((array.dtype.str, array.shape)).encode())
+    digest.update(memoryview(array).cast("B"))
+
+
+def content_hash(*inputs) -> str:
+    """
+    Returns a hash of the inputs, which may be ITK images, parameter objects,
+    NumPy arrays, paths (hashed by file content), strings, numbers or None.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for value in inputs:
+        digest.update(type(value).__name__.encode())
+        if value is None:
+            continue
+        if isinstance(value, itk.ParameterObject):
+            digest.update(
+                json.dumps(parameter_object_to_dicts(value), sort_keys=True).encode()
+            )
+        elif isinstance(value, np.ndarray):
+            _update_with_array(digest, value)
+        elif isinstance(value, os.PathLike):
+            digest.update(Path(value).read_bytes())
+        elif isinstance(value, (str, int, float, bool)):
+            digest.update(repr(value).encode())
+        else:
+            # An itk.Image: hash the pixels and the geometry
+            _update_with_array(digest, itk.array_view_from_image(value))
+            for key in ("spacing", "origin", "direction"):
+                _update_with_array(digest, np.asarray(value[key], np.float64))
+    return digest.hexdigest()
+
+
+def registration_key(*args, **kwargs) -> str:
+    """
+    Returns the cache key of a call to itk.elastix_registration_method with
+    the given arguments. Files passed by name are hashed by their content.
+    Where the output and the log go does not affect the key.
+    """
+    inputs = list(args)
+    for name in sorted(kwargs):
+        if name in _UNKEYED_ARGUMENTS:
+            continue
+        value = kwargs[name]
+        if name.endswith("_file_name"):
+            value = Path(value)
+        elif name.endswith("_points"):
+            value = itk.array_from_vector_container(value)
+        inputs += [name, value]
+    return content_hash(*inputs)
+
+
+class RegistrationCache:
+    """
+    Least recently used cache of result images and transform parameters.
+    When `directory` is set, results are also stored there and read back
+    when they are no longer in memory.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, directory: Path = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries or (
+            self.directory is not None
+            and (Path(self.directory) / f"{key}.json").exists()
+        )
+
+    def get(self, key: str) -> Tuple["itk.Image", "itk.ParameterObject"]:
+        """
+        Returns the result image and transform parameters stored for `key`,
+        or None.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                result_image, parameter_maps, _ = self._entries[key]
+                return result_image, parameter_object_from_dicts(parameter_maps)
+
+        if self.directory is None:
+            return None
+        image_path = Path(self.directory) / f"{key}.mha"
+        parameters_path = Path(self.directory) / f"{key}.json"
+        if not image_path.exists() or not parameters_path.exists():
+            return None
+        result_image = itk.imread(str(image_path))
+        parameter_maps = json.loads(parameters_path.read_text())
+        self._add_to_memory(key, result_image, parameter_maps)
+        return result_image, parameter_object_from_dicts(parameter_maps)
+
+    def put(
+        self,
+        key: str,
+        result_image: "itk.Image",
+        result_transform_parameters: "itk.ParameterObject",
+    ):
+        parameter_maps = parameter_object_to_dicts(result_transform_parameters)
+        self._add_to_memory(key, result_image, parameter_maps)
+
+        if self.directory is not None:
+            directory = Path(self.directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            itk.imwrite(result_image, str(directory / f"{key}.mha"))
+            # Write the parameters last, as their presence marks a complete
+            # entry
+            (directory / f"{key}.json").write_text(json.dumps(parameter_maps))
+
+    def clear(self):
+        """
+        Removes all results from memory. Results on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _add_to_memory(self, key, result_image, parameter_maps):
+        size = itk.array_view_from_image(result_image).nbytes
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (result_image, parameter_maps, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+
+# Cache used by the registration widget
+registration_cache = RegistrationCache()
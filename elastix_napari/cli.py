@@ -0,0 +1,102 @@
+"""Command line entry point to run registrations without napari."""
+import argparse
+import sys
+
+from elastix_napari.engine import PRESETS, iter_jobs, read_manifest, write_metrics
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="elastix-napari-register",
+        description="Register images with elastix, without starting napari.",
+    )
+    parser.add_argument(
+        "manifest", nargs="?", help="CSV or JSON file with one registration per job"
+    )
+    parser.add_argument("--fixed", help="Fixed image file of a single job")
+    parser.add_argument("--moving", help="Moving image file of a single job")
+    parser.add_argument("--output", help="Result image file of a single job")
+    parser.add_argument(
+        "--output-directory", help="Directory for the transform parameter files"
+    )
+    parser.add_argument(
+        "--preset", choices=PRESETS + ["custom"], default="rigid"
+    )
+    parser.add_argument(
+        "--parameter-file",
+        action="append",
+        dest="parameter_files",
+        default=[],
+        help="Parameter file of the custom preset, may be repeated",
+    )
+    parser.add_argument("--fixed-mask")
+    parser.add_argument("--moving-mask")
+    parser.add_argument("--initial-transform")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Number of registrations that run at the same time",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        dest="number_of_threads",
+        help="Number of threads per registration, by default the cores are "
+        "divided over the registrations that run at the same time",
+    )
+    parser.add_argument(
+        "--metrics",
+        dest="metrics_file",
+        help="CSV file for the image similarity and target registration error "
+        "of each registration",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    """
+    Runs the registrations and returns the exit code, which is 1 when any of
+    them failed.
+    """
+    parser = _parser()
+    arguments = parser.parse_args(argv)
+
+    if arguments.manifest:
+        jobs = read_manifest(arguments.manifest)
+        if arguments.number_of_threads is not None:
+            for job in jobs:
+                job.setdefault("number_of_threads", arguments.number_of_threads)
+        if arguments.metrics_file:
+            for job in jobs:
+                job["compute_metrics"] = True
+    elif arguments.fixed and arguments.moving and arguments.output:
+        job = {
+            key: value
+            for key, value in vars(arguments).items()
+            if value is not None
+            and key not in ("manifest", "max_workers", "metrics_file")
+        }
+        job["compute_metrics"] = bool(arguments.metrics_file)
+        jobs = [job]
+    else:
+        parser.error("Specify a manifest, or --fixed, --moving and --output")
+
+    failed = 0
+    results = []
+    for result in iter_jobs(jobs, arguments.max_workers):
+        results.append(result)
+        if result.error is None:
+            print(f"{result.name}: {result.output} ({result.elapsed:.1f} s)")
+        else:
+            failed += 1
+            print(f"{result.name}: failed: {result.error}", file=sys.stderr)
+    if arguments.metrics_file:
+        results.sort(key=lambda result: result.index)
+        write_metrics(results, arguments.metrics_file)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
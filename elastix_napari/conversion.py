@@ -0,0 +1,228 @@
+"""Converts napari layer data to ITK images with few full-size copies."""
+import itertools
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import itk
+
+# Maximum number of bytes of the input that is cast at once
+CHUNK_BYTES = 64 * 1024**2
+
+
+def cast_array(data, dtype) -> np.ndarray:
+    """
+    Returns `data` as a C-contiguous NumPy array of `dtype`. Returns `data`
+    itself when no conversion is needed, and otherwise casts it slab by slab
+    into a newly allocated array.
+    """
+    dtype = np.dtype(dtype)
+    if (
+        isinstance(data, np.ndarray)
+        and data.dtype == dtype
+        and data.flags.c_contiguous
+    ):
+        return data
+    if (
+        isinstance(data, np.ndarray)
+        and data.dtype == np.bool_
+        and dtype == np.uint8
+        and data.flags.c_contiguous
+    ):
+        # A boolean mask has the same memory layout as a binary uint8 image
+        return data.view(np.uint8)
+
+    result = np.empty(data.shape, dtype)
+    if result.ndim == 0 or result.size == 0:
+        result[...] = np.asarray(data)
+        return result
+
+    slab_bytes = max(result[0].size * np.dtype(data.dtype).itemsize, 1)
+    step = max(CHUNK_BYTES // slab_bytes, 1)
+    for start in range(0, result.shape[0], step):
+        result[start : start + step] = np.asarray(data[start : start + step])
+    return result
+
+
+def _image_view_from_array(data, dtype, scale, translate, rotate) -> "itk.Image":
+    image = itk.image_view_from_array(cast_array(data, dtype))
+    if scale is not None:
+        image["spacing"] = np.asarray(scale, np.float64)
+    if translate is not None:
+        image["origin"] = np.asarray(translate, np.float64)
+    if rotate is not None:
+        image["direction"] = np.ascontiguousarray(np.transpose(rotate)).astype(
+            np.float64
+        )
+    return image
+
+
+def _level_factors(layer, level: int) -> np.ndarray:
+    # Downsampling factors of a level of a multiscale layer, per axis
+    full_shape = np.asarray(layer.data[0].shape, float)
+    return full_shape / np.asarray(layer.data[level].shape)
+
+
+def image_view_from_layer(
+    layer, dtype=np.float32, level: int = 0, region=None, frame: int = None
+) -> "itk.Image":
+    """
+    Converts an image layer to an ITK image of `dtype`, sharing the memory
+    of the layer data when possible. The spacing, origin and direction are
+    taken from the layer, as in itk_napari_conversion.image_from_image_layer.
+
+    Of a multiscale layer, only the pyramid `level` is converted (or the
+    coarsest level, when there are fewer levels). `region` optionally
+    restricts the conversion to a (start, stop) pixel range per axis of that
+    level, so that only this part of lazy (dask or zarr) data is read.
+    Of a time series, only the `frame` (an index of the first axis) is
+    converted.
+    """
+    if layer.multiscale:
+        level = min(level, len(layer.data) - 1)
+        data = layer.data[level]
+        factors = _level_factors(layer, level)
+    else:
+        data = layer.data
+        factors = np.ones(data.ndim)
+    scale = np.asarray(layer.scale, float) * factors
+    translate = np.asarray(layer.translate, float)
+    rotate = np.asarray(layer.rotate, float)
+    if frame is not None:
+        data = data[frame]
+        scale, translate, rotate = scale[1:], translate[1:], rotate[1:, 1:]
+
+    if region is not None:
+        start = np.asarray([start for start, _ in region], float)
+        data = data[tuple(slice(start, stop) for start, stop in region)]
+        translate = translate + rotate @ (start * scale)
+    return _image_view_from_array(data, dtype, scale, translate, rotate)
+
+
+def region_from_world_box(
+    layer, box, margin: int = 0, level: int = 0
+) -> List[Tuple[int, int]]:
+    """
+    Returns the region of image_view_from_layer that contains the pixels of
+    a layer (or of a level of a multiscale layer) in a box of world (physical)
+    coordinates, with `margin` pixels around it. The box has a row of lower
+    and a row of upper bounds, of the last axes of the layer; the other axes
+    are not restricted. Raises ValueError when the box is outside the layer.
+    """
+    if layer.multiscale:
+        level = min(level, len(layer.data) - 1)
+        shape = np.asarray(layer.data[level].shape)
+        factors = _level_factors(layer, level)
+    else:
+        shape = np.asarray(layer.data.shape)
+        factors = np.ones(len(shape))
+    scale = np.asarray(layer.scale, float) * factors
+    translate = np.asarray(layer.translate, float)
+    rotate = np.asarray(layer.rotate, float)
+
+    def corners(lower, upper):
+        return np.array(list(itertools.product(*zip(lower, upper))), float)
+
+    # The world bounding box of the layer, of which pixels extend half a pixel
+    # around their centers
+    pixel_corners = corners(np.full(len(shape), -0.5), shape - 0.5)
+    layer_corners = (pixel_corners * scale) @ rotate.T + translate
+    lower, upper = layer_corners.min(axis=0), layer_corners.max(axis=0)
+    box = np.asarray(box, float)
+    axes = min(len(shape), box.shape[1])
+    lower[-axes:] = np.maximum(lower[-axes:], box[0, -axes:])
+    upper[-axes:] = np.minimum(upper[-axes:], box[1, -axes:])
+
+    # The continuous pixel indices of the corners of the box
+    indices = ((corners(lower, upper) - translate) @ rotate) / scale
+    start = np.floor(indices.min(axis=0) + 0.5).astype(int) - margin
+    stop = np.floor(indices.max(axis=0) + 0.5).astype(int) + 1 + margin
+    start, stop = np.maximum(start, 0), np.minimum(stop, shape)
+    if np.any(lower > upper) or np.any(start >= stop):
+        raise ValueError(f"The region of interest is outside {layer.name}")
+    return [(int(first), int(last)) for first, last in zip(start, stop)]
+
+
+def downsampled_image_view_from_layer(
+    layer, shrink_factor: int, dtype=np.float32
+) -> "itk.Image":
+    """
+    Converts an image layer to an ITK image that is downsampled by about
+    `shrink_factor` along each axis, without converting the full resolution
+    data. Of a multiscale layer, the coarsest level that is not downsampled
+    by more than `shrink_factor` is used. Other layers are subsampled by
+    taking every `shrink_factor`-th pixel.
+    """
+    if layer.multiscale:
+        level = 0
+        for index in range(len(layer.data)):
+            if np.max(_level_factors(layer, index)) <= shrink_factor:
+                level = index
+        return image_view_from_layer(layer, dtype, level)
+
+    data = layer.data[(slice(None, None, shrink_factor),) * layer.data.ndim]
+    scale = np.asarray(layer.scale, float) * shrink_factor
+    return _image_view_from_array(data, dtype, scale, layer.translate, layer.rotate)
+
+
+def downsampled_image_view(image: "itk.Image", shrink_factor: int, dtype=np.float32):
+    """
+    Like downsampled_image_view_from_layer, for an ITK image.
+    """
+    data = itk.array_view_from_image(image)
+    data = data[(slice(None, None, shrink_factor),) * data.ndim]
+    scale = np.asarray(image["spacing"], float) * shrink_factor
+    rotate = np.transpose(image["direction"])
+    return _image_view_from_array(data, dtype, scale, image["origin"], rotate)
+
+
+def _memory_map(file_name: os.PathLike) -> np.ndarray:
+    # Returns a read-only memory map of the data of the file, or None when the
+    # file cannot be memory mapped
+    suffix = Path(file_name).suffix.lower()
+    if suffix == ".npy":
+        return np.load(file_name, mmap_mode="r")
+    if suffix in (".tif", ".tiff"):
+        try:
+            import tifffile
+
+            return tifffile.memmap(file_name, mode="r")
+        except (ImportError, ValueError):
+            # Compressed or tiled TIFF files are read by ITK
+            return None
+    return None
+
+
+def image_view_from_file(file_name: os.PathLike, dtype=np.float32) -> "itk.Image":
+    """
+    Reads an image file as an ITK image of `dtype`, without a napari layer.
+    NumPy (.npy) and uncompressed TIFF files are memory mapped, and are not
+    copied when they have the requested type; they have unit spacing. Other
+    files (mha, nrrd, nii, ...) are read by ITK.
+    """
+    data = _memory_map(file_name)
+    if data is not None:
+        return _image_view_from_array(data, dtype, None, None, None)
+    pixel_types = {np.dtype(np.float32): itk.F, np.dtype(np.uint8): itk.UC}
+    return itk.imread(os.fspath(file_name), pixel_types[np.dtype(dtype)])
+
+
+def memory_mapped_image(image: "itk.Image", file_name: os.PathLike) -> "itk.Image":
+    """
+    Writes an ITK image to a NumPy (.npy) file, and returns a view of the
+    read-only memory map of the file, with the metadata of `image`. Layers of
+    this view only keep the pixels in memory that were read recently.
+    """
+    data = itk.array_view_from_image(image)
+    output = np.lib.format.open_memmap(
+        file_name, mode="w+", dtype=data.dtype, shape=data.shape
+    )
+    output[...] = data
+    output.flush()
+    del output
+    view = itk.image_view_from_array(np.load(file_name, mmap_mode="r"))
+    view["spacing"] = image["spacing"]
+    view["origin"] = image["origin"]
+    view["direction"] = image["direction"]
+    return view
@@ -1,19 +1,426 @@
-from typing import TYPE_CHECKING
+import os
+import threading
+from typing import TYPE_CHECKING, List, Tuple, Union
 from magicgui import magic_factory
-import itk
+import numpy as np
+import tempfile
 from pathlib import Path
-from itk_napari_conversion import (
-    image_from_image_layer,
-    image_layer_from_image,
-    point_set_from_points_layer,
-)
 
 # For IDE type support and autocompletion
 # https://napari.org/stable/plugins/building_a_plugin/best_practices.html#don-t-require-napari-if-not-necessary
 if TYPE_CHECKING:
     import napari
+    import itk
 
+from napari.layers import Image, Labels, Shapes
 from napari.utils import notifications
+from magicgui.widgets import Label, ProgressBar, PushButton
+from elastix_napari.job_queue_widget import add_queue_button
+from elastix_napari.workers import (
+    add_progress_listener,
+    cancel_workers,
+    preload_in_background,
+    remove_progress_listener,
+    start_worker,
+)
+
+
+def preview_parameter_object(
+    parameter_object: "itk.ParameterObject", shrink_factor: int
+) -> "itk.ParameterObject":
+    """
+    Returns a copy of the parameter object for images downsampled by
+    `shrink_factor`, with correspondingly fewer resolution levels.
+    """
+    import itk
+
+    levels_to_skip = max(int(np.log2(shrink_factor)), 0)
+    result = itk.ParameterObject.New()
+    for index in range(parameter_object.GetNumberOfParameterMaps()):
+        parameter_map = parameter_object.GetParameterMap(index)
+        if "NumberOfResolutions" in parameter_map:
+            resolutions = int(parameter_map["NumberOfResolutions"][0])
+            parameter_map["NumberOfResolutions"] = [
+                str(max(resolutions - levels_to_skip, 1))
+            ]
+            # Pyramid schedules no longer match the number of resolutions
+            for key in ["FixedImagePyramidSchedule", "MovingImagePyramidSchedule"]:
+                if key in parameter_map:
+                    del parameter_map[key]
+        result.AddParameterMap(parameter_map)
+    return result
+
+
+def region_of_interest_box(
+    source: str,
+    shapes: "napari.layers.Shapes" = None,
+    viewer: "napari.viewer.Viewer" = None,
+) -> np.ndarray:
+    """
+    Returns the world (physical) bounding box of the shapes of a shapes
+    layer, or with source "current view", of the part of the scene that the
+    viewer shows, as a row of lower and a row of upper bounds. Axes that are
+    not displayed are not restricted. Raises ValueError when there is no
+    such region.
+    """
+    if source == "shapes":
+        if shapes is None or len(shapes.data) == 0:
+            raise ValueError("Draw the region of interest in a shapes layer")
+        vertices = np.concatenate(shapes.data) * np.asarray(shapes.scale)
+        world = vertices @ np.transpose(shapes.rotate) + np.asarray(shapes.translate)
+        return np.stack([world.min(axis=0), world.max(axis=0)])
+
+    if viewer is None:
+        raise ValueError("The current view is only known in a viewer")
+    if viewer.dims.ndisplay != 2:
+        raise ValueError("The current view is only a region of interest in 2D")
+    camera = viewer.scene.camera
+    # The zoom is the number of canvas pixels per world unit
+    canvas_size = np.asarray(viewer.canvas.viewbox_size(viewer.layers), float)
+    half_size = canvas_size / camera.zoom / 2
+    center = np.asarray(camera.center[-2:], float)
+    box = np.stack(
+        [np.full(viewer.dims.ndim, -np.inf), np.full(viewer.dims.ndim, np.inf)]
+    )
+    displayed = list(viewer.dims.displayed)
+    box[0, displayed] = center - half_size
+    box[1, displayed] = center + half_size
+    return box
+
+
+def current_view_shapes(viewer: "napari.viewer.Viewer") -> Shapes:
+    """
+    Returns a shapes layer of which region_of_interest_box is the current
+    view, of which the axes that are not displayed span the layers of the
+    viewer, so that the view can be registered after it changed.
+    """
+    box = region_of_interest_box("current view", viewer=viewer)
+    box = np.where(np.isfinite(box), box, viewer.layers.extent.world)
+    displayed = list(viewer.dims.displayed)
+    (top, left), (bottom, right) = box[:, displayed]
+    rectangles = []
+    # A rectangle at the lower and one at the upper bounds of the other axes
+    for bounds in box:
+        vertices = np.repeat(bounds[np.newaxis], 4, axis=0)
+        vertices[:, displayed] = [
+            [top, left], [top, right], [bottom, right], [bottom, left]
+        ]
+        rectangles.append(vertices)
+    return Shapes(rectangles, shape_type="rectangle", name="current view")
+
+
+def _resolve_current_view(kwargs: dict, viewer: "napari.viewer.Viewer") -> dict:
+    # Queued registrations register the view at the time they were queued
+    if (
+        kwargs["region_of_interest"] != "current view"
+        or kwargs["time_series"] != "off"
+    ):
+        return kwargs
+    return dict(
+        kwargs, region_of_interest="shapes", roi_shapes=current_view_shapes(viewer)
+    )
+
+
+def register_time_series(
+    layer: "napari.layers.Image",
+    parameter_object: "itk.ParameterObject",
+    mode: str,
+    reference_frame: int,
+    chain_length: int,
+    viewer: "napari.viewer.Viewer" = None,
+    name: str = "time series registration",
+    initial_transform: str = None,
+    number_of_threads: int = 0,
+) -> "napari.layers.Image":
+    """
+    Registers the frames of a time series layer (see time_series.py), and
+    returns a layer with the stacked results, of which the "transforms"
+    metadata has the name of the transform of each frame in the transform
+    registry. With a viewer, the frames are registered in the background.
+    """
+    from napari.layers import Image
+    from elastix_napari.batch import parameter_object_from_dicts
+    from elastix_napari.conversion import image_view_from_layer
+    from elastix_napari.time_series import iter_time_series
+    from elastix_napari.transforms import transform_registry
+
+    number_of_frames = layer.data.shape[0]
+    frames = [
+        image_view_from_layer(layer, np.float32, frame=index)
+        for index in range(number_of_frames)
+    ]
+    kwargs = {}
+    if initial_transform:
+        kwargs["initial_transform_parameter_file_name"] = initial_transform
+    if number_of_threads:
+        kwargs["number_of_threads"] = number_of_threads
+
+    def register():
+        result = np.empty((number_of_frames,) + frames[0].shape, np.float32)
+        transforms = [None] * number_of_frames
+        for frame in iter_time_series(
+            frames, parameter_object, mode, reference_frame, chain_length, **kwargs
+        ):
+            if frame.error is not None:
+                notifications.show_warning(
+                    f"Registration of frame {frame.index} failed: {frame.error}"
+                )
+                # Keep the unregistered frame
+                result[frame.index] = layer.data[frame.index]
+                continue
+            result[frame.index] = frame.result_image
+            transforms[frame.index] = transform_registry.add(
+                f"{name} frame {frame.index}",
+                parameter_object_from_dicts(frame.transform_parameters),
+            )
+
+        result_layer = Image(
+            result,
+            name=name,
+            scale=layer.scale,
+            translate=layer.translate,
+            rotate=layer.rotate,
+        )
+        result_layer.metadata["transforms"] = transforms
+        return result_layer
+
+    if viewer is None:
+        return register()
+    start_worker(viewer, register, "registration")
+    return None
+
+
+def _time_series_error(layer: "napari.layers.Image", reference_frame: int) -> str:
+    # Returns why a layer cannot be registered as a time series, or None
+    if layer is None or layer.multiscale or layer.ndim < 3:
+        return "Select a time series as moving image"
+    if reference_frame >= layer.data.shape[0]:
+        return "The reference frame is not in the series"
+    return None
+
+
+def _regions_of_interest(
+    fixed_layer: "napari.layers.Image",
+    moving_layer: "napari.layers.Image",
+    box: np.ndarray,
+    margin: int = 0,
+    level: int = 0,
+) -> Tuple[dict, "OutputGrid"]:
+    """
+    Returns the regions of the fixed and moving layers in a world box (see
+    region_from_world_box), by name, and the grid of the whole fixed layer,
+    to which the output grid of the result transform is extended. Raises
+    ValueError when the box is outside a layer.
+    """
+    from elastix_napari.conversion import image_view_from_layer, region_from_world_box
+    from elastix_napari.tiling import OutputGrid
+
+    regions = {
+        name: region_from_world_box(layer, box, margin, level)
+        for name, layer in [("fixed", fixed_layer), ("moving", moving_layer)]
+    }
+    # Only the first pixel of the fixed layer is converted, for its grid
+    first_pixel = image_view_from_layer(
+        fixed_layer, np.float32, level, [(0, 1)] * fixed_layer.ndim
+    )
+    shape = (
+        fixed_layer.data[min(level, len(fixed_layer.data) - 1)].shape
+        if fixed_layer.multiscale
+        else fixed_layer.data.shape
+    )
+    return regions, OutputGrid.from_image(first_pixel, shape)
+
+
+def _cache_keys(args, kwargs, preview_args=None, preview_kwargs=None) -> dict:
+    # The cache keys of the elastix run, and of its preview, by stage name
+    from elastix_napari.cache import registration_key
+
+    cache_keys = {"elastix": registration_key(*args, **kwargs)}
+    if preview_args is not None:
+        cache_keys["elastix preview"] = registration_key(
+            *preview_args, **preview_kwargs
+        )
+    return cache_keys
+
+
+def _run_elastix(
+    args,
+    kwargs,
+    stage,
+    number_of_threads: int = 0,
+    cache_key: str = None,
+    name: str = "elastix",
+    cancelled: threading.Event = None,
+) -> Tuple["itk.Image", "itk.ParameterObject"]:
+    """
+    Runs elastix, in the `stage` of a run profile, with its share of the
+    cores (see threads.py), and returns the result image and transform
+    parameters. With a `cache_key`, a cached result is returned instead, and
+    a new result is cached. With a `cancelled` event, elastix runs in a
+    process that is terminated when the event is set, which raises
+    CancelledError.
+    """
+    import itk
+    from elastix_napari.batch import registration_in_process
+    from elastix_napari.cache import registration_cache
+    from elastix_napari.threads import global_threads_kept, limit_threads
+
+    if cache_key is not None:
+        with stage("cache lookup"):
+            cached = registration_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    with stage(name), limit_threads(number_of_threads) as threads:
+        if cancelled is not None:
+            result_image, result_transform_parameters = registration_in_process(
+                *args, **kwargs, number_of_threads=threads, cancelled=cancelled
+            )
+        else:
+            with global_threads_kept():
+                result_image, result_transform_parameters = (
+                    itk.elastix_registration_method(
+                        *args, **kwargs, number_of_threads=threads
+                    )
+                )
+    if cache_key is not None:
+        with stage("cache result"):
+            registration_cache.put(
+                cache_key, result_image, result_transform_parameters
+            )
+    return result_image, result_transform_parameters
+
+
+def _add_profile(layers, run_profile, last: bool = True, output_directory=None):
+    """
+    Keeps the profile of the run so far in the metadata of its result layer
+    (or list of layers), and returns them. When the run is `last`, the
+    profile is finished, and written to `output_directory` when given.
+    """
+    if not run_profile.enabled:
+        return layers
+    if last:
+        run_profile.finish()
+        if output_directory is not None:
+            run_profile.write(output_directory)
+    profile_dict = run_profile.as_dict()
+    for layer in layers if isinstance(layers, list) else [layers]:
+        layer.metadata["profile"] = profile_dict
+    return layers
+
+
+def _register_in_background(
+    viewer: "napari.viewer.Viewer",
+    register,
+    kwargs: dict,
+    output_directory: Path = None,
+    register_preview=None,
+    preview_kwargs: dict = None,
+    refine_preview: bool = True,
+    cancelled: threading.Event = None,
+):
+    """
+    Runs `register` in the background, after `register_preview` when given
+    (and only then with `refine_preview`), and adds the results to the
+    viewer. `cancelled` is set when the run is cancelled. The progress is
+    followed in the iteration info that elastix writes to
+    `output_directory`, or to a temporary directory; the elastix arguments
+    `kwargs` and `preview_kwargs` of the runs are changed to write it there,
+    and, in a temporary directory, not to write their result image.
+    """
+    from elastix_napari.progress import (
+        enable_iteration_info,
+        read_iteration_info,
+        total_iterations,
+    )
+
+    temporary_directory = None
+    if output_directory is None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        output_directory = temporary_directory.name
+    total = 0
+    for run_kwargs in [kwargs] + ([preview_kwargs] if register_preview else []):
+        run_kwargs["output_directory"] = str(output_directory)
+        if temporary_directory is not None:
+            # Only the iteration info is read from the temporary directory
+            run_kwargs["parameter_object"].SetParameter("WriteResultImage", "false")
+        enable_iteration_info(run_kwargs["parameter_object"])
+        total += total_iterations(run_kwargs["parameter_object"])
+
+    def monitor():
+        return read_iteration_info(output_directory), total
+
+    def clean_up(_):
+        # A cancelled elastix run may still be writing, so only clean up
+        # after a run that returned
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+
+    def start_registration():
+        worker = start_worker(viewer, register, "registration", monitor, cancelled)
+        worker.returned.connect(clean_up)
+
+    if register_preview is None:
+        start_registration()
+        return
+    worker = start_worker(
+        viewer, register_preview, "registration", monitor, cancelled
+    )
+    if refine_preview:
+        worker.returned.connect(lambda _: start_registration())
+    else:
+        worker.returned.connect(clean_up)
+
+
+def add_progress_widgets(widget):
+    """
+    Adds a progress bar, the current iteration and, if matplotlib is
+    installed, a live plot of the metric value to the widget.
+    """
+    progress_bar = ProgressBar(value=0, min=0, max=1, label="progress")
+    iteration_label = Label(value="")
+    progress_bar.visible = False
+    iteration_label.visible = False
+    widget.append(progress_bar)
+    widget.append(iteration_label)
+
+    try:
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
+        from matplotlib.figure import Figure
+    except ImportError:
+        canvas = None
+    else:
+        figure = Figure(figsize=(4, 2.5), tight_layout=True)
+        axes = figure.add_subplot()
+        canvas = FigureCanvasQTAgg(figure)
+        canvas.setVisible(False)
+        widget.native.layout().addWidget(canvas)
+
+    def on_progress(progress):
+        iterations, total = progress
+        progress_bar.visible = True
+        iteration_label.visible = True
+        progress_bar.max = max(total, 1)
+        progress_bar.value = min(len(iterations), total)
+        if not iterations:
+            return
+        last = iterations[-1]
+        iteration_label.value = (
+            f"resolution {last.resolution}, iteration {last.iteration}, "
+            f"metric {last.metric:.6g}, step size {last.step_size:.4g}"
+        )
+        if canvas is not None:
+            canvas.setVisible(True)
+            axes.clear()
+            axes.plot([info.metric for info in iterations], linewidth=1)
+            axes.set_xlabel("iteration")
+            axes.set_ylabel("metric")
+            canvas.draw_idle()
+
+    add_progress_listener("registration", on_progress)
+    widget.native.destroyed.connect(
+        lambda: remove_progress_listener("registration", on_progress)
+    )
+
 
 def on_init(widget):
     """
@@ -25,6 +432,9 @@ def on_init(widget):
     for name in [
         "fixed_mask",
         "moving_mask",
+        "mask_label",
+        "roi_shapes",
+        "roi_margin",
         "parameterfile_1",
         "parameterfile_2",
         "parameterfile_3",
@@ -39,14 +449,60 @@ def on_init(widget):
         "max_step_length",
         "log_to_file",
         "output_directory",
+        "preview_shrink_factor",
+        "refine_preview",
+        "pyramid_level",
+        "time_series",
+        "reference_frame",
+        "chain_length",
+        "fixed_file",
+        "moving_file",
+        "result_file",
+        "moving_labels",
+        "number_of_threads",
+        "profile",
+        "compute_metrics",
+        "cache_directory",
     ]:
         getattr(widget, name).visible = False
 
+    def on_image_changed(value):
+        widget.pyramid_level.visible = any(
+            layer is not None and layer.multiscale
+            for layer in [widget.fixed_image.value, widget.moving_image.value]
+        )
+        # The first axis of a layer with more than two axes may be time
+        moving = widget.moving_image.value
+        widget.time_series.visible = (
+            moving is not None and not moving.multiscale and moving.ndim > 2
+        )
+        on_time_series_changed(widget.time_series.value)
+
+    def on_time_series_changed(value):
+        is_time_series = widget.time_series.visible and value != "off"
+        widget.chain_length.visible = is_time_series
+        widget.reference_frame.visible = is_time_series and value == "reference frame"
+
+    widget.time_series.changed.connect(on_time_series_changed)
+
+    widget.fixed_image.changed.connect(on_image_changed)
+    widget.moving_image.changed.connect(on_image_changed)
+
+    @widget.preview.changed.connect
+    def on_preview_changed(value):
+        for name in ["preview_shrink_factor", "refine_preview"]:
+            getattr(widget, name).visible = value
+
     @widget.use_masks.changed.connect
     def on_use_masks_changed(value):
-        for name in ["fixed_mask", "moving_mask"]:
+        for name in ["fixed_mask", "moving_mask", "mask_label"]:
             getattr(widget, name).visible = value
 
+    @widget.region_of_interest.changed.connect
+    def on_region_of_interest_changed(value):
+        widget.roi_shapes.visible = value == "shapes"
+        widget.roi_margin.visible = value != "off"
+
     @widget.preset.changed.connect
     def on_preset_changed(value):
         is_custom_preset = value == "custom"
@@ -91,6 +547,17 @@ def on_init(widget):
 
     @widget.advanced.changed.connect
     def on_advanced_changed(value):
+        for name in [
+            "fixed_file",
+            "moving_file",
+            "result_file",
+            "moving_labels",
+            "number_of_threads",
+            "profile",
+            "compute_metrics",
+            "cache_directory",
+        ]:
+            getattr(widget, name).visible = value
         if widget.preset.value != "custom":
             for name in [
                 "metric",
@@ -101,8 +568,28 @@ def on_init(widget):
             ]:
                 getattr(widget, name).visible = value
 
+    cancel_button = PushButton(text="cancel")
+    cancel_button.tooltip = "Cancel the registrations that are still running"
+    cancel_button.changed.connect(lambda: cancel_workers("registration"))
+    widget.append(cancel_button)
+
+    add_queue_button(
+        widget,
+        lambda kwargs: f"{kwargs['preset']} registration of "
+        + (
+            getattr(kwargs["moving_image"], "name", "")
+            if kwargs["moving_file"] == Path()
+            else kwargs["moving_file"].name
+        ),
+        resolve=_resolve_current_view,
+    )
+
+    add_progress_widgets(widget)
+
     widget.native.layout().addStretch()
 
+    preload_in_background()
+
 
 @magic_factory(
     widget_init=on_init,
@@ -115,6 +602,23 @@ def on_init(widget):
     },
     fixed_mask={"bind": None},
     moving_mask={"bind": None},
+    mask_label={
+        "min": 0,
+        "max": 2**31 - 1,
+        "tooltip": "Label of labels layer masks to register, or 0 for all labels",
+    },
+    region_of_interest={
+        "choices": ["off", "shapes", "current view"],
+        "tooltip": "Only register the images in the bounding box of the "
+        "shapes of a shapes layer, or in the current view. The result "
+        "transform still applies to the whole images",
+    },
+    roi_shapes={"tooltip": "Shapes of which the bounding box is registered"},
+    roi_margin={
+        "min": 0,
+        "tooltip": "Number of pixels around the region of interest that are "
+        "also registered",
+    },
     fixed_point_set={
         "filter": "*.txt",
         "tooltip": "Load a fixed point set",
@@ -156,14 +660,97 @@ def on_init(widget):
         "step": 256,
         "tooltip": "Select the number of spatial " "samples to use",
     },
+    pyramid_level={
+        "min": 0,
+        "tooltip": "Level of multiscale images to register",
+    },
+    time_series={
+        "choices": ["off", "reference frame", "predecessor"],
+        "tooltip": "Register each frame (along the first axis) of the moving "
+        "layer to a reference frame, or to the frame before it",
+    },
+    reference_frame={
+        "min": 0,
+        "tooltip": "Frame to which the other frames are registered",
+    },
+    chain_length={
+        "min": 1,
+        "tooltip": "Number of consecutive frames that are registered one "
+        "after the other, each starting from the transform of the frame "
+        "before it. Chains run in parallel",
+    },
+    deformation_field={
+        "tooltip": "Also show the deformation field of the result transform",
+    },
+    jacobian={
+        "tooltip": "Also show the spatial Jacobian determinant of the result "
+        "transform",
+    },
+    preview={
+        "tooltip": "First register downsampled images, to quickly show a "
+        "preview of the result",
+    },
+    preview_shrink_factor={
+        "min": 2,
+        "max": 32,
+        "tooltip": "Factor by which the images are downsampled for the preview",
+    },
+    refine_preview={
+        "tooltip": "Refine the preview at full resolution, starting from the "
+        "preview transform",
+    },
+    fixed_file={
+        "filter": "*.mha;*.mhd;*.nrrd;*.nii;*.nii.gz;*.tif;*.tiff;*.npy",
+        "tooltip": "Register this image file instead of the fixed image layer. "
+        "NumPy and uncompressed TIFF files are memory mapped",
+    },
+    moving_file={
+        "filter": "*.mha;*.mhd;*.nrrd;*.nii;*.nii.gz;*.tif;*.tiff;*.npy",
+        "tooltip": "Register this image file instead of the moving image "
+        "layer. NumPy and uncompressed TIFF files are memory mapped",
+    },
+    moving_labels={
+        "tooltip": "Also warp these labels of the moving image with the "
+        "result transform, by nearest neighbor interpolation",
+    },
+    result_file={
+        "mode": "w",
+        "filter": "*.npy",
+        "tooltip": "Write the result to this NumPy file, and show it memory "
+        "mapped, instead of keeping it in memory",
+    },
+    number_of_threads={
+        "min": 0,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of threads of elastix, or 0 to share the cores "
+        "with the other registrations and transformations that run",
+    },
+    profile={
+        "tooltip": "Record the time and memory use of each stage of the run "
+        "in the metadata of the result, and in profile.json in the output "
+        "directory",
+    },
+    cache_directory={
+        "mode": "d",
+        "tooltip": "Also keep cached results in this directory, so that they "
+        "are reused in later sessions",
+    },
+    compute_metrics={
+        "tooltip": "Measure the similarity of the fixed and result images, "
+        "and with corresponding points the target registration error",
+    },
 )
 def elastix_registration(
     fixed_image: "napari.layers.Image" = None,
     moving_image: "napari.layers.Image" = None,
     preset: str = "rigid",
     use_masks: bool = False,
-    fixed_mask: "napari.layers.Image" = None,
-    moving_mask: "napari.layers.Image" = None,
+    fixed_mask: "napari.layers.Layer" = None,
+    moving_mask: "napari.layers.Layer" = None,
+    mask_label: int = 0,
+    region_of_interest: str = "off",
+    roi_shapes: "napari.layers.Shapes" = None,
+    roi_margin: int = 16,
     parameterfile_1: Path = "",
     parameterfile_2: Path = "",
     parameterfile_3: Path = "",
@@ -182,21 +769,214 @@ def elastix_registration(
     max_iterations: int = 500,
     spatial_samples: int = 512,
     max_step_length: float = 1.0,
-) -> "napari.layers.Image":
+    use_cache: bool = True,
+    cache_directory: Path = "",
+    pyramid_level: int = 0,
+    time_series: str = "off",
+    reference_frame: int = 0,
+    chain_length: int = 10,
+    deformation_field: bool = False,
+    jacobian: bool = False,
+    preview: bool = False,
+    preview_shrink_factor: int = 4,
+    refine_preview: bool = True,
+    fixed_file: Path = "",
+    moving_file: Path = "",
+    result_file: Path = "",
+    moving_labels: "napari.layers.Labels" = None,
+    number_of_threads: int = 0,
+    profile: bool = False,
+    compute_metrics: bool = False,
+    viewer: "napari.viewer.Viewer" = None,
+) -> Union["napari.layers.Image", List["napari.layers.Layer"], None]:
     """
     Takes user input and calls elastix' registration function in itkelastix.
+    When the widget is docked in a viewer, the registration runs in the
+    background and the result layer is added to the viewer when done. Results
+    of earlier runs with identical inputs are reused when `use_cache` is set,
+    and kept in `cache_directory` as well when it is given. Of multiscale
+    layers, `pyramid_level` is registered. In `preview` mode, downsampled
+    images are registered first, and the result optionally initializes a full
+    resolution registration. The result transform is kept in the transform
+    registry, and its deformation field and spatial Jacobian determinant are
+    optionally computed, in one transformix run. Runs that take place at the
+    same time share the cores, unless `number_of_threads` is set. With
+    `profile`, the time and memory use of each stage are kept in the "profile"
+    metadata of the result, and written to the output directory. With
+    `compute_metrics`, the similarity of the fixed and result images, and with
+    corresponding points the target registration error, are kept in the
+    "metrics" metadata of the result. Huge images can be read from `fixed_file`
+    and `moving_file` instead of layers, memory mapped when possible, and the
+    result can be written to the memory-mapped `result_file`. Masks may be
+    image or labels layers; of labels layers, the mask is `mask_label`, or all
+    labels when it is 0. `moving_labels` are warped by the result transform
+    into a labels layer of their own type. With `region_of_interest`, only the
+    bounding box of `roi_shapes`, or of the current view, is converted and
+    registered, with a margin of `roi_margin` pixels, and the output grid of
+    the result transform is extended to the whole fixed image.
+
+    With `time_series`, the frames of the moving layer are registered to its
+    `reference_frame`, or each to its predecessor, in parallel chains of
+    consecutive frames, of which each frame starts from the transform of the
+    one before it; the fixed image, masks, points, files and region of
+    interest are not used.
     """
-    if fixed_image is None or moving_image is None:
-        notifications.show_error("No images selected for registration.")
-        return None
+    if time_series != "off":
+        error = _time_series_error(moving_image, reference_frame)
+        if error is not None:
+            notifications.show_error(error)
+            return None
+    else:
+        if (fixed_image is None and fixed_file == Path()) or (
+            moving_image is None and moving_file == Path()
+        ):
+            notifications.show_error("No images selected for registration.")
+            return None
+        for file_name in [fixed_file, moving_file]:
+            if file_name != Path() and not file_name.is_file():
+                notifications.show_error(f"Image file not found: {file_name}")
+                return None
+        for mask in [fixed_mask, moving_mask] if use_masks else []:
+            if mask is not None and not isinstance(mask, (Image, Labels)):
+                notifications.show_error("Masks must be image or labels layers")
+                return None
+        if region_of_interest != "off":
+            if fixed_file != Path() or moving_file != Path():
+                notifications.show_error(
+                    "A region of interest can only be registered of image layers"
+                )
+                return None
+            try:
+                roi_box = region_of_interest_box(region_of_interest, roi_shapes, viewer)
+            except ValueError as error:
+                notifications.show_error(str(error))
+                return None
+        if result_file != Path():
+            if result_file.suffix.lower() != ".npy":
+                notifications.show_error("The result file must be a NumPy (.npy) file")
+                return None
+            # The result is kept in its file, instead of in the cache
+            use_cache = False
+
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.cache import content_hash, registration_cache
+    from elastix_napari.conversion import (
+        downsampled_image_view,
+        downsampled_image_view_from_layer,
+        image_view_from_file,
+        image_view_from_layer,
+        memory_mapped_image,
+    )
+    from elastix_napari.engine import create_parameter_object
+    from elastix_napari.batch import (
+        parameter_object_from_dicts,
+        parameter_object_to_dicts,
+    )
+    from elastix_napari.fields import transform_fields
+    from elastix_napari.labels import (
+        label_image_view_from_layer,
+        mask_view_from_layer,
+        transformix_labels,
+    )
+    from elastix_napari.metrics import registration_metrics
+    from elastix_napari.points import (
+        physical_points_from_layer,
+        point_container,
+        read_physical_points,
+    )
+    from elastix_napari.profiling import RunProfile
+    from elastix_napari.threads import limit_threads
+    from elastix_napari.transformix_widget import (
+        field_layers,
+        labels_layer_from_image,
+    )
+    from elastix_napari.transforms import transform_registry
+
+    if use_cache:
+        # The cache of the widget keeps its results on disk as well, when it
+        # has a directory
+        registration_cache.directory = (
+            None if cache_directory == Path() else cache_directory
+        )
+
+    run_profile = RunProfile(
+        preset + " registration", enabled=profile, trace_allocations=True
+    )
+    stage = run_profile.stage
 
-    # Convert image layer to itk_image
-    fixed_image = image_from_image_layer(fixed_image)
-    moving_image = image_from_image_layer(moving_image)
-    fixed_image = fixed_image.astype(itk.F)
-    moving_image = moving_image.astype(itk.F)
+    def create_parameters():
+        try:
+            with stage("create parameter object"):
+                return create_parameter_object(
+                    preset,
+                    [
+                        file_path
+                        for file_path in [
+                            parameterfile_1,
+                            parameterfile_2,
+                            parameterfile_3,
+                        ]
+                        if file_path != Path()
+                    ],
+                    advanced=advanced,
+                    metric=metric,
+                    resolutions=resolutions,
+                    max_iterations=max_iterations,
+                    spatial_samples=spatial_samples,
+                    max_step_length=max_step_length,
+                    use_corresponding_points=use_corresponding_points,
+                )
+        except ValueError:
+            notifications.show_error("Parameter file not found or not valid")
+            return None
+
+    if time_series != "off":
+        parameter_object = create_parameters()
+        if parameter_object is None:
+            return None
+        return register_time_series(
+            moving_image,
+            parameter_object,
+            time_series,
+            reference_frame,
+            chain_length,
+            viewer,
+            name=f"{preset} Registration",
+            initial_transform=(
+                str(initial_transform) if initial_transform != Path() else None
+            ),
+            number_of_threads=number_of_threads,
+        )
 
-    parameter_object = itk.ParameterObject.New()
+    def convert_image(layer, file_name, name, region=None):
+        # Convert image layer to itk_image, without copying float32 layer data
+        if file_name != Path():
+            with stage(f"read {name} image"):
+                return image_view_from_file(file_name, np.float32)
+        with stage(f"convert {name} image"):
+            return image_view_from_layer(layer, np.float32, pyramid_level, region)
+
+    fixed_layer, moving_layer = fixed_image, moving_image
+    # Regions of interest of the fixed and moving layers, and the grid of the
+    # whole fixed image
+    regions = {}
+    full_grid = None
+    if region_of_interest != "off":
+        try:
+            regions, full_grid = _regions_of_interest(
+                fixed_layer, moving_layer, roi_box, roi_margin, pyramid_level
+            )
+        except ValueError as error:
+            notifications.show_error(str(error))
+            return None
+    fixed_image = convert_image(fixed_layer, fixed_file, "fixed", regions.get("fixed"))
+    moving_image = convert_image(
+        moving_layer, moving_file, "moving", regions.get("moving")
+    )
+
+    parameter_object = create_parameters()
+    if parameter_object is None:
+        return None
 
     kwargs = {
         "parameter_object": parameter_object,
@@ -206,57 +986,36 @@ def elastix_registration(
     if initial_transform != Path():
         kwargs["initial_transform_parameter_file_name"] = str(initial_transform)
 
-    if preset == "custom":
-        for file_path in [parameterfile_1, parameterfile_2, parameterfile_3]:
-            if file_path != Path():
-                try:
-                    parameter_object.AddParameterFile(str(file_path))
-                except:
-                    notifications.show_error("Parameter file not found or not valid")
-                    return None
-            else:
-                pass
-    else:
-        if advanced:
-            parameter_map = parameter_object.GetDefaultParameterMap(preset, resolutions)
-            parameter_map["Metric"] = [metric]
-            parameter_map["MaximumStepLength"] = [str(max_step_length)]
-            parameter_map["NumberOfSpatialSamples"] = [str(spatial_samples)]
-            parameter_map["MaximumNumberOfIterations"] = [str(max_iterations)]
-        else:
-            parameter_map = parameter_object.GetDefaultParameterMap(preset, 4)
-
-        if use_corresponding_points:
-            parameter_map["Registration"] = ["MultiMetricMultiResolutionRegistration"]
-            parameter_map["Metric"] += ("CorrespondingPointsEuclideanDistanceMetric",)
-
-            if fixed_points is None:
-                if fixed_point_set == Path():
-                    return utils.error("Please specify the fixed points!")
-                else:
-                    kwargs["fixed_point_set_file_name"] = str(fixed_point_set)
-            else:
-                if fixed_points.data.size > 0:
-                    kwargs["fixed_points"] = point_set_from_points_layer(fixed_points).GetPoints()
-                else:
-                    return utils.error(
-                        "Please make sure the selected layer of fixed points has one or more points!"
-                    )
+    # Physical points in NumPy axis order, which are passed to elastix without
+    # point set files, and measure the target registration error of the result
+    point_arrays = {}
 
-            if moving_points is None:
-                if moving_point_set == Path():
-                    return utils.error("Please specify the moving points!")
-                else:
-                    kwargs["moving_point_set_file_name"] = str(moving_point_set)
+    if use_corresponding_points and preset != "custom":
+        for name, layer, file_name, image in [
+            ("fixed", fixed_points, fixed_point_set, fixed_image),
+            ("moving", moving_points, moving_point_set, moving_image),
+        ]:
+            if layer is None:
+                if file_name == Path():
+                    notifications.show_error(f"Please specify the {name} points!")
+                    return None
+                with stage(f"read {name} points"):
+                    point_arrays[name] = read_physical_points(file_name, image)
+            elif layer.data.size > 0:
+                with stage(f"convert {name} points"):
+                    point_arrays[name] = physical_points_from_layer(layer)
             else:
-                if moving_points.data.size > 0:
-                    kwargs["moving_points"] = point_set_from_points_layer(moving_points).GetPoints()
-                else:
-                    return utils.error(
-                        "Please make sure the selected layer of moving points has one or more points!"
-                    )
-
-        parameter_object.AddParameterMap(parameter_map)
+                notifications.show_error(
+                    f"Please make sure the selected layer of {name} points has one "
+                    "or more points!"
+                )
+                return None
+            kwargs[f"{name}_points"] = point_container(point_arrays[name])
+        if len(point_arrays["fixed"]) != len(point_arrays["moving"]):
+            notifications.show_error(
+                "The fixed and moving points must have the same number of points"
+            )
+            return None
 
     args = [fixed_image, moving_image]
 
@@ -265,15 +1024,17 @@ def elastix_registration(
             notifications.show_error("No masks selected for registration")
             return None
         else:
-            if fixed_mask:
-                fixed_mask = image_from_image_layer(fixed_mask)
-                fixed_mask = fixed_mask.astype(itk.UC)
-                kwargs["fixed_mask"] = fixed_mask
-
-            if moving_mask:
-                moving_mask = image_from_image_layer(moving_mask)
-                moving_mask = moving_mask.astype(itk.UC)
-                kwargs["moving_mask"] = moving_mask
+            for name, layer in [
+                ("fixed_mask", fixed_mask),
+                ("moving_mask", moving_mask),
+            ]:
+                if layer:
+                    with stage(f"convert {name.replace('_', ' ')}"):
+                        kwargs[name] = mask_view_from_layer(
+                            layer,
+                            mask_label if isinstance(layer, Labels) else None,
+                            pyramid_level,
+                        )
 
     if save_output_to_disk:
         if not output_directory.is_dir() or output_directory == Path():
@@ -283,12 +1044,186 @@ def elastix_registration(
         kwargs["log_to_file"] = log_to_file
         kwargs["output_directory"] = str(output_directory)
 
-    # Run elastix registration
-    result_image, result_transform_parameters = itk.elastix_registration_method(
-        *args, **kwargs
-    )
+    preview_args, preview_kwargs = None, None
+    if preview:
+        # Register downsampled copies first, using fewer resolution levels
+        with stage("downsample preview images"):
+            # Files and regions of interest are downsampled after conversion
+            preview_args = [
+                downsampled_image_view(image, preview_shrink_factor, np.float32)
+                if file_name != Path() or regions
+                else downsampled_image_view_from_layer(
+                    layer, preview_shrink_factor, np.float32
+                )
+                for layer, image, file_name in [
+                    (fixed_layer, fixed_image, fixed_file),
+                    (moving_layer, moving_image, moving_file),
+                ]
+            ]
+            preview_kwargs = dict(
+                kwargs,
+                parameter_object=preview_parameter_object(
+                    parameter_object, preview_shrink_factor
+                ),
+            )
+            for name in ["fixed_mask", "moving_mask"]:
+                if name in kwargs:
+                    preview_kwargs[name] = downsampled_image_view(
+                        kwargs[name], preview_shrink_factor, np.uint8
+                    )
 
-    # Convert result (itk.Image) to napari layer
-    layer = image_layer_from_image(result_image)
-    layer.name = preset + " Registration"
-    return layer
+    def add_profile(layers, last=True):
+        return _add_profile(
+            layers,
+            run_profile,
+            last,
+            output_directory if save_output_to_disk else None,
+        )
+
+    def result_layer(result_image, name=preset + " Registration"):
+        # Convert result (itk.Image) to napari layer
+        with stage("create result layer"):
+            layer = image_layer_from_image(result_image)
+        layer.name = name
+        return layer
+
+    def result_layers(result_image, result_transform_parameters):
+        if full_grid is not None:
+            # The transform is in physical coordinates, so that it applies to
+            # the whole images when it resamples the whole fixed image
+            result_transform_parameters = parameter_object_from_dicts(
+                full_grid.parameter_maps(
+                    parameter_object_to_dicts(result_transform_parameters)
+                )
+            )
+        if result_file != Path():
+            with stage("write result file"):
+                result_image = memory_mapped_image(result_image, result_file)
+        layer = result_layer(result_image)
+        # Keep the transform, to apply it with transformix later on
+        with stage("store transform"):
+            layer.metadata["transform"] = transform_registry.add(
+                layer.name, result_transform_parameters
+            )
+        if compute_metrics:
+            with stage("compute metrics"):
+                layer.metadata["metrics"] = registration_metrics(
+                    fixed_image,
+                    result_image,
+                    parameter_object_to_dicts(result_transform_parameters),
+                    point_arrays.get("fixed"),
+                    point_arrays.get("moving"),
+                    kwargs.get("fixed_mask"),
+                )
+        layers = [layer]
+        if moving_labels is not None:
+            with stage(f"warp {moving_labels.name}"), limit_threads(
+                number_of_threads
+            ) as threads:
+                label_image, values = label_image_view_from_layer(
+                    moving_labels, pyramid_level
+                )
+                layers.append(
+                    labels_layer_from_image(
+                        transformix_labels(
+                            label_image,
+                            values,
+                            parameter_object_to_dicts(result_transform_parameters),
+                            threads,
+                        ),
+                        values,
+                        moving_labels.data.dtype,
+                        f"transformed {moving_labels.name}",
+                    )
+                )
+        if deformation_field or jacobian:
+            # elastix already resampled the result image, so only the fields
+            # are computed, in a single transformix run
+            with stage("compute fields"), limit_threads(
+                number_of_threads
+            ) as threads:
+                fields = transform_fields(
+                    result_transform_parameters, jacobian, threads
+                )
+            with stage("create field layers"):
+                layers += field_layers(fields, deformation_field, jacobian)
+        return add_profile(layers if len(layers) > 1 else layer)
+
+    # The cache keys are computed before the progress of a run in a viewer is
+    # followed, which changes the output directory and the parameter maps.
+    # Runs that write to disk are not cached, as they must write their output.
+    cache_keys = {}
+    if use_cache and not save_output_to_disk:
+        with stage("cache lookup"):
+            cache_keys = _cache_keys(args, kwargs, preview_args, preview_kwargs)
+            cached = registration_cache.get(cache_keys["elastix"])
+        # Cached results are shown right away, also in a viewer
+        if cached is not None and not preview:
+            layers = result_layers(*cached)
+            if viewer is None:
+                return layers
+            for layer in layers if isinstance(layers, list) else [layers]:
+                viewer.add_layer(layer)
+            return None
+
+    # Transform parameters of the preview, which initialize the refinement
+    preview_transform = []
+    # Runs in a viewer take place in a process, which cancelling terminates
+    cancelled = threading.Event() if viewer is not None else None
+
+    def register_preview():
+        result_image, result_transform_parameters = _run_elastix(
+            preview_args,
+            preview_kwargs,
+            stage,
+            number_of_threads,
+            cache_keys.get("elastix preview"),
+            "elastix preview",
+            cancelled,
+        )
+        preview_transform.append(result_transform_parameters)
+        return add_profile(
+            result_layer(result_image, preset + " Registration preview"),
+            last=not refine_preview,
+        )
+
+    def register():
+        refine_kwargs = kwargs
+        cache_key = cache_keys.get("elastix")
+        if preview_transform:
+            # The preview already started from the initial transform
+            refine_kwargs = dict(
+                kwargs, initial_transform_parameter_object=preview_transform[0]
+            )
+            refine_kwargs.pop("initial_transform_parameter_file_name", None)
+            if cache_key is not None:
+                cache_key = content_hash(cache_key, preview_transform[0])
+        # Run elastix registration
+        return result_layers(
+            *_run_elastix(
+                args,
+                refine_kwargs,
+                stage,
+                number_of_threads,
+                cache_key,
+                cancelled=cancelled,
+            )
+        )
+
+    if viewer is None:
+        if not preview:
+            return register()
+        preview_layer = register_preview()
+        return register() if refine_preview else preview_layer
+
+    _register_in_background(
+        viewer,
+        register,
+        kwargs,
+        output_directory if save_output_to_disk else None,
+        register_preview if preview else None,
+        preview_kwargs,
+        refine_preview,
+        cancelled,
+    )
+    return None
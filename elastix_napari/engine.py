@@ -0,0 +1,333 @@
+"""Builds elastix parameter objects and runs registration jobs headless."""
+import csv
+import json
+import os
+import time
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Sequence
+
+import itk
+
+from elastix_napari.batch import parameter_object_to_dicts
+from elastix_napari.metrics import registration_metrics
+from elastix_napari.points import read_physical_points
+from elastix_napari.processes import process_pool
+from elastix_napari.threads import global_threads_kept, threads_per_worker
+
+PRESETS = ["translation", "rigid", "affine", "bspline"]
+
+# Options of a job that are file names, and the types of those that are not
+# strings
+_PATH_OPTIONS = [
+    "fixed_mask",
+    "moving_mask",
+    "fixed_point_set",
+    "moving_point_set",
+    "initial_transform",
+]
+_OPTION_TYPES = {
+    "advanced": bool,
+    "resolutions": int,
+    "max_iterations": int,
+    "spatial_samples": int,
+    "max_step_length": float,
+    "use_corresponding_points": bool,
+    "number_of_threads": int,
+    "compute_metrics": bool,
+}
+
+# Columns of the CSV file of write_metrics
+METRICS_COLUMNS = [
+    "name",
+    "output",
+    "elapsed",
+    "error",
+    "mse",
+    "ncc",
+    "mutual_information",
+    "tre_mean",
+    "tre_std",
+    "tre_median",
+    "tre_max",
+]
+
+
+class JobResult(NamedTuple):
+    index: int
+    name: str
+    output: str
+    elapsed: float
+    error: str
+    # Image similarity and target registration error, see
+    # metrics.registration_metrics
+    metrics: dict = None
+
+
+def create_parameter_object(
+    preset: str = "rigid",
+    parameter_files: Sequence[os.PathLike] = (),
+    advanced: bool = False,
+    metric: str = "AdvancedMattesMutualInformation",
+    resolutions: int = 4,
+    max_iterations: int = 500,
+    spatial_samples: int = 512,
+    max_step_length: float = 1.0,
+    use_corresponding_points: bool = False,
+) -> "itk.ParameterObject":
+    """
+    Returns the parameter object of a preset, or of the parameter files when
+    `preset` is "custom". The advanced options override those of the preset
+    map, and `use_corresponding_points` adds the corresponding points metric
+    to it. Raises a ValueError when a parameter file is not valid.
+    """
+    parameter_object = itk.ParameterObject.New()
+    if preset == "custom":
+        for file_path in parameter_files:
+            try:
+                parameter_object.AddParameterFile(str(file_path))
+            except Exception as error:
+                raise ValueError(
+                    f"Parameter file not found or not valid: {file_path}"
+                ) from error
+        return parameter_object
+
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset: {preset}")
+    if advanced:
+        parameter_map = parameter_object.GetDefaultParameterMap(preset, resolutions)
+        parameter_map["Metric"] = [metric]
+        parameter_map["MaximumStepLength"] = [str(max_step_length)]
+        parameter_map["NumberOfSpatialSamples"] = [str(spatial_samples)]
+        parameter_map["MaximumNumberOfIterations"] = [str(max_iterations)]
+    else:
+        parameter_map = parameter_object.GetDefaultParameterMap(preset, 4)
+
+    if use_corresponding_points:
+        parameter_map["Registration"] = ["MultiMetricMultiResolutionRegistration"]
+        parameter_map["Metric"] += ("CorrespondingPointsEuclideanDistanceMetric",)
+
+    parameter_object.AddParameterMap(parameter_map)
+    return parameter_object
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _parse_job(job: dict) -> dict:
+    # Drops empty values, as CSV manifests have all columns for each job, and
+    # converts the values of CSV manifests to their types
+    job = {key: value for key, value in job.items() if value not in (None, "")}
+    for key, option_type in _OPTION_TYPES.items():
+        if key in job:
+            value = job[key]
+            job[key] = _parse_bool(value) if option_type is bool else option_type(value)
+    parameter_files = job.get("parameter_files", [])
+    if isinstance(parameter_files, str):
+        parameter_files = [path for path in parameter_files.split(";") if path]
+    job["parameter_files"] = parameter_files
+    return job
+
+
+def read_manifest(path: os.PathLike) -> List[dict]:
+    """
+    Reads the jobs of a CSV file, with a header row of option names, or of a
+    JSON file with a list of jobs (or an object with a "jobs" list).
+
+    Each job has a "fixed" and a "moving" image file, and an "output" file for
+    the result image. The optional "output_directory" receives the transform
+    parameter files and, with "log_to_file", the elastix log. Other options
+    are "name", "preset", "parameter_files" (separated by ";" in CSV files),
+    "fixed_mask", "moving_mask", "fixed_point_set", "moving_point_set",
+    "initial_transform", "use_corresponding_points", "number_of_threads",
+    "compute_metrics" and the advanced options of the registration widget.
+    Relative paths are relative to the manifest.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        jobs = json.loads(path.read_text())
+        if isinstance(jobs, dict):
+            jobs = jobs["jobs"]
+    else:
+        with open(path, newline="") as manifest:
+            jobs = list(csv.DictReader(manifest))
+
+    jobs = [_parse_job(job) for job in jobs]
+    for job in jobs:
+        for key in ["fixed", "moving", "output", "output_directory"] + _PATH_OPTIONS:
+            if key in job:
+                job[key] = str(path.parent / job[key])
+        job["parameter_files"] = [
+            str(path.parent / file_path) for file_path in job["parameter_files"]
+        ]
+    return jobs
+
+
+def registration_arguments(job: dict):
+    """
+    Returns the fixed image, moving image and keyword arguments of
+    itk.elastix_registration_method for a job.
+    """
+    job = _parse_job(job)
+    parameter_object = create_parameter_object(
+        job.get("preset", "rigid"),
+        job["parameter_files"],
+        **{
+            key: job[key]
+            for key in [
+                "advanced",
+                "metric",
+                "resolutions",
+                "max_iterations",
+                "spatial_samples",
+                "max_step_length",
+                "use_corresponding_points",
+            ]
+            if key in job
+        },
+    )
+    kwargs = {"parameter_object": parameter_object, "log_to_console": False}
+    if "number_of_threads" in job:
+        kwargs["number_of_threads"] = job["number_of_threads"]
+
+    if "initial_transform" in job:
+        kwargs["initial_transform_parameter_file_name"] = job["initial_transform"]
+    if job.get("use_corresponding_points"):
+        for name in ["fixed", "moving"]:
+            if f"{name}_point_set" not in job:
+                raise ValueError(f"Please specify the {name} point set")
+            kwargs[f"{name}_point_set_file_name"] = job[f"{name}_point_set"]
+    for name in ["fixed_mask", "moving_mask"]:
+        if name in job:
+            kwargs[name] = itk.imread(job[name], itk.UC)
+    if "output_directory" in job:
+        Path(job["output_directory"]).mkdir(parents=True, exist_ok=True)
+        kwargs["output_directory"] = job["output_directory"]
+        kwargs["log_to_file"] = _parse_bool(job.get("log_to_file", False))
+
+    fixed_image = itk.imread(job["fixed"], itk.F)
+    moving_image = itk.imread(job["moving"], itk.F)
+    return fixed_image, moving_image, kwargs
+
+
+def _job_name(job: dict, index: int) -> str:
+    if "name" in job:
+        return job["name"]
+    if "moving" in job:
+        return os.path.basename(job["moving"])
+    return f"job {index}"
+
+
+def run_job(job: dict, index: int = 0) -> JobResult:
+    """
+    Runs one registration job and writes its result image. With
+    "compute_metrics", the quality of the registration is measured as well.
+    A failing job returns its error message in the result, instead of
+    raising.
+    """
+    start = time.perf_counter()
+    name = _job_name(job, index)
+    output = job.get("output")
+    try:
+        fixed_image, moving_image, kwargs = registration_arguments(job)
+        with global_threads_kept():
+            result_image, result_transform_parameters = (
+                itk.elastix_registration_method(fixed_image, moving_image, **kwargs)
+            )
+        metrics = None
+        if _parse_bool(job.get("compute_metrics", False)):
+            points = [None, None]
+            if "fixed_point_set_file_name" in kwargs:
+                points = [
+                    read_physical_points(kwargs[f"{name}_point_set_file_name"], image)
+                    for name, image in [
+                        ("fixed", fixed_image),
+                        ("moving", moving_image),
+                    ]
+                ]
+            metrics = registration_metrics(
+                fixed_image,
+                result_image,
+                parameter_object_to_dicts(result_transform_parameters),
+                *points,
+                kwargs.get("fixed_mask"),
+            )
+        if output:
+            Path(output).parent.mkdir(parents=True, exist_ok=True)
+            itk.imwrite(result_image, output)
+            if "output_directory" not in kwargs:
+                # Write the transform next to the result image
+                stem = str(Path(output).with_suffix(""))
+                for map_index in range(
+                    result_transform_parameters.GetNumberOfParameterMaps()
+                ):
+                    transform_parameters = itk.ParameterObject.New()
+                    transform_parameters.SetParameterMap(
+                        result_transform_parameters.GetParameterMap(map_index)
+                    )
+                    transform_parameters.WriteParameterFile(
+                        f"{stem}.TransformParameters.{map_index}.txt"
+                    )
+        return JobResult(
+            index, name, output, time.perf_counter() - start, None, metrics
+        )
+    except Exception as error:
+        return JobResult(index, name, output, time.perf_counter() - start, str(error))
+
+
+def write_metrics(results: Sequence[JobResult], path: os.PathLike):
+    """
+    Writes a CSV file with the time, image similarity and target registration
+    error of each job, for quality control of a batch of registrations.
+    """
+    with open(path, "w", newline="") as metrics_file:
+        writer = csv.DictWriter(metrics_file, METRICS_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            metrics = result.metrics or {}
+            row = {
+                "name": result.name,
+                "output": result.output,
+                "elapsed": result.elapsed,
+                "error": result.error,
+            }
+            row.update(metrics.get("similarity", {}))
+            for key, value in metrics.get("target_registration_error", {}).items():
+                if key != "per_point":
+                    row["tre_" + key] = value
+            writer.writerow(row)
+
+
+def _run_job(arguments):
+    index, job = arguments
+    return run_job(job, index)
+
+
+def iter_jobs(jobs: Sequence[dict], max_workers: int = None) -> Iterator[JobResult]:
+    """
+    Runs the jobs in up to `max_workers` processes, and yields a JobResult
+    per job, in the order in which the jobs finish. Jobs without a
+    "number_of_threads" share the cores equally with the other processes.
+    """
+    workers = min(max_workers or os.cpu_count() or 1, max(len(jobs), 1))
+    jobs = [
+        dict({"number_of_threads": threads_per_worker(workers)}, **job)
+        for job in jobs
+    ]
+    with process_pool(workers) as executor:
+        futures = [
+            executor.submit(_run_job, (index, job)) for index, job in enumerate(jobs)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_jobs(jobs: Sequence[dict], max_workers: int = None) -> List[JobResult]:
+    """
+    Like iter_jobs, but returns the results of all jobs in the order of the
+    jobs.
+    """
+    return sorted(iter_jobs(jobs, max_workers), key=lambda result: result.index)
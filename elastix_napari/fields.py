@@ -0,0 +1,217 @@
+"""Computes the deformation field and Jacobian of transforms, and warps."""
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_from_dicts, parameter_object_to_dicts
+from elastix_napari.cache import content_hash
+
+DEFAULT_MAX_ENTRIES = 4
+
+# Parameters that only affect how an image is resampled, not the fields
+_RESAMPLING_PARAMETERS = {
+    "CompressResultImage",
+    "DefaultPixelValue",
+    "FinalBSplineInterpolationOrder",
+    "ResampleInterpolator",
+    "ResultImageFormat",
+    "ResultImagePixelType",
+    "WriteResultImage",
+}
+
+
+def _fields_key(transform_parameter_object: "itk.ParameterObject") -> str:
+    parameter_maps = [
+        {
+            key: value
+            for key, value in parameter_map.items()
+            if key not in _RESAMPLING_PARAMETERS
+        }
+        for parameter_map in parameter_object_to_dicts(transform_parameter_object)
+    ]
+    return content_hash(parameter_object_from_dicts(parameter_maps))
+
+
+class TransformFields(NamedTuple):
+    # Vector image of the displacement at each point of the output grid
+    deformation_field: "itk.Image"
+    # Scalar image, or None when it was not computed
+    jacobian_determinant: "itk.Image"
+
+
+class FieldCache:
+    """
+    Least recently used cache of the fields of at most `max_entries`
+    transforms, keyed on the content of the transform parameters (ignoring
+    those that only affect the interpolation of images).
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(
+        self, transform_parameter_object: "itk.ParameterObject"
+    ) -> TransformFields:
+        """
+        Returns the fields stored for the transform, or None.
+        """
+        key = _fields_key(transform_parameter_object)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(
+        self,
+        transform_parameter_object: "itk.ParameterObject",
+        fields: TransformFields,
+    ):
+        key = _fields_key(transform_parameter_object)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and fields.jacobian_determinant is None:
+                # Keep a Jacobian determinant that was computed before
+                fields = fields._replace(
+                    jacobian_determinant=cached.jacobian_determinant
+                )
+            self._entries[key] = fields
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Fields of the transforms that were applied most recently
+field_cache = FieldCache()
+
+
+def transformix_with_fields(
+    image: "itk.Image",
+    transform_parameter_object: "itk.ParameterObject",
+    jacobian: bool = True,
+    number_of_threads: int = 0,
+):
+    """
+    Resamples `image` like itk.transformix_filter, and computes the
+    deformation field and, when `jacobian` is set, the spatial Jacobian
+    determinant in the same transformix run, with `number_of_threads` (or the
+    default number of threads of ITK, when it is 0). Returns the result image
+    and the TransformFields, which are also stored in `field_cache`.
+    """
+    # transformix also writes the deformation field to its output directory
+    with tempfile.TemporaryDirectory() as output_directory:
+        transformix_object = itk.TransformixFilter.New(image)
+        transformix_object.SetTransformParameterObject(transform_parameter_object)
+        transformix_object.SetComputeDeformationField(True)
+        transformix_object.SetOutputDirectory(output_directory)
+        transformix_object.SetLogToConsole(False)
+        if number_of_threads:
+            transformix_object.SetNumberOfWorkUnits(number_of_threads)
+        transformix_object.UpdateLargestPossibleRegion()
+
+        fields = TransformFields(
+            transformix_object.GetOutputDeformationField(),
+            transformix_object.ComputeSpatialJacobianDeterminantImage()
+            if jacobian
+            else None,
+        )
+    field_cache.put(transform_parameter_object, fields)
+    return transformix_object.GetOutput(), fields
+
+
+def transform_fields(
+    transform_parameter_object: "itk.ParameterObject",
+    jacobian: bool = True,
+    number_of_threads: int = 0,
+) -> TransformFields:
+    """
+    Returns the fields of a transform, without resampling an image, for
+    example of a registration of which elastix already resampled the result.
+    Fields that are in `field_cache` are not computed again.
+    """
+    fields = field_cache.get(transform_parameter_object)
+    if fields is not None and (not jacobian or fields.jacobian_determinant is not None):
+        return fields
+
+    # transformix requires an input image. A single pixel one, which is
+    # sampled by nearest neighbor interpolation, takes no time to resample.
+    parameter_maps = parameter_object_to_dicts(transform_parameter_object)
+    dimension = len(parameter_maps[-1]["Size"])
+    placeholder = itk.image_view_from_array(np.zeros((1,) * dimension, np.float32))
+    parameter_maps = [
+        dict(
+            parameter_map,
+            ResampleInterpolator=["FinalNearestNeighborInterpolator"],
+        )
+        for parameter_map in parameter_maps
+    ]
+    _, fields = transformix_with_fields(
+        placeholder,
+        parameter_object_from_dicts(parameter_maps),
+        jacobian,
+        number_of_threads,
+    )
+    return fields
+
+
+def _physical_points(image: "itk.Image") -> np.ndarray:
+    # Physical coordinates of all pixels, in NumPy axis order, with the axis
+    # of the coordinates first
+    shape = itk.array_view_from_image(image).shape[: image.GetImageDimension()]
+    indices = np.indices(shape, dtype=np.float64).reshape(len(shape), -1)
+    spacing = np.asarray(image["spacing"], np.float64)[:, np.newaxis]
+    origin = np.asarray(image["origin"], np.float64)[:, np.newaxis]
+    direction = np.asarray(image["direction"], np.float64)
+    return origin + direction @ (indices * spacing)
+
+
+def warp_with_field(
+    image: "itk.Image",
+    deformation_field: "itk.Image",
+    order: int = 1,
+    default_value=0,
+) -> "itk.Image":
+    """
+    Resamples `image` on the grid of `deformation_field`, by spline
+    interpolation of `order` (0 for nearest neighbor, 1 for linear) at the
+    displaced points. Points outside the image get `default_value`.
+    """
+    # SciPy is only loaded when a stored field is used
+    from scipy import ndimage
+
+    dimension = deformation_field.GetImageDimension()
+    # The displacement vectors are in ITK order, so reverse them
+    displacement = itk.array_view_from_image(deformation_field)
+    displacement = displacement.reshape(-1, dimension)[:, ::-1].T
+    points = _physical_points(deformation_field) + displacement
+
+    # Map the physical points to continuous indices of the image
+    spacing = np.asarray(image["spacing"], np.float64)[:, np.newaxis]
+    origin = np.asarray(image["origin"], np.float64)[:, np.newaxis]
+    direction = np.asarray(image["direction"], np.float64)
+    indices = np.linalg.solve(direction, points - origin) / spacing
+
+    values = ndimage.map_coordinates(
+        itk.array_view_from_image(image), indices,
+        order=order,
+        mode="constant",
+        cval=default_value,
+    )
+    shape = itk.array_view_from_image(deformation_field).shape[:dimension]
+    result = itk.image_view_from_array(values.reshape(shape))
+    for key in ("spacing", "origin", "direction"):
+        result[key] = np.asarray(deformation_field[key], np.float64)
+    return result
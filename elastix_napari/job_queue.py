@@ -0,0 +1,203 @@
+"""A queue of registration and transformix jobs that run in the background."""
+import threading
+import time
+from typing import Any, Callable, List
+
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+DEFAULT_MAX_WORKERS = 2
+
+
+class Job:
+    """
+    A call of `function` with `kwargs`, and its status, timing and result.
+    `on_finished` is called with the job when it finishes successfully.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable,
+        kwargs: dict = None,
+        on_finished: Callable[["Job"], Any] = None,
+    ):
+        self.name = name
+        self.function = function
+        self.kwargs = dict(kwargs or {})
+        self.on_finished = on_finished
+        self.status = PENDING
+        self.queued = time.time()
+        self.started = None
+        self.elapsed = None
+        self.error = None
+        self.result = None
+
+    def __repr__(self):
+        return f"Job({self.name!r}, status={self.status!r})"
+
+    @property
+    def done(self) -> bool:
+        return self.status in (FINISHED, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """
+    Runs the jobs that are submitted to it, up to `max_workers` at a time,
+    in the order of the queue. A cancelled job that is still running keeps
+    its place among the `max_workers` until it returns.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self._max_workers = max_workers
+        self._jobs = []
+        # Jobs whose function has not returned yet, including cancelled ones
+        self._executing = set()
+        self._listeners = []
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @max_workers.setter
+    def max_workers(self, value: int):
+        with self._condition:
+            self._max_workers = max(value, 1)
+        self._dispatch()
+
+    def jobs(self) -> List[Job]:
+        """
+        Returns the jobs in the order of the queue.
+        """
+        with self._condition:
+            return list(self._jobs)
+
+    def add_listener(self, callback: Callable[[Job], Any]):
+        """
+        Calls `callback` with a job when it is added, moved, started or done.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Job], Any]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, job: Job):
+        for callback in list(self._listeners):
+            callback(job)
+
+    def submit(
+        self,
+        name: str,
+        function: Callable,
+        kwargs: dict = None,
+        on_finished: Callable[[Job], Any] = None,
+    ) -> Job:
+        """
+        Adds a job that calls `function` with `kwargs` to the end of the
+        queue, and returns it. `on_finished` is called with the job when it
+        finishes successfully, from the thread in which it ran.
+        """
+        job = Job(name, function, kwargs, on_finished)
+        with self._condition:
+            self._jobs.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def move(self, job: Job, steps: int):
+        """
+        Moves a job `steps` places towards the end of the queue, or towards
+        the front when `steps` is negative. The waiting job that is closest
+        to the front runs first.
+        """
+        with self._condition:
+            index = self._jobs.index(job)
+            self._jobs.remove(job)
+            self._jobs.insert(max(index + steps, 0), job)
+        self._notify(job)
+
+    def cancel(self, job: Job):
+        """
+        Cancels a job. A job that is running cannot be interrupted, but its
+        result is discarded.
+        """
+        with self._condition:
+            if job.done:
+                return
+            job.status = CANCELLED
+            self._condition.notify_all()
+        self._notify(job)
+
+    def retry(self, job: Job) -> Job:
+        """
+        Queues a job that failed or was cancelled once more, and returns the
+        new job.
+        """
+        return self.submit(job.name, job.function, job.kwargs, job.on_finished)
+
+    def clear_done(self):
+        """
+        Removes the jobs that are done from the queue.
+        """
+        with self._condition:
+            self._jobs = [job for job in self._jobs if not job.done]
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits until all jobs are done, and returns whether they are.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: all(job.done for job in self._jobs) and not self._executing,
+                timeout,
+            )
+
+    def _dispatch(self):
+        started = []
+        with self._condition:
+            for job in self._jobs:
+                if len(self._executing) >= self._max_workers:
+                    break
+                if job.status == PENDING:
+                    job.status = RUNNING
+                    job.started = time.time()
+                    self._executing.add(job)
+                    started.append(job)
+        for job in started:
+            self._notify(job)
+            threading.Thread(
+                target=self._run, args=(job,), name=f"job {job.name}", daemon=True
+            ).start()
+
+    def _run(self, job: Job):
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            result = job.function(**job.kwargs)
+        except Exception as exception:
+            error = str(exception) or type(exception).__name__
+        with self._condition:
+            self._executing.discard(job)
+            job.elapsed = time.perf_counter() - start
+            if job.status == RUNNING:
+                # Jobs that were cancelled while running keep their status
+                job.status = FINISHED if error is None else FAILED
+                job.result = result
+                job.error = error
+            self._condition.notify_all()
+        self._notify(job)
+        self._dispatch()
+        if job.status == FINISHED and job.on_finished is not None:
+            job.on_finished(job)
+
+
+# Queue of the jobs of the queue widget
+job_queue = JobQueue()
@@ -0,0 +1,202 @@
+"""Dock widget of the job queue, and the buttons that queue jobs."""
+from typing import TYPE_CHECKING, Callable
+
+from magicgui.widgets import Container, PushButton, SpinBox, Table
+from napari.utils import notifications
+from superqt.utils import ensure_main_thread
+
+from elastix_napari.job_queue import FINISHED, Job, job_queue
+
+if TYPE_CHECKING:
+    import napari
+
+COLUMNS = ["job", "status", "time (s)", "error"]
+
+
+def widget_kwargs(widget) -> dict:
+    """
+    Returns the current values of the parameters of a function widget,
+    without its viewer, so that the function returns its result instead of
+    adding it to the viewer.
+    """
+    return {
+        name: getattr(widget, name).value
+        for name in widget.__signature__.parameters
+        if name != "viewer"
+    }
+
+
+def _result_adder(viewer: "napari.viewer.Viewer") -> Callable[[Job], None]:
+    # Adds the layers of a finished job to the viewer, on the main thread
+    @ensure_main_thread
+    def add_result(job: Job):
+        if viewer is not None:
+            layers = job.result if isinstance(job.result, list) else [job.result]
+            for layer in layers:
+                viewer.add_layer(layer)
+        notifications.show_info(f"{job.name} finished in {job.elapsed:.1f} s")
+
+    return add_result
+
+
+def queue_widget_call(
+    widget,
+    name: str,
+    viewer: "napari.viewer.Viewer" = None,
+    resolve: Callable[[dict, "napari.viewer.Viewer"], dict] = None,
+) -> Job:
+    """
+    Queues a call of the function of `widget` with its current settings, and
+    returns the job, or None when the settings cannot be resolved. When the
+    job finishes, its layers are added to `viewer`, by default the viewer of
+    the widget, also when the job queue widget is not open. `resolve(kwargs,
+    viewer)` returns the settings with the parts that depend on the current
+    state of the viewer (such as the current view) fixed, and raises
+    ValueError when they cannot be.
+    """
+    function = widget.__wrapped__
+    if viewer is None and "viewer" in widget.__signature__.parameters:
+        viewer = widget.viewer.value
+    kwargs = widget_kwargs(widget)
+    if resolve is not None:
+        try:
+            kwargs = resolve(kwargs, viewer)
+        except ValueError as error:
+            notifications.show_error(str(error))
+            return None
+
+    def run(**kwargs):
+        result = function(**kwargs)
+        if result is None:
+            # The widget functions report invalid settings themselves
+            raise ValueError("No result, see the notifications")
+        return result
+
+    return job_queue.submit(name, run, kwargs, _result_adder(viewer))
+
+
+def add_queue_button(
+    widget,
+    name: Callable[[dict], str],
+    resolve: Callable[[dict, "napari.viewer.Viewer"], dict] = None,
+):
+    """
+    Adds a button to `widget` that queues its current settings, as a job
+    called `name(kwargs)`, see queue_widget_call.
+    """
+    queue_button = PushButton(text="add to queue")
+    queue_button.tooltip = (
+        "Run with these settings in the job queue, while you set up the next "
+        "job"
+    )
+    queue_button.changed.connect(
+        lambda: queue_widget_call(
+            widget, name(widget_kwargs(widget)), resolve=resolve
+        )
+    )
+    widget.append(queue_button)
+
+
+def _elapsed(job: Job) -> str:
+    return "" if job.elapsed is None else f"{job.elapsed:.1f}"
+
+
+class JobQueueWidget(Container):
+    """
+    Shows the queued, running and finished jobs. Waiting jobs can be moved up
+    and down, and jobs can be cancelled, or retried when they failed. The
+    layers of finished jobs are added to the viewer of the widget that
+    queued them, see queue_widget_call.
+    """
+
+    def __init__(self, napari_viewer: "napari.viewer.Viewer"):
+        super().__init__(layout="vertical")
+        self.viewer = napari_viewer
+        self.native.setStyleSheet("QWidget{font-size: 12pt;}")
+
+        self.max_workers = SpinBox(
+            value=job_queue.max_workers,
+            min=1,
+            max=16,
+            label="max workers",
+            tooltip="Number of jobs that run at the same time",
+        )
+        self.max_workers.changed.connect(self._on_max_workers_changed)
+        self.table = Table(value={"data": [], "index": [], "columns": COLUMNS})
+        self.table.read_only = True
+        self.extend([self.max_workers, self.table])
+
+        buttons = Container(layout="horizontal", labels=False)
+        for text, tooltip, callback in [
+            ("up", "Run the selected job earlier", lambda: self._move(-1)),
+            ("down", "Run the selected job later", lambda: self._move(1)),
+            ("cancel", "Cancel the selected job", self._cancel),
+            ("retry", "Queue the selected job again", self._retry),
+            ("clear", "Remove the jobs that are done", self._clear),
+        ]:
+            button = PushButton(text=text, tooltip=tooltip)
+            button.changed.connect(callback)
+            buttons.append(button)
+        self.append(buttons)
+
+        job_queue.add_listener(self._on_job_changed)
+        self.native.destroyed.connect(
+            lambda: job_queue.remove_listener(self._on_job_changed)
+        )
+        self.refresh()
+
+    def _on_max_workers_changed(self, value: int):
+        job_queue.max_workers = value
+
+    def selected_job(self) -> Job:
+        """
+        Returns the job of the selected row, or None.
+        """
+        rows = self.table.native.selectionModel().selectedRows()
+        if not rows:
+            rows = self.table.native.selectedIndexes()
+        jobs = job_queue.jobs()
+        if not rows or rows[0].row() >= len(jobs):
+            return None
+        return jobs[rows[0].row()]
+
+    def _select(self, job: Job):
+        jobs = job_queue.jobs()
+        if job in jobs:
+            self.table.native.selectRow(jobs.index(job))
+
+    def _move(self, steps: int):
+        job = self.selected_job()
+        if job is not None:
+            job_queue.move(job, steps)
+            self.refresh()
+            self._select(job)
+
+    def _cancel(self):
+        job = self.selected_job()
+        if job is not None:
+            job_queue.cancel(job)
+
+    def _retry(self):
+        job = self.selected_job()
+        if job is not None and job.done and job.status != FINISHED:
+            job_queue.retry(job)
+
+    def _clear(self):
+        job_queue.clear_done()
+        self.refresh()
+
+    def refresh(self):
+        jobs = job_queue.jobs()
+        self.table.value = {
+            "data": [
+                [job.name, job.status, _elapsed(job), job.error or ""]
+                for job in jobs
+            ],
+            "index": list(range(1, len(jobs) + 1)),
+            "columns": COLUMNS,
+        }
+
+    @ensure_main_thread
+    def _on_job_changed(self, job: Job):
+        self.refresh()
@@ -0,0 +1,154 @@
+"""Resamples label images with transformix, without casting them to float."""
+from functools import reduce
+from typing import List, Tuple
+
+import numpy as np
+import itk
+
+from elastix_napari.conversion import CHUNK_BYTES, image_view_from_layer
+
+# Pixel types of which transformix resamples images natively
+NATIVE_DTYPES = [np.dtype(np.uint8), np.dtype(np.uint16), np.dtype(np.int16)]
+
+
+def _slabs(data) -> List[slice]:
+    slab_bytes = max(int(np.prod(data.shape[1:])) * data.dtype.itemsize, 1)
+    step = max(CHUNK_BYTES // slab_bytes, 1)
+    return [slice(start, start + step) for start in range(0, data.shape[0], step)]
+
+
+def label_parameter_maps(
+    parameter_maps: List[dict], default_pixel_value=0
+) -> List[dict]:
+    """
+    Returns a copy of the parameter maps that resamples by nearest neighbor
+    interpolation, and gives points outside the image `default_pixel_value`.
+    """
+    return [
+        dict(
+            parameter_map,
+            ResampleInterpolator=["FinalNearestNeighborInterpolator"],
+            DefaultPixelValue=[str(default_pixel_value)],
+        )
+        for parameter_map in parameter_maps
+    ]
+
+
+def encode_labels(data) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the label data as an array that transformix resamples natively,
+    and the label value of each of its values, or None when the array has the
+    labels themselves. The label values include 0, the background. The data
+    is processed slab by slab, so that no full-size temporaries are made.
+    """
+    dtype = np.dtype(data.dtype)
+    if dtype in NATIVE_DTYPES:
+        return np.ascontiguousarray(data), None
+
+    slabs = _slabs(data) if np.ndim(data) else [Ellipsis]
+    values = reduce(
+        np.union1d,
+        (np.unique(np.asarray(data[slab])) for slab in slabs),
+        np.zeros(1, dtype),
+    )
+    if len(values) <= 256:
+        index_dtype = np.uint8
+    elif len(values) <= 65536:
+        index_dtype = np.uint16
+    else:
+        return np.asarray(data, np.float64), None
+
+    indices = np.empty(data.shape, index_dtype)
+    for slab in slabs:
+        indices[slab] = np.searchsorted(values, np.asarray(data[slab]))
+    return indices, values
+
+
+def decode_labels(data: np.ndarray, values: np.ndarray, dtype) -> np.ndarray:
+    """
+    Returns the labels of data that was encoded by encode_labels, as `dtype`.
+    """
+    if values is None:
+        # Unlike np.asarray, astype keeps array views of ITK images, which
+        # keep the image (and so the data) alive
+        return data.astype(dtype, copy=False)
+    return values[data]
+
+
+def background_index(values: np.ndarray) -> int:
+    """
+    Returns the encoded value of the background label 0.
+    """
+    return 0 if values is None else int(np.searchsorted(values, 0))
+
+
+def _layer_data(layer, level: int):
+    if layer.multiscale:
+        return layer.data[min(level, len(layer.data) - 1)]
+    return layer.data
+
+
+def _image_view_like_layer(data: np.ndarray, layer, level: int) -> "itk.Image":
+    # Only the first pixel of the layer is converted, for its geometry
+    reference = image_view_from_layer(
+        layer, np.uint8, level, region=[(0, 1)] * np.ndim(data)
+    )
+    image = itk.image_view_from_array(data)
+    for key in ("spacing", "origin", "direction"):
+        image[key] = reference[key]
+    return image
+
+
+def label_image_view_from_layer(
+    layer, level: int = 0
+) -> Tuple["itk.Image", np.ndarray]:
+    """
+    Converts a labels layer (or a level of a multiscale one) to an ITK image
+    that transformix resamples natively, see encode_labels, and returns it
+    with the label value of each of its values (or None). Labels of a native
+    type are not copied.
+    """
+    data, values = encode_labels(_layer_data(layer, level))
+    return _image_view_like_layer(data, layer, level), values
+
+
+def mask_view_from_layer(layer, label: int = None, level: int = 0) -> "itk.Image":
+    """
+    Converts a layer to an elastix mask. With `label`, the mask is where the
+    data of a labels layer has that label, or any label when `label` is 0.
+    Otherwise, the data is cast to uint8, as for image layers.
+    """
+    if label is None:
+        return image_view_from_layer(layer, np.uint8, level)
+    data = _layer_data(layer, level)
+    mask = np.empty(data.shape, np.bool_)
+    for slab in _slabs(data) if np.ndim(data) else [Ellipsis]:
+        labels = np.asarray(data[slab])
+        mask[slab] = labels == label if label else labels != 0
+    # A boolean mask has the same memory layout as a binary uint8 image
+    return _image_view_like_layer(mask.view(np.uint8), layer, level)
+
+
+def transformix_labels(
+    image: "itk.Image",
+    values: np.ndarray,
+    parameter_maps: List[dict],
+    number_of_threads: int = 0,
+) -> "itk.Image":
+    """
+    Resamples a label image of label_image_view_from_layer with transformix,
+    with `number_of_threads` (or the default number of threads of ITK, when
+    it is 0). The result has the encoded values; see decode_labels.
+    """
+    from elastix_napari.batch import parameter_object_from_dicts
+
+    kwargs = {}
+    if number_of_threads:
+        kwargs["number_of_work_units"] = number_of_threads
+    return itk.transformix_filter(
+        image,
+        parameter_object_from_dicts(
+            label_parameter_maps(parameter_maps, background_index(values))
+        ),
+        **kwargs,
+    )
@@ -0,0 +1,159 @@
+"""Measures registration quality: landmark errors and image similarity."""
+from typing import List
+
+import numpy as np
+import itk
+
+from elastix_napari.conversion import CHUNK_BYTES
+from elastix_napari.points import landmark_errors
+
+DEFAULT_BINS = 32
+
+
+def error_summary(errors: np.ndarray) -> dict:
+    """
+    Returns the mean, standard deviation, median and maximum of errors.
+    """
+    errors = np.asarray(errors, float)
+    if errors.size == 0:
+        return {"mean": None, "std": None, "median": None, "max": None}
+    return {
+        "mean": float(errors.mean()),
+        "std": float(errors.std()),
+        "median": float(np.median(errors)),
+        "max": float(errors.max()),
+    }
+
+
+def target_registration_error(
+    fixed_points: np.ndarray, moving_points: np.ndarray, parameter_maps: List[dict]
+) -> dict:
+    """
+    Returns the distance between each transformed fixed point and its moving
+    point ("per_point"), and their summary. The points are physical
+    coordinates in NumPy axis order.
+    """
+    errors = landmark_errors(fixed_points, moving_points, parameter_maps)
+    return dict(error_summary(errors), per_point=errors.tolist())
+
+
+def _slabs(shape, itemsize: int) -> List[slice]:
+    # Slices along the first axis of at most about CHUNK_BYTES each
+    slab_bytes = max(int(np.prod(shape[1:])) * itemsize, 1)
+    step = max(CHUNK_BYTES // slab_bytes, 1)
+    return [slice(start, start + step) for start in range(0, shape[0], step)]
+
+
+def image_similarity(
+    fixed_image: "itk.Image",
+    result_image: "itk.Image",
+    mask: "itk.Image" = None,
+    bins: int = DEFAULT_BINS,
+) -> dict:
+    """
+    Returns the mean squared error, normalized cross correlation and mutual
+    information (in nats, from a joint histogram of `bins` bins per image) of
+    two images on the same grid, within `mask` when given. The images are
+    processed in one pass, slab by slab, so that no full-size float64 copies
+    are made.
+    """
+    fixed = itk.array_view_from_image(fixed_image)
+    result = itk.array_view_from_image(result_image)
+    inside = None
+    if mask is not None:
+        if tuple(mask.shape) != tuple(fixed_image.shape):
+            # elastix allows masks on other grids; resample it to the image
+            mask = itk.resample_image_filter(
+                mask,
+                reference_image=fixed_image,
+                use_reference_image=True,
+                interpolator=itk.NearestNeighborInterpolateImageFunction.New(mask),
+            )
+        inside = itk.array_view_from_image(mask)
+    slabs = _slabs(fixed.shape, np.dtype(np.float64).itemsize) if fixed.ndim else []
+    if not slabs or fixed.size == 0:
+        return {"mse": None, "ncc": None, "mutual_information": None}
+    # The histogram bins span the values of the whole images, which are found
+    # without converting the images, so that the moments and the joint
+    # histogram are computed in one pass over the slabs
+    low = [float(fixed.min()), float(result.min())]
+    high = [float(fixed.max()), float(result.max())]
+
+    def bin_indices(values, axis):
+        if high[axis] == low[axis]:
+            return np.zeros(values.shape, np.intp)
+        indices = (values - low[axis]) * (bins / (high[axis] - low[axis]))
+        return np.minimum(indices.astype(np.intp), bins - 1)
+
+    count = 0
+    sums = np.zeros(6)
+    joint = np.zeros(bins * bins)
+    for slab in slabs:
+        fixed_values = np.asarray(fixed[slab], np.float64).ravel()
+        result_values = np.asarray(result[slab], np.float64).ravel()
+        if inside is not None:
+            selected = inside[slab].ravel() != 0
+            fixed_values = fixed_values[selected]
+            result_values = result_values[selected]
+        if fixed_values.size == 0:
+            continue
+        count += fixed_values.size
+        difference = fixed_values - result_values
+        sums += [
+            fixed_values.sum(),
+            result_values.sum(),
+            fixed_values @ fixed_values,
+            result_values @ result_values,
+            fixed_values @ result_values,
+            difference @ difference,
+        ]
+        joint += np.bincount(
+            bin_indices(fixed_values, 0) * bins + bin_indices(result_values, 1),
+            minlength=bins * bins,
+        )
+    if count == 0:
+        return {"mse": None, "ncc": None, "mutual_information": None}
+
+    fixed_sum, result_sum, fixed_squares, result_squares, products, errors = sums
+    covariance = products - fixed_sum * result_sum / count
+    norm = np.sqrt(
+        max(fixed_squares - fixed_sum**2 / count, 0)
+        * max(result_squares - result_sum**2 / count, 0)
+    )
+    ncc = float(covariance / norm) if norm > 0 else 0.0
+
+    joint = joint.reshape(bins, bins) / count
+    fixed_marginal = joint.sum(axis=1, keepdims=True)
+    result_marginal = joint.sum(axis=0, keepdims=True)
+    nonzero = joint > 0
+    mutual_information = float(
+        np.sum(
+            joint[nonzero]
+            * np.log(joint[nonzero] / (fixed_marginal * result_marginal)[nonzero])
+        )
+    )
+    return {
+        "mse": float(errors / count),
+        "ncc": ncc,
+        "mutual_information": mutual_information,
+    }
+
+
+def registration_metrics(
+    fixed_image: "itk.Image",
+    result_image: "itk.Image",
+    parameter_maps: List[dict] = None,
+    fixed_points: np.ndarray = None,
+    moving_points: np.ndarray = None,
+    fixed_mask: "itk.Image" = None,
+) -> dict:
+    """
+    Returns the image similarity of a registration and, when corresponding
+    points are given, its target registration error.
+    """
+    metrics = {"similarity": image_similarity(fixed_image, result_image, fixed_mask)}
+    if fixed_points is not None and moving_points is not None:
+        metrics["target_registration_error"] = target_registration_error(
+            fixed_points, moving_points, parameter_maps
+        )
+    return metrics
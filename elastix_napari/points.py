@@ -0,0 +1,278 @@
+"""Reads, writes and transforms point sets, and measures landmark errors."""
+import itertools
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_from_dicts, parameter_object_to_dicts
+from elastix_napari.tiling import OutputGrid
+
+_OUTPUT_POINT_PATTERN = re.compile(r"OutputPoint = \[([^\]]*)\]")
+
+
+def read_point_set(file_name: os.PathLike) -> Tuple[np.ndarray, bool]:
+    """
+    Reads an elastix point set file, and returns its points and whether they
+    are indices (instead of physical points).
+    """
+    with open(file_name) as point_set_file:
+        kind = point_set_file.readline().strip().lower()
+        is_index = kind == "index"
+        if kind not in ("index", "point"):
+            # Files without a header line have physical points
+            point_set_file.seek(0)
+        count = int(point_set_file.readline())
+        points = np.loadtxt(point_set_file, ndmin=2, max_rows=count)
+    return points[:, ::-1], is_index
+
+
+def write_point_set(file_name: os.PathLike, points: np.ndarray, is_index=False):
+    """
+    Writes points (or indices, with `is_index`) to an elastix point set file.
+    """
+    points = np.asarray(points, float)
+    np.savetxt(
+        file_name,
+        points.reshape(len(points), -1)[:, ::-1],
+        fmt="%.17g",
+        header=f"{'index' if is_index else 'point'}\n{len(points)}",
+        comments="",
+    )
+
+
+def physical_points_from_layer(layer) -> np.ndarray:
+    """
+    Returns the physical (world) coordinates of the points of a napari Points
+    layer, applying its scale, rotation and translation.
+    """
+    points = np.asarray(layer.data, float) * layer.scale
+    return points @ np.asarray(layer.rotate, float).T + layer.translate
+
+
+def point_container(points: np.ndarray) -> "itk.VectorContainer":
+    """
+    Returns a container of ITK points, to pass points to elastix as the
+    `fixed_points` and `moving_points` arguments without a point set file.
+    """
+    points = np.asarray(points, np.float32)
+    point_set = itk.PointSet[itk.F, points.shape[1]].New()
+    point_set.SetPoints(itk.vector_container_from_array(points[:, ::-1].ravel()))
+    return point_set.GetPoints()
+
+
+def physical_points(indices: np.ndarray, image: "itk.Image") -> np.ndarray:
+    """
+    Returns the physical points of (continuous) indices of `image`.
+    """
+    spacing = np.asarray(image["spacing"], float)
+    origin = np.asarray(image["origin"], float)
+    direction = np.asarray(image["direction"], float)
+    return origin + (np.asarray(indices, float) * spacing) @ direction.T
+
+
+def read_physical_points(file_name: os.PathLike, image: "itk.Image") -> np.ndarray:
+    """
+    Reads an elastix point set file, and returns its physical points, of
+    which indices are indices of `image`.
+    """
+    points, is_index = read_point_set(file_name)
+    return physical_points(points, image) if is_index else points
+
+
+# elastix transforms of which points are transformed in memory
+_MATRIX_TRANSFORMS = [
+    "TranslationTransform",
+    "EulerTransform",
+    "SimilarityTransform",
+    "AffineTransform",
+]
+_BSPLINE_TRANSFORMS = ["BSplineTransform", "RecursiveBSplineTransform"]
+_NO_INITIAL_TRANSFORM = ("", "NoInitialTransform")
+
+
+def _values(parameter_map: dict, key: str, default=None) -> np.ndarray:
+    return np.asarray(parameter_map.get(key, default), float)
+
+
+def _initial_parameter_maps(parameter_map: dict) -> List[dict]:
+    # The parameter maps of the initial transform file of a parameter map
+    for key in [
+        "InitialTransformParameterFileName",
+        "InitialTransformParametersFileName",
+    ]:
+        file_name = parameter_map.get(key, [""])[0]
+        if file_name not in _NO_INITIAL_TRANSFORM:
+            parameter_object = itk.ParameterObject.New()
+            parameter_object.ReadParameterFile(file_name)
+            parameter_maps = parameter_object_to_dicts(parameter_object)
+            return _initial_parameter_maps(parameter_maps[0]) + parameter_maps
+    return []
+
+
+def _matrix_and_offset(
+    parameter_map: dict, dimension: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    # The matrix and offset of a linear transform, computed by the ITK
+    # transform of the same parameters
+    name = parameter_map["Transform"][0]
+    parameters = _values(parameter_map, "TransformParameters")
+    if name == "TranslationTransform":
+        return np.eye(dimension), parameters
+    if name == "EulerTransform":
+        transform = {2: itk.Euler2DTransform, 3: itk.Euler3DTransform}[dimension]
+        transform = transform[itk.D].New()
+        if dimension == 3:
+            transform.SetComputeZYX(
+                parameter_map.get("ComputeZYX", ["false"])[0] == "true"
+            )
+    elif name == "SimilarityTransform":
+        transform = {2: itk.Similarity2DTransform, 3: itk.Similarity3DTransform}
+        transform = transform[dimension][itk.D].New()
+    else:
+        transform = itk.AffineTransform[itk.D, dimension].New()
+    transform.SetCenter(
+        _values(parameter_map, "CenterOfRotationPoint", [0] * dimension).tolist()
+    )
+    itk_parameters = itk.OptimizerParameters[itk.D](len(parameters))
+    for index, value in enumerate(parameters):
+        itk_parameters[index] = value
+    transform.SetParameters(itk_parameters)
+    return itk.array_from_matrix(transform.GetMatrix()), np.asarray(
+        transform.GetOffset()
+    )
+
+
+def _cubic_bspline(x: np.ndarray) -> np.ndarray:
+    x = np.abs(x)
+    return np.where(
+        x < 1,
+        (4 - 6 * x**2 + 3 * x**3) / 6,
+        np.where(x < 2, (2 - x) ** 3 / 6, 0.0),
+    )
+
+
+def _bspline_displacements(parameter_map: dict, points: np.ndarray) -> np.ndarray:
+    # Displacements of a cubic B-spline transform at points in ITK axis order,
+    # which are zero where the support of a point is not inside the grid
+    dimension = points.shape[1]
+    size = _values(parameter_map, "GridSize").astype(int)
+    origin = _values(parameter_map, "GridOrigin")
+    spacing = _values(parameter_map, "GridSpacing")
+    # elastix stores the direction cosines column by column
+    direction = _values(
+        parameter_map, "GridDirection", np.eye(dimension).ravel()
+    ).reshape(dimension, dimension, order="F")
+    grid_index = _values(parameter_map, "GridIndex", [0] * dimension)
+    # One coefficient image per axis, in NumPy axis order
+    coefficients = _values(parameter_map, "TransformParameters").reshape(
+        (dimension,) + tuple(size[::-1])
+    )
+
+    indices = np.linalg.solve(direction, (points - origin).T).T / spacing
+    indices -= grid_index
+    start = np.floor(indices - 1).astype(int)
+    # The weights of the 4 coefficients of the support per axis
+    weights = _cubic_bspline(
+        indices[:, :, np.newaxis] - start[:, :, np.newaxis] - np.arange(4)
+    )
+    inside = np.all((start >= 0) & (start + 4 <= size), axis=1)
+    start = np.clip(start, 0, size - 4)
+
+    displacements = np.zeros_like(points)
+    for offsets in itertools.product(range(4), repeat=dimension):
+        weight = np.prod(
+            [weights[:, axis, offset] for axis, offset in enumerate(offsets)], axis=0
+        )
+        index = tuple((start + offsets).T[::-1])
+        displacements += weight[:, np.newaxis] * coefficients[(slice(None),) + index].T
+    displacements[~inside] = 0
+    return displacements
+
+
+def _in_memory_parameter_maps(parameter_maps: List[dict]) -> bool:
+    return all(
+        parameter_map["Transform"][0] in _MATRIX_TRANSFORMS
+        or (
+            parameter_map["Transform"][0] in _BSPLINE_TRANSFORMS
+            and parameter_map.get("BSplineTransformSplineOrder", ["3"])[0] == "3"
+        )
+        for parameter_map in parameter_maps
+    )
+
+
+def _transformix_point_coordinates(
+    coordinates: np.ndarray, parameter_maps: List[dict]
+) -> np.ndarray:
+    # Transforms points with transformix, which only reads points from a file
+    grid = OutputGrid.from_parameter_maps(parameter_maps)
+    dimension = coordinates.shape[1]
+    with tempfile.TemporaryDirectory() as directory:
+        point_set_file_name = os.path.join(directory, "points.txt")
+        write_point_set(point_set_file_name, coordinates)
+
+        # Only transform the points, not an image of the full output size
+        single_pixel = (0,) * dimension, (1,) * dimension
+        transformix_object = itk.TransformixFilter.New(
+            itk.image_view_from_array(np.zeros((1,) * dimension, np.float32))
+        )
+        transformix_object.SetTransformParameterObject(
+            parameter_object_from_dicts(
+                grid.block_parameter_maps(parameter_maps, *single_pixel)
+            )
+        )
+        transformix_object.SetFixedPointSetFileName(point_set_file_name)
+        transformix_object.SetOutputDirectory(directory)
+        transformix_object.SetLogToConsole(False)
+        transformix_object.UpdateLargestPossibleRegion()
+
+        output = Path(directory, "outputpoints.txt").read_text()
+
+    values = " ".join(_OUTPUT_POINT_PATTERN.findall(output)).split()
+    return np.array(values, float).reshape(-1, dimension)[:, ::-1]
+
+
+def transform_point_coordinates(
+    coordinates: np.ndarray, parameter_maps: List[dict]
+) -> np.ndarray:
+    """
+    Transforms points in memory, with vectorized NumPy. Like elastix, the
+    transform maps points from the fixed image to the moving image. The
+    points of transforms other than the translation, Euler, similarity,
+    affine and cubic B-spline transforms are transformed by transformix.
+    """
+    dimension = len(parameter_maps[-1]["Size"])
+    coordinates = np.asarray(coordinates, float).reshape(-1, dimension)
+    parameter_maps = _initial_parameter_maps(parameter_maps[0]) + list(parameter_maps)
+    if not _in_memory_parameter_maps(parameter_maps):
+        return _transformix_point_coordinates(coordinates, parameter_maps)
+
+    # Each transform starts from the transforms before it, which it is either
+    # composed with or added to
+    points = coordinates[:, ::-1]
+    transformed = points
+    for parameter_map in parameter_maps:
+        combine = parameter_map.get("HowToCombineTransforms", ["Compose"])[0]
+        inputs = points if combine == "Add" else transformed
+        if parameter_map["Transform"][0] in _BSPLINE_TRANSFORMS:
+            outputs = inputs + _bspline_displacements(parameter_map, inputs)
+        else:
+            matrix, offset = _matrix_and_offset(parameter_map, dimension)
+            outputs = inputs @ matrix.T + offset
+        transformed = transformed + outputs - points if combine == "Add" else outputs
+    return transformed[:, ::-1]
+
+
+def landmark_errors(
+    fixed_points: np.ndarray, moving_points: np.ndarray, parameter_maps: List[dict]
+) -> np.ndarray:
+    """
+    Returns the distance between each transformed fixed point and the
+    corresponding moving point.
+    """
+    transformed = transform_point_coordinates(fixed_points, parameter_maps)
+    return np.linalg.norm(transformed - np.asarray(moving_points, float), axis=1)
@@ -0,0 +1,55 @@
+"""Runs work in pools of spawned processes, or in a terminable one."""
+import multiprocessing
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from typing import Callable
+
+# Seconds between checks of whether a run is cancelled
+CANCEL_POLL_INTERVAL = 0.1
+
+# Per worker process state, set by the initializer of process_pool
+worker_state = {}
+
+
+def spawn_context() -> multiprocessing.context.BaseContext:
+    # Use spawn, as forking a process that runs Qt and ITK threads is unsafe
+    return multiprocessing.get_context("spawn")
+
+
+def _initialize_worker(initializer, initargs):
+    worker_state.update(initializer(*initargs))
+
+
+def process_pool(
+    max_workers: int, initializer: Callable = None, initargs: tuple = ()
+) -> ProcessPoolExecutor:
+    """
+    Returns a pool of up to `max_workers` spawned processes. Each process
+    keeps the dictionary that `initializer` returns for `initargs` in
+    `worker_state`, so that the inputs that all jobs share are sent to each
+    process only once.
+    """
+    if initializer is None:
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn_context())
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=spawn_context(),
+        initializer=_initialize_worker,
+        initargs=(initializer, initargs),
+    )
+
+
+def call_in_process(function: Callable, *args, cancelled: threading.Event = None):
+    """
+    Calls `function` with `args` in a new process, and returns its result.
+    When `cancelled` is set, the process is terminated, instead of letting
+    it finish its work, and CancelledError is raised.
+    """
+    with spawn_context().Pool(1) as pool:
+        result = pool.apply_async(function, args)
+        while not result.ready():
+            if cancelled is not None and cancelled.is_set():
+                # Leaving the pool terminates its process
+                raise CancelledError()
+            result.wait(CANCEL_POLL_INTERVAL)
+        return result.get()
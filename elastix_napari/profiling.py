@@ -0,0 +1,175 @@
+"""Records the time and memory use of each stage of a run."""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+PROFILE_FILE_NAME = "profile.json"
+
+# Number of runs that currently trace allocations, so that tracing is only
+# stopped when the last of them finishes
+_tracing_runs = 0
+_tracing_lock = threading.Lock()
+
+
+def max_rss() -> int:
+    """
+    Returns the high-water mark of the resident memory of the process, in
+    bytes, or None when it is not available.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _start_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_runs = 1
+        elif _tracing_runs > 0:
+            _tracing_runs += 1
+
+
+def _stop_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs > 0:
+            _tracing_runs -= 1
+            if _tracing_runs == 0:
+                tracemalloc.stop()
+
+
+class RunProfile:
+    """
+    Timings and memory use of the stages of a run called `name`. When the
+    profile is not `enabled`, stages are not recorded, so that runs that are
+    not profiled do not pay for it.
+    """
+
+    def __init__(
+        self, name: str, enabled: bool = True, trace_allocations: bool = False
+    ):
+        self.name = name
+        self.enabled = enabled
+        self._stages = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._tracing = enabled and trace_allocations
+        if self._tracing:
+            _start_tracing()
+            # Also stop tracing when a run is abandoned without finishing
+            self._stop_tracing = weakref.finalize(self, _stop_tracing)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records the time and memory use of the code that runs in the context.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        tracing = self._tracing and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        max_rss_before = max_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            max_rss_after = max_rss()
+            record = {
+                "name": name,
+                "start": start - self._start,
+                "seconds": end - start,
+                "thread": threading.current_thread().name,
+                "max_rss": max_rss_after,
+                "max_rss_increase": None
+                if max_rss_after is None
+                else max_rss_after - max_rss_before,
+                "traced_peak": tracemalloc.get_traced_memory()[1] if tracing else None,
+            }
+            with self._lock:
+                self._stages.append(record)
+
+    def finish(self):
+        """
+        Stops tracing allocations. Calling it more than once has no effect.
+        """
+        if self._tracing:
+            self._tracing = False
+            self._stop_tracing()
+
+    def as_dict(self) -> dict:
+        """
+        Returns the stages recorded so far, in the order in which they
+        started, and the total time of the run until now.
+        """
+        with self._lock:
+            stages = sorted(
+                (dict(record) for record in self._stages),
+                key=lambda record: record["start"],
+            )
+        return {
+            "name": self.name,
+            "seconds": time.perf_counter() - self._start,
+            "max_rss": max_rss(),
+            "stages": stages,
+        }
+
+    def write(self, directory: os.PathLike) -> Path:
+        """
+        Writes the profile to PROFILE_FILE_NAME in `directory`, and returns
+        its path. Besides the profile, the file has the stages as complete
+        trace events, with times in microseconds, so that it can be opened in
+        chrome://tracing or https://ui.perfetto.dev.
+        """
+        profile = self.as_dict()
+        threads = {}
+        trace_events = []
+        for record in profile["stages"]:
+            thread_id = threads.setdefault(record["thread"], len(threads))
+            trace_events.append(
+                {
+                    "name": record["name"],
+                    "cat": self.name,
+                    "ph": "X",
+                    "ts": record["start"] * 1e6,
+                    "dur": record["seconds"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread_id,
+                    "args": {
+                        key: record[key]
+                        for key in ("max_rss", "max_rss_increase", "traced_peak")
+                    },
+                }
+            )
+        for thread_name, thread_id in threads.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": thread_id,
+                    "args": {"name": thread_name},
+                }
+            )
+        path = Path(directory) / PROFILE_FILE_NAME
+        path.write_text(json.dumps(dict(profile, traceEvents=trace_events), indent=2))
+        return path
@@ -0,0 +1,102 @@
+"""Reads elastix' iteration information while a registration is running."""
+import re
+from pathlib import Path
+from typing import List, NamedTuple
+
+import itk
+
+_ITERATION_INFO_PATTERN = re.compile(r"IterationInfo\.(\d+)\.R(\d+)\.txt$")
+
+
+class IterationInfo(NamedTuple):
+    parameter_map: int
+    resolution: int
+    iteration: int
+    metric: float
+    step_size: float
+
+
+def enable_iteration_info(parameter_object: "itk.ParameterObject"):
+    """
+    Makes elastix write its iteration information for every parameter map.
+    """
+    for index in range(parameter_object.GetNumberOfParameterMaps()):
+        parameter_object.SetParameter(index, "WriteIterationInfo", "true")
+
+
+def total_iterations(parameter_object: "itk.ParameterObject") -> int:
+    """
+    Returns the maximum number of iterations elastix can do over all parameter
+    maps and resolution levels.
+    """
+    total = 0
+    for index in range(parameter_object.GetNumberOfParameterMaps()):
+        resolutions = 1
+        if parameter_object.HasParameter(index, "NumberOfResolutions"):
+            resolutions = int(
+                parameter_object.GetParameter(index, "NumberOfResolutions")[0]
+            )
+        iterations = [500]
+        if parameter_object.HasParameter(index, "MaximumNumberOfIterations"):
+            iterations = [
+                int(float(value))
+                for value in parameter_object.GetParameter(
+                    index, "MaximumNumberOfIterations"
+                )
+            ]
+        # A single value applies to all resolution levels
+        iterations += iterations[-1:] * (resolutions - len(iterations))
+        total += sum(iterations[:resolutions])
+    return total
+
+
+def _column(header: List[str], prefix: str, name: str) -> int:
+    for index, column in enumerate(header):
+        if column.startswith(prefix) and column.endswith(name):
+            return index
+    return None
+
+
+def read_iteration_info(output_directory: Path) -> List[IterationInfo]:
+    """
+    Returns the iterations elastix has written to `output_directory` so far,
+    in the order in which they were done. elastix writes them to one
+    IterationInfo.<p>.R<r>.txt file per parameter map <p> and resolution
+    level <r>; itk-elastix does not expose iteration events.
+    """
+    files = []
+    for path in Path(output_directory).glob("IterationInfo.*.R*.txt"):
+        match = _ITERATION_INFO_PATTERN.search(path.name)
+        if match:
+            files.append((int(match.group(1)), int(match.group(2)), path))
+
+    result = []
+    for parameter_map, resolution, path in sorted(files):
+        lines = path.read_text().splitlines()
+        if not lines:
+            continue
+        header = lines[0].split("\t")
+        metric_column = _column(header, "2:", "Metric")
+        step_size_column = _column(header, "3", "StepSize")
+        # The last line may still be incomplete while elastix is writing
+        for line in lines[1:]:
+            values = line.split("\t")
+            if len(values) != len(header):
+                continue
+            try:
+                result.append(
+                    IterationInfo(
+                        parameter_map,
+                        resolution,
+                        int(values[0]),
+                        float(values[metric_column])
+                        if metric_column is not None
+                        else float("nan"),
+                        float(values[step_size_column])
+                        if step_size_column is not None
+                        else float("nan"),
+                    )
+                )
+            except ValueError:
+                continue
+    return result
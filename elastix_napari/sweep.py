@@ -0,0 +1,199 @@
+"""Registers a pair of images with many sets of options, and ranks them."""
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Dict, Iterator, List, NamedTuple, Sequence
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_to_dicts
+from elastix_napari.engine import create_parameter_object
+from elastix_napari.metrics import image_similarity
+from elastix_napari.points import landmark_errors
+from elastix_napari.processes import CANCEL_POLL_INTERVAL, process_pool, worker_state
+from elastix_napari.progress import enable_iteration_info, read_iteration_info
+from elastix_napari.threads import threads_per_worker
+
+class SweepResult(NamedTuple):
+    index: int
+    configuration: dict
+    elapsed: float
+    final_metric: float
+    # Mutual information (in nats) of the fixed image and the result image,
+    # which is comparable between metrics
+    mutual_information: float
+    # Mean distance between the transformed fixed points and the moving
+    # points, or None without points
+    landmark_error: float
+    transform_parameters: List[dict]
+    error: str
+
+    @property
+    def score(self) -> float:
+        # Lower is better, and results without a score rank last
+        score = self.landmark_error
+        if score is None and self.mutual_information is not None:
+            score = -self.mutual_information
+        if score is None or np.isnan(score):
+            return float("inf")
+        return score
+
+
+def configurations(
+    values: Dict[str, Sequence], samples: int = None, seed: int = 0
+) -> List[dict]:
+    """
+    Returns all combinations of the values of the options, or a random subset
+    of `samples` of them.
+    """
+    names = list(values)
+    grid = [
+        dict(zip(names, combination))
+        for combination in itertools.product(*(values[name] for name in names))
+    ]
+    if samples and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def _worker_state(fixed_image, moving_image, preset, points) -> dict:
+    return {
+        "fixed_image": itk.image_from_dict(fixed_image),
+        "moving_image": itk.image_from_dict(moving_image),
+        "preset": preset,
+        "points": points,
+    }
+
+
+def _register(index, configuration, number_of_threads):
+    start = time.perf_counter()
+    fixed_image = worker_state["fixed_image"]
+    points = worker_state["points"]
+    try:
+        parameter_object = create_parameter_object(
+            worker_state["preset"], advanced=True, **configuration
+        )
+        enable_iteration_info(parameter_object)
+        with tempfile.TemporaryDirectory() as output_directory:
+            result_image, result_transform_parameters = (
+                itk.elastix_registration_method(
+                    fixed_image,
+                    worker_state["moving_image"],
+                    parameter_object=parameter_object,
+                    output_directory=output_directory,
+                    log_to_console=False,
+                    number_of_threads=number_of_threads,
+                )
+            )
+            elapsed = time.perf_counter() - start
+            iterations = read_iteration_info(output_directory)
+        final_metric = iterations[-1].metric if iterations else float("nan")
+        mutual_information = image_similarity(fixed_image, result_image)[
+            "mutual_information"
+        ]
+
+        transform_parameters = parameter_object_to_dicts(result_transform_parameters)
+        landmark_error = None
+        if points is not None:
+            landmark_error = float(
+                np.mean(landmark_errors(*points, transform_parameters))
+            )
+        return SweepResult(
+            index,
+            configuration,
+            elapsed,
+            final_metric,
+            mutual_information,
+            landmark_error,
+            transform_parameters,
+            None,
+        )
+    except Exception as error:
+        return SweepResult(
+            index,
+            configuration,
+            time.perf_counter() - start,
+            None,
+            None,
+            None,
+            None,
+            str(error),
+        )
+
+
+def iter_sweep(
+    fixed_image: "itk.Image",
+    moving_image: "itk.Image",
+    configurations: Sequence[dict],
+    preset: str = "rigid",
+    fixed_points: np.ndarray = None,
+    moving_points: np.ndarray = None,
+    max_workers: int = None,
+    cancelled: threading.Event = None,
+) -> Iterator[SweepResult]:
+    """
+    Registers the images with each configuration of the advanced options of
+    `preset`, using up to `max_workers` processes that share the cores.
+    Yields a SweepResult per configuration, in the order in which they
+    finish. The points are physical coordinates in NumPy axis order. When
+    `cancelled` is set, or the generator is closed, the configurations that
+    have not started are cancelled, and no more results are yielded.
+    """
+    points = None
+    if fixed_points is not None and moving_points is not None:
+        points = (np.asarray(fixed_points, float), np.asarray(moving_points, float))
+    workers = min(max_workers or os.cpu_count() or 1, max(len(configurations), 1))
+
+    with process_pool(
+        workers,
+        _worker_state,
+        (
+            itk.dict_from_image(fixed_image.astype(itk.F)),
+            itk.dict_from_image(moving_image.astype(itk.F)),
+            preset,
+            points,
+        ),
+    ) as executor:
+        pending = {
+            executor.submit(
+                _register, index, configuration, threads_per_worker(workers)
+            )
+            for index, configuration in enumerate(configurations)
+        }
+        try:
+            while pending:
+                done, pending = wait(
+                    pending, CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                if cancelled is not None and cancelled.is_set():
+                    return
+                for future in done:
+                    yield future.result()
+        finally:
+            # Only wait for the configurations that are running, which elastix
+            # cannot interrupt
+            executor.shutdown(cancel_futures=True)
+
+
+def rank(results: Sequence[SweepResult]) -> List[SweepResult]:
+    """
+    Returns the results that succeeded from best to worst score, and those of
+    equal score from fastest to slowest.
+    """
+    return sorted(
+        (result for result in results if result.error is None),
+        key=lambda result: (result.score, result.elapsed),
+    )
+
+
+def fastest(results: Sequence[SweepResult], max_score: float) -> SweepResult:
+    """
+    Returns the fastest result with a score of at most `max_score`, or None.
+    """
+    accurate = [result for result in rank(results) if result.score <= max_score]
+    return min(accurate, key=lambda result: result.elapsed, default=None)
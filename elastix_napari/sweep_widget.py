@@ -0,0 +1,285 @@
+import os
+import threading
+from typing import TYPE_CHECKING, List
+from magicgui import magic_factory
+import numpy as np
+
+# For IDE type support and autocompletion
+# https://napari.org/stable/plugins/building_a_plugin/best_practices.html#don-t-require-napari-if-not-necessary
+if TYPE_CHECKING:
+    import napari
+
+from napari.utils import notifications
+from magicgui.widgets import ProgressBar, PushButton, Table
+from elastix_napari.transforms import transform_registry
+from elastix_napari.workers import (
+    add_progress_listener,
+    cancel_workers,
+    preload_in_background,
+    remove_progress_listener,
+    start_worker,
+)
+
+METRICS = [
+    "AdvancedMattesMutualInformation",
+    "AdvancedNormalizedCorrelation",
+    "AdvancedMeanSquares",
+]
+COLUMNS = [
+    "metric",
+    "resolutions",
+    "max_iterations",
+    "spatial_samples",
+    "max_step_length",
+    "time (s)",
+    "final metric",
+    "mutual information",
+    "landmark error",
+]
+
+
+def parse_values(text: str, value_type: type) -> list:
+    """
+    Returns the values of a comma separated list, such as "100, 250, 500".
+    """
+    values = text.replace(";", ",").split(",")
+    return [value_type(value) for value in values if value.strip()]
+
+
+def ranking_rows(results) -> List[dict]:
+    """
+    Returns a row per result that succeeded, from best to worst.
+    """
+    from elastix_napari.sweep import rank
+
+    return [
+        dict(
+            result.configuration,
+            **{
+                "time (s)": round(result.elapsed, 2),
+                "final metric": result.final_metric,
+                "mutual information": result.mutual_information,
+                "landmark error": result.landmark_error,
+            },
+        )
+        for result in rank(results)
+    ]
+
+
+def _table_value(rows: List[dict]) -> dict:
+    return {
+        "data": [[row.get(column) for column in COLUMNS] for row in rows],
+        "index": list(range(1, len(rows) + 1)),
+        "columns": COLUMNS,
+    }
+
+
+def on_init(widget):
+    """
+    Initializes widget layout.
+    Updates widget layout according to user input.
+    """
+    widget.native.setStyleSheet("QWidget{font-size: 12pt;}")
+
+    cancel_button = PushButton(text="cancel")
+    cancel_button.tooltip = "Cancel the sweeps that are still running"
+    cancel_button.changed.connect(lambda: cancel_workers("sweep"))
+    widget.append(cancel_button)
+
+    progress_bar = ProgressBar(value=0, min=0, max=1, label="finished runs")
+    progress_bar.visible = False
+    table = Table(value=_table_value([]))
+    table.read_only = True
+    table.visible = False
+    widget.extend([progress_bar, table])
+
+    def on_progress(progress):
+        results, total = progress
+        progress_bar.visible = True
+        progress_bar.max = max(total, 1)
+        progress_bar.value = len(results)
+        table.visible = True
+        table.value = _table_value(ranking_rows(results))
+
+    add_progress_listener("sweep", on_progress)
+    widget.native.destroyed.connect(
+        lambda: remove_progress_listener("sweep", on_progress)
+    )
+
+    widget.native.layout().addStretch()
+
+    preload_in_background()
+
+
+@magic_factory(
+    widget_init=on_init,
+    layout="vertical",
+    call_button="sweep",
+    preset={
+        "choices": ["translation", "rigid", "affine", "bspline"],
+        "tooltip": "Preset of which the advanced options are swept",
+    },
+    metrics={
+        "widget_type": "Select",
+        "choices": METRICS,
+        "tooltip": "Metrics to try",
+    },
+    resolutions={"tooltip": "Comma separated numbers of resolutions to try"},
+    max_iterations={
+        "tooltip": "Comma separated maximum numbers of iterations to try"
+    },
+    spatial_samples={
+        "tooltip": "Comma separated numbers of spatial samples to try"
+    },
+    max_step_length={"tooltip": "Comma separated maximum step lengths to try"},
+    samples={
+        "min": 0,
+        "tooltip": "Number of randomly chosen combinations to run, or 0 to run "
+        "all combinations",
+    },
+    fixed_points={
+        "tooltip": "Optionally score the results by their landmark error, with "
+        "these fixed points",
+    },
+    moving_points={
+        "tooltip": "Moving points that correspond to the fixed points",
+    },
+    max_landmark_error={
+        "min": 0,
+        "tooltip": "Choose the fastest combination with at most this landmark "
+        "error, or the one with the lowest error when 0",
+    },
+    max_workers={
+        "min": 1,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of registrations that run at the same time",
+    },
+)
+def elastix_parameter_sweep(
+    fixed_image: "napari.layers.Image" = None,
+    moving_image: "napari.layers.Image" = None,
+    preset: str = "rigid",
+    metrics: List[str] = ("AdvancedMattesMutualInformation",),
+    resolutions: str = "4",
+    max_iterations: str = "250, 500",
+    spatial_samples: str = "512, 2048",
+    max_step_length: str = "1.0",
+    samples: int = 0,
+    fixed_points: "napari.layers.Points" = None,
+    moving_points: "napari.layers.Points" = None,
+    max_landmark_error: float = 0.0,
+    max_workers: int = min(os.cpu_count() or 1, 2),
+    viewer: "napari.viewer.Viewer" = None,
+) -> "napari.layers.Image":
+    """
+    Registers the images with each combination of the values of the advanced
+    options (or a random subset of them), running several registrations in
+    parallel, and ranks them by landmark error when corresponding points are
+    given, or else by the mutual information of the fixed image and the
+    result image. The result of the best
+    combination is returned, and the ranking, with the time of each
+    combination, is kept in its "sweep" metadata.
+    """
+    if fixed_image is None or moving_image is None:
+        notifications.show_error("No images selected for registration.")
+        return None
+
+    try:
+        values = {
+            "metric": list(metrics),
+            "resolutions": parse_values(resolutions, int),
+            "max_iterations": parse_values(max_iterations, int),
+            "spatial_samples": parse_values(spatial_samples, int),
+            "max_step_length": parse_values(max_step_length, float),
+        }
+    except ValueError:
+        notifications.show_error("Values must be comma separated numbers")
+        return None
+    if not all(values.values()):
+        notifications.show_error("Specify at least one value of each option")
+        return None
+
+    if (fixed_points is None) != (moving_points is None):
+        notifications.show_error("Please specify both the fixed and moving points!")
+        return None
+    if fixed_points is not None and len(fixed_points.data) != len(moving_points.data):
+        notifications.show_error(
+            "The fixed and moving points must have the same number of points"
+        )
+        return None
+
+    import itk
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.batch import parameter_object_from_dicts
+    from elastix_napari.conversion import image_view_from_layer
+    from elastix_napari.points import physical_points_from_layer
+    from elastix_napari.sweep import configurations, fastest, iter_sweep, rank
+
+    points = [None, None]
+    if fixed_points is not None:
+        # Landmark errors are measured in physical coordinates
+        points = [
+            physical_points_from_layer(layer)
+            for layer in (fixed_points, moving_points)
+        ]
+
+    jobs = configurations(values, samples)
+    fixed = image_view_from_layer(fixed_image, np.float32)
+    moving = image_view_from_layer(moving_image, np.float32)
+    finished = []
+    cancelled = threading.Event()
+
+    def sweep():
+        for result in iter_sweep(
+            fixed,
+            moving,
+            jobs,
+            preset,
+            *points,
+            max_workers=max_workers,
+            cancelled=cancelled,
+        ):
+            finished.append(result)
+            if result.error is not None:
+                notifications.show_warning(
+                    f"Registration with {result.configuration} failed: "
+                    f"{result.error}"
+                )
+
+        if cancelled.is_set():
+            return None
+        ranking = rank(finished)
+        if not ranking:
+            notifications.show_error("All registrations of the sweep failed")
+            return None
+        chosen = ranking[0]
+        if max_landmark_error > 0 and fixed_points is not None:
+            chosen = fastest(finished, max_landmark_error) or chosen
+
+        transform_parameters = parameter_object_from_dicts(chosen.transform_parameters)
+        layer = image_layer_from_image(
+            itk.transformix_filter(moving, transform_parameters)
+        )
+        layer.name = f"{preset} sweep result"
+        layer.metadata["configuration"] = chosen.configuration
+        layer.metadata["sweep"] = ranking_rows(finished)
+        layer.metadata["transform"] = transform_registry.add(
+            layer.name, transform_parameters
+        )
+        notifications.show_info(
+            f"Chose {chosen.configuration} of {len(ranking)} combinations, "
+            f"which took {chosen.elapsed:.1f} s"
+        )
+        return layer
+
+    if viewer is None:
+        return sweep()
+
+    start_worker(
+        viewer,
+        sweep,
+        "sweep",
+        monitor=lambda: (list(finished), len(jobs)),
+        cancelled=cancelled,
+    )
+    return None
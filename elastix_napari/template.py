@@ -0,0 +1,102 @@
+"""Builds a population template (atlas) by group-wise registration."""
+import os
+import threading
+import time
+from typing import Callable, Iterator, List, NamedTuple, Sequence, Union
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import BatchResult, iter_batch_registration
+
+
+class TemplateRound(NamedTuple):
+    round: int
+    template: "itk.Image"
+    # Names of the subjects that were averaged, and of those that failed
+    registered: List[str]
+    failed: List[str]
+    elapsed: float
+
+
+class StreamingMean:
+    """
+    Mean of images on the same grid, accumulated one image at a time, so
+    that only the sum is kept in memory.
+    """
+
+    def __init__(self, reference: "itk.Image"):
+        self.reference = reference
+        self.count = 0
+        self._sum = np.zeros(itk.array_view_from_image(reference).shape, np.float64)
+
+    def add(self, image: "itk.Image"):
+        self._sum += itk.array_view_from_image(image)
+        self.count += 1
+
+    def mean(self) -> "itk.Image":
+        """
+        Returns the mean as a float image with the metadata of the reference.
+        """
+        mean = itk.image_view_from_array(
+            (self._sum / max(self.count, 1)).astype(np.float32)
+        )
+        mean.CopyInformation(self.reference)
+        return mean
+
+
+def iter_template_building(
+    subjects: Sequence[Union["itk.Image", str, os.PathLike]],
+    parameter_object: "itk.ParameterObject",
+    rounds: int = 3,
+    initial_template: "itk.Image" = None,
+    names: Sequence[str] = None,
+    max_workers: int = None,
+    on_result: Callable[[BatchResult], None] = None,
+    cancelled: threading.Event = None,
+    **kwargs,
+) -> Iterator[TemplateRound]:
+    """
+    Registers all subjects (images or image files) to the template, in
+    parallel, and makes the mean of the results the new template, for
+    `rounds` rounds. The initial template is the first subject, unless
+    `initial_template` is given. Yields a TemplateRound per round, and calls
+    `on_result` with the BatchResult of each registration. When `cancelled`
+    is set, the registrations that have not started are cancelled, and no
+    more rounds are yielded. Additional keyword arguments are passed to
+    batch.iter_batch_registration.
+    """
+    template = initial_template
+    if template is None:
+        template = subjects[0]
+        if isinstance(template, (str, os.PathLike)):
+            template = itk.imread(os.fspath(template), itk.F)
+
+    for round_index in range(rounds):
+        start = time.perf_counter()
+        mean = StreamingMean(template)
+        registered, failed = [], []
+        for result in iter_batch_registration(
+            template,
+            subjects,
+            parameter_object,
+            names=names,
+            max_workers=max_workers,
+            cancelled=cancelled,
+            **kwargs,
+        ):
+            if on_result is not None:
+                on_result(result)
+            if result.error is not None:
+                failed.append(result.name)
+                continue
+            mean.add(result.result_image)
+            registered.append(result.name)
+        if cancelled is not None and cancelled.is_set():
+            return
+        if not registered:
+            raise RuntimeError(f"All registrations of round {round_index + 1} failed")
+        template = mean.mean()
+        yield TemplateRound(
+            round_index + 1, template, registered, failed, time.perf_counter() - start
+        )
@@ -0,0 +1,185 @@
+import os
+import threading
+from typing import TYPE_CHECKING, List
+from magicgui import magic_factory
+import numpy as np
+from pathlib import Path
+
+# For IDE type support and autocompletion
+# https://napari.org/stable/plugins/building_a_plugin/best_practices.html#don-t-require-napari-if-not-necessary
+if TYPE_CHECKING:
+    import napari
+
+from napari.utils import notifications
+from magicgui.widgets import Label, ProgressBar, PushButton
+from elastix_napari.workers import (
+    add_progress_listener,
+    cancel_workers,
+    preload_in_background,
+    remove_progress_listener,
+    start_worker,
+)
+
+
+def on_init(widget):
+    """
+    Initializes widget layout.
+    Updates widget layout according to user input.
+    """
+    widget.native.setStyleSheet("QWidget{font-size: 12pt;}")
+
+    widget.parameterfile.visible = False
+
+    @widget.preset.changed.connect
+    def on_preset_changed(value):
+        widget.parameterfile.visible = value == "custom"
+
+    cancel_button = PushButton(text="cancel")
+    cancel_button.tooltip = "Cancel the template building that is still running"
+    cancel_button.changed.connect(lambda: cancel_workers("template"))
+    widget.append(cancel_button)
+
+    progress_bar = ProgressBar(value=0, min=0, max=1, label="registrations")
+    round_label = Label(value="")
+    progress_bar.visible = False
+    round_label.visible = False
+    widget.extend([progress_bar, round_label])
+
+    def on_progress(progress):
+        templates, finished, total = progress
+        progress_bar.visible = True
+        round_label.visible = True
+        progress_bar.max = max(total, 1)
+        progress_bar.value = finished
+        round_label.value = f"finished rounds: {len(templates)}"
+
+    add_progress_listener("template", on_progress)
+    widget.native.destroyed.connect(
+        lambda: remove_progress_listener("template", on_progress)
+    )
+
+    widget.native.layout().addStretch()
+
+    preload_in_background()
+
+
+@magic_factory(
+    widget_init=on_init,
+    layout="vertical",
+    call_button="build template",
+    subjects={"tooltip": "Images of the population"},
+    initial_template={
+        "tooltip": "Template of the first round, or the first subject when "
+        "none is selected",
+    },
+    preset={
+        "choices": ["translation", "rigid", "affine", "bspline", "custom"],
+        "tooltip": "Select a preset parameter file or select "
+        "the 'custom' option to load a custom one",
+    },
+    parameterfile={
+        "filter": "*.txt;*.toml",
+        "tooltip": "Load a custom parameter file",
+    },
+    rounds={
+        "min": 1,
+        "tooltip": "Number of times the subjects are registered to the "
+        "template, and averaged into a new template",
+    },
+    max_workers={
+        "min": 1,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of registrations that run at the same time",
+    },
+)
+def elastix_template_building(
+    subjects: List["napari.layers.Image"] = (),
+    initial_template: "napari.layers.Image" = None,
+    preset: str = "affine",
+    parameterfile: Path = "",
+    rounds: int = 3,
+    max_workers: int = min(os.cpu_count() or 1, 2),
+    viewer: "napari.viewer.Viewer" = None,
+) -> List["napari.layers.Image"]:
+    """
+    Builds a population template: registers all subjects to the template in
+    parallel, and averages the results into the template of the next round.
+    The template of each round is shown as a layer as soon as the round
+    finishes.
+    """
+    if len(subjects) < 2:
+        notifications.show_error("Select at least two subjects.")
+        return None
+
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.conversion import image_view_from_layer
+    from elastix_napari.engine import create_parameter_object
+    from elastix_napari.template import iter_template_building
+
+    try:
+        parameter_object = create_parameter_object(preset, [parameterfile])
+    except ValueError:
+        notifications.show_error("Parameter file not found or not valid")
+        return None
+
+    images = [image_view_from_layer(layer, np.float32) for layer in subjects]
+    template = None
+    if initial_template is not None:
+        template = image_view_from_layer(initial_template, np.float32)
+    # Templates of the finished rounds, and the number of registrations
+    templates = []
+    finished = []
+    cancelled = threading.Event()
+
+    def template_layer(template_round):
+        layer = image_layer_from_image(template_round.template)
+        layer.name = f"template round {template_round.round}"
+        layer.metadata["registered"] = template_round.registered
+        layer.metadata["elapsed"] = template_round.elapsed
+        return layer
+
+    def build():
+        try:
+            for template_round in iter_template_building(
+                images,
+                parameter_object,
+                rounds,
+                template,
+                names=[layer.name for layer in subjects],
+                max_workers=max_workers,
+                on_result=finished.append,
+                cancelled=cancelled,
+            ):
+                if template_round.failed:
+                    notifications.show_warning(
+                        f"Registration of {', '.join(template_round.failed)} "
+                        f"failed in round {template_round.round}"
+                    )
+                templates.append(template_round)
+        except RuntimeError as error:
+            notifications.show_error(str(error))
+
+    if viewer is None:
+        build()
+        return [template_layer(template_round) for template_round in templates]
+
+    # Show the template of each round as soon as the round finishes. The
+    # progress of the worker is received on the main thread.
+    shown = set()
+
+    def show_templates(progress):
+        for template_round in progress[0]:
+            if template_round.round not in shown:
+                shown.add(template_round.round)
+                viewer.add_layer(template_layer(template_round))
+
+    worker = start_worker(
+        viewer,
+        build,
+        "template",
+        monitor=lambda: (list(templates), len(finished), rounds * len(images)),
+        cancelled=cancelled,
+    )
+    # Only the progress of this build shows its templates
+    worker.yielded.connect(show_templates)
+    return None
@@ -0,0 +1,49 @@
+import threading
+
+import itk
+import numpy as np
+from elastix_napari.batch import batch_registration, iter_batch_registration
+from itk_napari_conversion import image_from_image_layer
+
+
+def test_batch_registration(images_2D, default_rigid, data_dir):
+    fixed_image, moving_image = images_2D
+    fixed_image = image_from_image_layer(fixed_image)
+    moving_image = image_from_image_layer(moving_image)
+
+    results = batch_registration(
+        fixed_image,
+        [moving_image, data_dir / "CT_2D_head_moving.mha", data_dir / "missing.mha"],
+        default_rigid,
+        max_workers=2,
+    )
+
+    reference_result_image, _ = itk.elastix_registration_method(
+        fixed_image, moving_image, parameter_object=default_rigid
+    )
+    assert [result.index for result in results] == [0, 1, 2]
+    for result in results[:2]:
+        assert result.error is None
+        assert result.elapsed > 0
+        assert np.allclose(result.result_image, reference_result_image)
+        assert result.result_transform_parameters.GetNumberOfParameterMaps() == 1
+
+    # A failing job is reported without stopping the batch
+    assert results[2].name == "missing.mha"
+    assert results[2].result_image is None
+    assert results[2].error
+
+
+def test_cancelled_batch_registration(images_2D, default_rigid, data_dir):
+    fixed_image, _ = images_2D
+    cancelled = threading.Event()
+    cancelled.set()
+    results = iter_batch_registration(
+        image_from_image_layer(fixed_image),
+        [data_dir / "CT_2D_head_moving.mha"] * 4,
+        default_rigid,
+        max_workers=1,
+        cancelled=cancelled,
+    )
+    # Jobs that have not started are cancelled, without results
+    assert list(results) == []
@@ -0,0 +1,114 @@
+import itk
+import numpy as np
+from napari.components import ViewerModel
+from elastix_napari import elastix_registration
+from elastix_napari.cache import RegistrationCache, content_hash, registration_cache
+
+
+def create_image(value, shape=(10, 10)):
+    return itk.image_view_from_array(np.full(shape, value, np.float32))
+
+
+def test_content_hash(default_rigid):
+    image = create_image(1)
+    assert content_hash(image, default_rigid) == content_hash(
+        create_image(1), default_rigid
+    )
+    assert content_hash(image, default_rigid) != content_hash(
+        create_image(2), default_rigid
+    )
+
+    spaced_image = create_image(1)
+    spaced_image["spacing"] = np.array([2.0, 2.0])
+    assert content_hash(image) != content_hash(spaced_image)
+
+    default_rigid.SetParameter(0, "MaximumNumberOfIterations", "10")
+    assert content_hash(image, default_rigid) != content_hash(
+        image, itk.ParameterObject.New()
+    )
+
+
+def test_lru_eviction(default_rigid):
+    image_bytes = 10 * 10 * 4
+    cache = RegistrationCache(max_bytes=2 * image_bytes)
+    cache.put("a", create_image(1), default_rigid)
+    cache.put("b", create_image(2), default_rigid)
+    cache.get("a")
+    cache.put("c", create_image(3), default_rigid)
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    result_image, result_transform_parameters = cache.get("c")
+    assert np.all(np.asarray(result_image) == 3)
+    assert result_transform_parameters.GetNumberOfParameterMaps() == 1
+
+
+def test_disk_cache(default_rigid, tmpdir):
+    cache = RegistrationCache(max_bytes=0, directory=tmpdir)
+    cache.put("a", create_image(1), default_rigid)
+    assert len(cache) == 0
+
+    result_image, result_transform_parameters = cache.get("a")
+    assert np.all(np.asarray(result_image) == 1)
+    assert result_transform_parameters.GetParameter(0, "Transform") == (
+        default_rigid.GetParameter(0, "Transform")
+    )
+
+
+def test_registration_uses_cache(images_2D, monkeypatch):
+    fixed_image, moving_image = images_2D
+    registration_cache.clear()
+    widget = elastix_registration.elastix_registration()
+    first = widget(fixed_image, moving_image, preset="translation")
+    assert len(registration_cache) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("elastix should not run again")
+
+    monkeypatch.setattr(itk, "elastix_registration_method", fail)
+    second = widget(fixed_image, moving_image, preset="translation")
+    assert np.array_equal(first.data, second.data)
+
+
+def test_registration_cache_directory(images_2D, tmp_path):
+    fixed_image, moving_image = images_2D
+    registration_cache.clear()
+    widget = elastix_registration.elastix_registration()
+    try:
+        first = widget(
+            fixed_image, moving_image, preset="translation", cache_directory=tmp_path
+        )
+        assert len(list(tmp_path.glob("*.json"))) == 1
+
+        # Results of earlier sessions are read back from the directory
+        registration_cache.clear()
+        second = widget(
+            fixed_image, moving_image, preset="translation", cache_directory=tmp_path
+        )
+        assert np.array_equal(first.data, second.data)
+        assert len(registration_cache) == 1
+        # Without a directory, results are only kept in memory again
+        widget(fixed_image, moving_image, preset="translation")
+        assert registration_cache.directory is None
+    finally:
+        registration_cache.directory = None
+
+
+def test_background_registration_uses_cache(images_2D, qtbot):
+    fixed_image, moving_image = images_2D
+    registration_cache.clear()
+    viewer = ViewerModel()
+    widget = elastix_registration.elastix_registration()
+
+    # The first run is in the background, with its progress followed
+    assert widget(fixed_image, moving_image, preset="translation", viewer=viewer) is None
+    qtbot.waitUntil(lambda: "translation Registration" in viewer.layers, timeout=60000)
+    assert len(registration_cache) == 1
+
+    # The second run is a cache hit, of which the result is added right away
+    assert widget(fixed_image, moving_image, preset="translation", viewer=viewer) is None
+    first, second = [
+        layer for layer in viewer.layers if layer.name.startswith("translation")
+    ]
+    assert np.array_equal(second.data, first.data)
+    assert len(registration_cache) == 1
@@ -0,0 +1,101 @@
+import pytest
+import tracemalloc
+import numpy as np
+import dask.array as da
+import itk
+from napari.layers import Image
+from elastix_napari import conversion
+from elastix_napari.conversion import (
+    cast_array,
+    image_view_from_layer,
+    region_from_world_box,
+)
+from itk_napari_conversion import image_from_image_layer
+
+
+def test_float_layer_is_not_copied(images):
+    fixed_image, _ = images
+    image = image_view_from_layer(fixed_image)
+
+    assert np.shares_memory(itk.array_view_from_image(image), fixed_image.data)
+    reference = image_from_image_layer(fixed_image)
+    assert np.allclose(image.GetSpacing(), reference.GetSpacing())
+    assert np.allclose(image.GetOrigin(), reference.GetOrigin())
+
+
+def test_bool_mask_is_not_copied():
+    mask = np.zeros([10, 100, 100], bool)
+    mask[:, :90, :] = True
+    image = image_view_from_layer(Image(mask), np.uint8)
+
+    assert np.shares_memory(itk.array_view_from_image(image), mask)
+    assert itk.template(image)[1][0] is itk.UC
+
+
+def test_cast_peak_memory(monkeypatch):
+    monkeypatch.setattr(conversion, "CHUNK_BYTES", 1024**2)
+    data = np.arange(64 * 128 * 128, dtype=np.uint16).reshape(64, 128, 128)
+    expected = data.astype(np.float32)
+
+    tracemalloc.start()
+    result = cast_array(data, np.float32)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert np.array_equal(result, expected)
+    # Only the result and one chunk are allocated, not a full size temporary
+    assert peak < expected.nbytes + 2 * conversion.CHUNK_BYTES
+
+
+def test_downsampled_image_view_from_layer():
+    data = np.arange(8 * 12, dtype=np.float32).reshape(8, 12)
+    image = conversion.downsampled_image_view_from_layer(
+        Image(data, scale=(0.5, 1.0)), 4
+    )
+    assert np.array_equal(itk.array_view_from_image(image), data[::4, ::4])
+    assert np.allclose(image["spacing"], (2.0, 4.0))
+
+    multiscale = Image([data, data[::2, ::2], data[::4, ::4]], multiscale=True)
+    image = conversion.downsampled_image_view_from_layer(multiscale, 2)
+    assert itk.array_view_from_image(image).shape == (4, 6)
+    assert np.allclose(image["spacing"], (2.0, 2.0))
+
+
+def test_level_and_region_of_lazy_layer():
+    data = np.arange(8 * 12, dtype=np.float32).reshape(8, 12)
+    levels = [da.from_array(data, chunks=4), da.from_array(data[::2, ::2], chunks=4)]
+    layer = Image(levels, multiscale=True, translate=(1.0, 2.0))
+
+    image = image_view_from_layer(layer, level=1, region=[(1, 3), (2, 6)])
+    assert np.array_equal(itk.array_view_from_image(image), data[::2, ::2][1:3, 2:6])
+    assert np.allclose(image["spacing"], (2.0, 2.0))
+    assert np.allclose(image["origin"], (3.0, 6.0))
+
+
+def test_region_from_world_box():
+    layer = Image(np.zeros((20, 30), np.float32), scale=(2, 3), translate=(10, 0))
+
+    assert region_from_world_box(layer, [[14, 9], [30, 30]]) == [(2, 11), (3, 11)]
+    assert region_from_world_box(layer, [[14, 9], [30, 30]], margin=5) == [
+        (0, 16),
+        (0, 16),
+    ]
+    # Only the last axis is restricted
+    assert region_from_world_box(layer, [[9], [30]]) == [(0, 20), (3, 11)]
+    with pytest.raises(ValueError):
+        region_from_world_box(layer, [[100, 0], [120, 10]])
+
+
+def test_memory_mapped_files(tmp_path):
+    data = np.random.default_rng(0).random((20, 30)).astype(np.float32)
+    np.save(tmp_path / "image.npy", data)
+    image = conversion.image_view_from_file(tmp_path / "image.npy")
+    assert np.array_equal(itk.array_view_from_image(image), data)
+
+    itk.imwrite(itk.image_from_array(data), str(tmp_path / "image.mha"))
+    assert np.array_equal(conversion.image_view_from_file(tmp_path / "image.mha"), data)
+
+    image["spacing"] = [2.0, 3.0]
+    result = conversion.memory_mapped_image(image, tmp_path / "result.npy")
+    assert np.array_equal(result["spacing"], [2.0, 3.0])
+    assert np.array_equal(np.load(tmp_path / "result.npy"), data)
@@ -5,7 +5,14 @@ import pytest
 MY_PLUGIN_NAME = "elastix-napari"
 
 # Names of the widgets
-MY_WIDGET_NAMES = ["elastix_registration", "transformix"]
+MY_WIDGET_NAMES = [
+    "elastix_registration",
+    "transformix",
+    "elastix_batch_registration",
+    "elastix_parameter_sweep",
+    "elastix_template_building",
+    "job queue",
+]
 
 
 @pytest.mark.parametrize("widget_name", MY_WIDGET_NAMES)
@@ -0,0 +1,89 @@
+import csv
+import subprocess
+import sys
+import itk
+import numpy as np
+from elastix_napari import cli, elastix_registration
+from elastix_napari.engine import create_parameter_object, read_manifest, run_jobs
+from itk_napari_conversion import image_from_image_layer
+
+
+def test_engine_does_not_import_napari():
+    code = "import sys, elastix_napari.cli; print('napari' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "False"
+
+
+def test_create_parameter_object(default_rigid):
+    parameter_object = create_parameter_object("rigid")
+    assert parameter_object.GetParameterMap(0).asdict() == (
+        parameter_object.GetDefaultParameterMap("rigid", 4).asdict()
+    )
+
+    parameter_object = create_parameter_object(
+        "rigid", advanced=True, max_iterations=50, use_corresponding_points=True
+    )
+    assert parameter_object.GetParameter(0, "MaximumNumberOfIterations") == ("50",)
+    assert parameter_object.GetParameter(0, "Metric")[-1] == (
+        "CorrespondingPointsEuclideanDistanceMetric"
+    )
+
+
+def test_manifest_matches_widget(images_2D, data_dir, tmpdir):
+    manifest = tmpdir / "manifest.csv"
+    manifest.write_text(
+        "name,fixed,moving,output,preset,advanced,max_iterations\n"
+        f"head,{data_dir / 'CT_2D_head_fixed.mha'},"
+        f"{data_dir / 'CT_2D_head_moving.mha'},head.mha,rigid,true,100\n"
+        f"missing,{data_dir / 'missing.mha'},"
+        f"{data_dir / 'CT_2D_head_moving.mha'},missing.mha,rigid,,\n",
+        "utf-8",
+    )
+    jobs = read_manifest(manifest)
+    assert jobs[0]["advanced"] is True
+    assert jobs[0]["max_iterations"] == 100
+
+    results = run_jobs(jobs, max_workers=2)
+    assert results[0].error is None
+    # Metrics are only computed on request
+    assert results[0].metrics is None
+    assert results[1].error
+
+    fixed_image, moving_image = images_2D
+    widget_result = elastix_registration.elastix_registration()(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        advanced=True,
+        max_iterations=100,
+        use_cache=False,
+    )
+    assert np.allclose(
+        itk.imread(str(tmpdir / "head.mha")), image_from_image_layer(widget_result)
+    )
+    assert (tmpdir / "head.TransformParameters.0.txt").exists()
+
+
+def test_cli(data_dir, tmpdir):
+    output = tmpdir / "result.mha"
+    exit_code = cli.main(
+        [
+            "--fixed",
+            str(data_dir / "CT_2D_head_fixed.mha"),
+            "--moving",
+            str(data_dir / "CT_2D_head_moving.mha"),
+            "--output",
+            str(output),
+            "--preset",
+            "translation",
+            "--metrics",
+            str(tmpdir / "metrics.csv"),
+        ]
+    )
+    assert exit_code == 0
+    assert output.exists()
+    with open(tmpdir / "metrics.csv", newline="") as metrics_file:
+        rows = list(csv.DictReader(metrics_file))
+    assert float(rows[0]["ncc"]) > 0
@@ -0,0 +1,79 @@
+import itk
+import numpy as np
+from elastix_napari import transformix_widget
+from elastix_napari.fields import (
+    field_cache,
+    transform_fields,
+    transformix_with_fields,
+    warp_with_field,
+)
+
+
+def test_warp_with_field(data_dir):
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(
+        str(data_dir / "TransformParameters.0_2D.txt")
+    )
+    transform_parameter_object.SetParameter(0, "TransformParameters", ["0.1", "2", "3"])
+    transform_parameter_object.SetParameter(
+        0, "ResampleInterpolator", "FinalLinearInterpolator"
+    )
+    y, x = np.mgrid[:100, :100]
+    image = itk.image_view_from_array((np.sin(x / 7) + np.cos(y / 5)).astype(np.float32))
+
+    field_cache.clear()
+    result_image, fields = transformix_with_fields(image, transform_parameter_object)
+    assert np.allclose(fields.jacobian_determinant, 1, atol=1e-4)
+
+    # Fields are stored regardless of the interpolator
+    transform_parameter_object.SetParameter(
+        0, "ResampleInterpolator", "FinalNearestNeighborInterpolator"
+    )
+    assert field_cache.get(transform_parameter_object) is fields
+
+    warped = warp_with_field(image, fields.deformation_field)
+    # Only compare points that are mapped inside the image
+    inside = (slice(10, 90), slice(10, 90))
+    assert np.allclose(
+        np.asarray(warped)[inside], np.asarray(result_image)[inside], atol=1e-4
+    )
+
+
+def test_transformix_widget_fields(images_2D, data_dir):
+    _, moving_image = images_2D
+    field_cache.clear()
+    widget = transformix_widget.create_transformix_widget()
+    result = widget(
+        image=moving_image,
+        transform_file=data_dir / "TransformParameters.0_2D.txt",
+        deformation_field=True,
+        jacobian=True,
+    )
+    image_layer, field_layer, jacobian_layer = result
+    assert field_layer.name == "deformation field"
+    assert jacobian_layer.data.shape == image_layer.data.shape
+    assert len(field_cache) == 1
+
+    stored = widget(
+        image=moving_image,
+        transform_file=data_dir / "TransformParameters.0_2D.txt",
+        use_stored_field=True,
+    )
+    assert stored.data.shape == image_layer.data.shape
+
+
+def test_transform_fields(data_dir):
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(
+        str(data_dir / "TransformParameters.0_2D.txt")
+    )
+    image = itk.image_view_from_array(np.random.rand(100, 100).astype(np.float32))
+    field_cache.clear()
+    _, expected = transformix_with_fields(image, transform_parameter_object)
+
+    # The fields do not depend on the resampled image
+    field_cache.clear()
+    fields = transform_fields(transform_parameter_object)
+    assert np.allclose(fields.deformation_field, expected.deformation_field)
+    assert np.allclose(fields.jacobian_determinant, expected.jacobian_determinant)
+    assert transform_fields(transform_parameter_object) is fields
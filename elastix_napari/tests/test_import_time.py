@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+# Imports the widget modules after what napari itself has loaded when the
+# viewer is up, and reports whether they loaded ITK, which takes seconds
+CODE = """
+import sys
+import magicgui.widgets, napari.layers, napari.qt.threading, napari.utils
+import elastix_napari.batch_widget
+import elastix_napari.elastix_registration
+import elastix_napari.sweep_widget
+import elastix_napari.template_widget
+import elastix_napari.transformix_widget
+print([name in sys.modules for name in ("itk", "itk_napari_conversion")])
+"""
+
+
+def test_widget_imports():
+    output = subprocess.run(
+        [sys.executable, "-c", CODE], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "[False, False]"
+
+
+def test_preload_in_background():
+    code = (
+        "import sys\n"
+        "from elastix_napari.workers import preload_in_background\n"
+        "preload_in_background().join()\n"
+        "import itk\n"
+        "print('elastix_napari.engine' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "True"
+
+
+def test_headless_imports():
+    # The command line and the worker processes do not load napari, dask or
+    # SciPy, which only some outputs use
+    code = (
+        "import sys\n"
+        "import elastix_napari.cli, elastix_napari.sweep, elastix_napari.time_series\n"
+        "print([name in sys.modules for name in ('napari', 'dask', 'scipy')])\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "[False, False, False]"
@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+from napari.components import ViewerModel
+from elastix_napari import elastix_registration
+from elastix_napari.job_queue import (
+    CANCELLED,
+    FAILED,
+    FINISHED,
+    PENDING,
+    RUNNING,
+    JobQueue,
+    job_queue,
+)
+from elastix_napari.job_queue_widget import JobQueueWidget, queue_widget_call
+
+
+def test_queue_order_and_max_workers():
+    queue = JobQueue(max_workers=1)
+    release = threading.Event()
+    order = []
+
+    def run(name):
+        release.wait()
+        order.append(name)
+        return name
+
+    first = queue.submit("first", run, {"name": "first"})
+    second = queue.submit("second", run, {"name": "second"})
+    third = queue.submit("third", run, {"name": "third"})
+    assert [first.status, second.status, third.status] == [RUNNING, PENDING, PENDING]
+
+    queue.move(third, -1)
+    release.set()
+    assert queue.wait(timeout=10)
+    assert order == ["first", "third", "second"]
+    assert all(job.status == FINISHED for job in queue.jobs())
+    assert third.result == "third"
+    assert third.elapsed is not None
+
+
+def test_cancel_and_retry():
+    queue = JobQueue(max_workers=1)
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise RuntimeError("failed on purpose")
+
+    running = queue.submit("running", release.wait)
+    failing = queue.submit("failing", fail)
+    cancelled = queue.submit("cancelled", release.wait)
+    queue.cancel(cancelled)
+    queue.cancel(running)
+    release.set()
+    assert queue.wait(timeout=10)
+    assert running.status == CANCELLED and running.result is None
+    assert cancelled.status == CANCELLED and cancelled.started is None
+    assert failing.status == FAILED
+    assert failing.error == "failed on purpose"
+
+    retried = queue.retry(cancelled)
+    assert queue.wait(timeout=10)
+    assert retried.status == FINISHED
+
+    queue.clear_done()
+    assert len(queue) == 0
+
+
+def test_queue_widget(images_2D, qtbot):
+    viewer = ViewerModel()
+    queue_widget = JobQueueWidget(viewer)
+    fixed_image, moving_image = images_2D
+    fixed_image.name, moving_image.name = "fixed", "moving"
+    registration_widget = elastix_registration.elastix_registration()
+    for name in ["fixed_image", "moving_image"]:
+        getattr(registration_widget, name).choices = [fixed_image, moving_image]
+    registration_widget.fixed_image.value = fixed_image
+    registration_widget.moving_image.value = moving_image
+    registration_widget.preset.value = "translation"
+
+    job = queue_widget_call(registration_widget, "translation registration", viewer)
+    qtbot.waitUntil(lambda: job.done, timeout=60000)
+    assert job.status == FINISHED
+    qtbot.waitUntil(lambda: "translation Registration" in viewer.layers)
+    assert queue_widget.table.data.to_list()[-1][:2] == ["translation registration", FINISHED]
+    job_queue.clear_done()
+
+
+def test_queue_current_view(images_2D, qtbot):
+    # The layers of a job are added without a queue widget, and the current
+    # view is registered as it was when the job was queued
+    viewer = ViewerModel()
+    fixed_image, moving_image = images_2D
+    fixed_image.name, moving_image.name = "fixed", "moving"
+    viewer.add_layer(fixed_image)
+    viewer.scene.camera.zoom *= 4
+    registration_widget = elastix_registration.elastix_registration()
+    for name in ["fixed_image", "moving_image"]:
+        getattr(registration_widget, name).choices = [fixed_image, moving_image]
+    registration_widget.fixed_image.value = fixed_image
+    registration_widget.moving_image.value = moving_image
+    registration_widget.preset.value = "translation"
+    registration_widget.region_of_interest.value = "current view"
+
+    job = queue_widget_call(
+        registration_widget,
+        "current view",
+        viewer,
+        elastix_registration._resolve_current_view,
+    )
+    box = elastix_registration.region_of_interest_box("current view", viewer=viewer)
+    assert job.kwargs["region_of_interest"] == "shapes"
+    assert np.allclose(
+        elastix_registration.region_of_interest_box("shapes", job.kwargs["roi_shapes"]),
+        box,
+    )
+    viewer.scene.camera.zoom /= 4
+    qtbot.waitUntil(lambda: job.done, timeout=60000)
+    assert job.status == FINISHED
+    qtbot.waitUntil(lambda: "translation Registration" in viewer.layers)
+    job_queue.clear_done()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from elastix_napari.labels import (
+    background_index,
+    decode_labels,
+    encode_labels,
+    label_parameter_maps,
+)
+
+
+@pytest.mark.parametrize(
+    "dtype, index_dtype", [(np.uint16, np.uint16), (np.int32, np.uint8), (np.int64, np.uint8)]
+)
+def test_encode_labels(dtype, index_dtype):
+    data = np.array([[5, -3 if dtype != np.uint16 else 3], [2**15 - 1, 5]], dtype)
+
+    indices, values = encode_labels(data)
+
+    assert indices.dtype == index_dtype
+    assert np.array_equal(decode_labels(indices, values, dtype), data)
+    assert decode_labels(indices, values, dtype).dtype == dtype
+    # Points outside the image get the background label
+    assert decode_labels(np.array(background_index(values)), values, dtype) == 0
+
+
+def test_encode_many_labels():
+    data = np.arange(70000, dtype=np.int32) * 1000
+
+    indices, values = encode_labels(data)
+
+    assert indices.dtype == np.float64
+    assert values is None
+    assert np.array_equal(decode_labels(indices, values, np.int32), data)
+
+
+def test_label_parameter_maps():
+    parameter_maps = [{"ResampleInterpolator": ["FinalBSplineInterpolator"]}]
+
+    (parameter_map,) = label_parameter_maps(parameter_maps, 4)
+
+    assert parameter_map["ResampleInterpolator"] == ["FinalNearestNeighborInterpolator"]
+    assert parameter_map["DefaultPixelValue"] == ["4"]
+    assert parameter_maps[0]["ResampleInterpolator"] == ["FinalBSplineInterpolator"]
@@ -0,0 +1,55 @@
+import itk
+import numpy as np
+from elastix_napari.batch import parameter_object_to_dicts
+from elastix_napari.metrics import image_similarity, target_registration_error
+from elastix_napari.points import physical_points, read_point_set
+
+
+def test_read_point_set(data_dir, tmpdir):
+    points, is_index = read_point_set(data_dir / "fixed_pointset_2D_test.txt")
+    assert not is_index
+    # NumPy axis order
+    assert np.array_equal(points, [[25, 25], [75, 25], [25, 75], [75, 75]])
+
+    index_file = tmpdir / "index.txt"
+    index_file.write_text("index\n1\n2 3\n", "utf-8")
+    points, is_index = read_point_set(index_file)
+    assert is_index
+    image = itk.image_from_array(np.zeros((10, 10), np.float32))
+    image.SetSpacing([2.0, 0.5])
+    image.SetOrigin([1.0, 1.0])
+    # Physical points are in NumPy axis order as well
+    assert np.allclose(physical_points(points, image), [[2.5, 5.0]])
+
+
+def test_image_similarity(images_2D):
+    fixed_image, moving_image = (
+        itk.image_view_from_array(np.asarray(layer.data, np.float32))
+        for layer in images_2D
+    )
+    similarity = image_similarity(fixed_image, fixed_image)
+    assert similarity["mse"] == 0
+    assert np.isclose(similarity["ncc"], 1)
+
+    other = image_similarity(fixed_image, moving_image)
+    assert other["mse"] > 0
+    assert other["ncc"] < similarity["ncc"]
+    assert other["mutual_information"] < similarity["mutual_information"]
+
+    mask = itk.image_view_from_array(np.zeros(fixed_image.shape, np.uint8))
+    assert image_similarity(fixed_image, moving_image, mask)["ncc"] is None
+
+
+def test_target_registration_error(data_dir):
+    parameter_object = itk.ParameterObject.New()
+    parameter_object.ReadParameterFile(str(data_dir / "TransformParameters.0_2D.txt"))
+    fixed_points, _ = read_point_set(data_dir / "fixed_pointset_2D_test.txt")
+    moving_points, _ = read_point_set(data_dir / "moving_pointset_2D_test.txt")
+
+    # The transform is the identity, so each moving point is (15, 24) away
+    error = target_registration_error(
+        fixed_points, moving_points, parameter_object_to_dicts(parameter_object)
+    )
+    assert np.allclose(error["per_point"], np.hypot(15, 24))
+    assert np.isclose(error["mean"], np.hypot(15, 24))
+    assert np.isclose(error["std"], 0)
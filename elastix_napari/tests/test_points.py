@@ -0,0 +1,71 @@
+import itk
+import numpy as np
+import pytest
+from itk_napari_conversion import image_from_image_layer
+from napari.layers import Points
+from elastix_napari.batch import parameter_object_to_dicts
+from elastix_napari.points import (
+    _transformix_point_coordinates,
+    physical_points_from_layer,
+    point_container,
+    read_point_set,
+    transform_point_coordinates,
+    write_point_set,
+)
+from elastix_napari.transformix_widget import transform_points
+
+
+def test_write_point_set(tmpdir):
+    points = np.random.default_rng(0).random((5, 3)) * 100
+    write_point_set(tmpdir / "points.txt", points)
+    read_points, is_index = read_point_set(tmpdir / "points.txt")
+    assert not is_index
+    assert np.array_equal(read_points, points)
+
+    write_point_set(tmpdir / "indices.txt", [[1, 2]], is_index=True)
+    assert (tmpdir / "indices.txt").read_text("utf-8").startswith("index\n1\n2 1")
+
+
+def test_point_container():
+    layer = Points([[1.0, 2.0], [3.0, 4.0]], scale=(2, 1), translate=(10, 0))
+    points = physical_points_from_layer(layer)
+    assert np.allclose(points, [[12, 2], [16, 4]])
+    # ITK points have the reverse axis order
+    container = point_container(points)
+    assert np.allclose(
+        itk.array_from_vector_container(container).reshape(-1, 2), points[:, ::-1]
+    )
+
+
+def test_transform_many_points(data_dir):
+    parameter_object = itk.ParameterObject.New()
+    parameter_object.ReadParameterFile(str(data_dir / "TransformParameters.0_2D.txt"))
+    data = np.random.default_rng(0).random((100_000, 2)) * 100
+    layer = Points(data, name="cells")
+
+    result = transform_points(layer, parameter_object_to_dicts(parameter_object))
+    assert isinstance(result, Points)
+    # The transform of the test file is the identity
+    assert np.allclose(result.data, data, atol=1e-4)
+
+
+@pytest.mark.parametrize("preset", ["translation", "rigid", "affine", "bspline"])
+def test_transform_points_in_memory(images_2D, preset):
+    fixed_image, moving_image = images_2D
+    parameter_object = itk.ParameterObject.New()
+    parameter_map = parameter_object.GetDefaultParameterMap(preset, 2)
+    parameter_map["MaximumNumberOfIterations"] = ["20"]
+    parameter_object.AddParameterMap(parameter_map)
+    _, transform = itk.elastix_registration_method(
+        image_from_image_layer(fixed_image),
+        image_from_image_layer(moving_image),
+        parameter_object=parameter_object,
+        log_to_console=False,
+    )
+    parameter_maps = parameter_object_to_dicts(transform)
+    # Points inside and outside the grid of the B-spline transform
+    points = np.random.default_rng(0).random((200, 2)) * 300 - 20
+
+    result = transform_point_coordinates(points, parameter_maps)
+    expected = _transformix_point_coordinates(points, parameter_maps)
+    assert np.allclose(result, expected, atol=1e-5)
@@ -0,0 +1,44 @@
+import json
+import tracemalloc
+
+import numpy as np
+
+from elastix_napari.profiling import PROFILE_FILE_NAME, RunProfile
+
+
+def test_stages(tmp_path):
+    run_profile = RunProfile("test", trace_allocations=True)
+    with run_profile.stage("allocate"):
+        array = np.ones(1024**2)
+    with run_profile.stage("sum"):
+        array.sum()
+    run_profile.finish()
+    assert not tracemalloc.is_tracing()
+
+    stages = run_profile.as_dict()["stages"]
+    assert [stage["name"] for stage in stages] == ["allocate", "sum"]
+    assert stages[0]["traced_peak"] >= array.nbytes
+    assert all(stage["seconds"] >= 0 for stage in stages)
+
+    path = run_profile.write(tmp_path)
+    assert path == tmp_path / PROFILE_FILE_NAME
+    trace = json.loads(path.read_text())
+    assert [event["name"] for event in trace["traceEvents"] if event["ph"] == "X"] == [
+        "allocate",
+        "sum",
+    ]
+
+
+def test_disabled():
+    run_profile = RunProfile("test", enabled=False, trace_allocations=True)
+    with run_profile.stage("nothing"):
+        pass
+    assert run_profile.as_dict()["stages"] == []
+    assert not tracemalloc.is_tracing()
+
+
+def test_abandoned_run_stops_tracing():
+    run_profile = RunProfile("test", trace_allocations=True)
+    assert tracemalloc.is_tracing()
+    del run_profile
+    assert not tracemalloc.is_tracing()
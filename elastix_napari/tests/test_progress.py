@@ -0,0 +1,36 @@
+import itk
+from elastix_napari.progress import read_iteration_info, total_iterations
+
+
+def test_read_iteration_info(tmpdir):
+    header = "1:ItNr\t2:Metric\t3a:Time\t3b:StepSize\t4:||Gradient||\tTime[ms]"
+    (tmpdir / "IterationInfo.0.R0.txt").write_text(
+        header + "\n0\t-0.5\t0.0\t1.0\t2.0\t1.2\n1\t-0.6\t1.0\t0.9\t1.5\t1.1\n",
+        "ascii",
+    )
+    # The last line of this file is still being written
+    (tmpdir / "IterationInfo.0.R1.txt").write_text(
+        header + "\n0\t-0.7\t0.0\t0.5\t1.0\t1.0\n1\t-0.8", "ascii"
+    )
+
+    iterations = read_iteration_info(tmpdir)
+
+    assert [(i.resolution, i.iteration) for i in iterations] == [
+        (0, 0),
+        (0, 1),
+        (1, 0),
+    ]
+    assert [i.metric for i in iterations] == [-0.5, -0.6, -0.7]
+    assert iterations[1].step_size == 0.9
+
+
+def test_total_iterations():
+    parameter_object = itk.ParameterObject.New()
+    parameter_map = parameter_object.GetDefaultParameterMap("rigid", 3)
+    parameter_map["MaximumNumberOfIterations"] = ["100"]
+    parameter_object.AddParameterMap(parameter_map)
+    parameter_map["NumberOfResolutions"] = ["2"]
+    parameter_map["MaximumNumberOfIterations"] = ["10", "20"]
+    parameter_object.AddParameterMap(parameter_map)
+
+    assert total_iterations(parameter_object) == 3 * 100 + 10 + 20
@@ -2,10 +2,15 @@ import pytest
 import elastix_napari
 import itk
 from elastix_napari import elastix_registration
+from elastix_napari.threads import thread_scheduler
+from elastix_napari.transforms import transform_registry
+from elastix_napari.workers import cancel_workers
 import numpy as np
 from itk_napari_conversion import image_layer_from_image
 from itk_napari_conversion import image_from_image_layer
 from pathlib import Path
+from napari.components import ViewerModel
+from napari.layers import Labels, Points, Shapes
 
 
 def get_er(*args, **kwargs):
@@ -21,7 +26,7 @@ def uncollect_if(images=None, masks=None, pointsets=None):
         return ("2D" in images) != ("2D" in pointsets)
 
 
-def test_registration(images, default_rigid, data_dir):
+def test_registration(images, default_rigid, tmp_path):
     fixed_image, moving_image = images
     result_image = get_er(fixed_image, moving_image, preset="rigid")
 
@@ -31,8 +36,8 @@ def test_registration(images, default_rigid, data_dir):
         parameter_object=default_rigid,
     )
 
-    fixed_filepath = Path(data_dir) / "fixed.nii"
-    moving_filepath = Path(data_dir) / "moving.nii"
+    fixed_filepath = tmp_path / "fixed.nii"
+    moving_filepath = tmp_path / "moving.nii"
 
     fixed_image = image_from_image_layer(fixed_image)
     moving_image = image_from_image_layer(moving_image)
@@ -66,6 +71,112 @@ def test_masked_registration(images, masks, default_rigid):
     assert np.allclose(image_from_image_layer(result_image), reference_result_image)
 
 
+def test_labels_mask_registration(images_2D, masks_2D):
+    fixed_image, moving_image = images_2D
+    mask, _ = masks_2D
+    # Of these labels, only label 5 is the mask
+    label_data = mask.data.astype(np.int32) * 5
+    label_data[95:] = 9
+    labels = Labels(label_data, name="labels")
+
+    result_image, result_labels = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        use_masks=True,
+        fixed_mask=labels,
+        moving_mask=labels,
+        mask_label=5,
+        moving_labels=labels,
+        use_cache=False,
+    )
+    expected = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        use_masks=True,
+        fixed_mask=mask,
+        moving_mask=mask,
+        use_cache=False,
+    )
+
+    assert np.allclose(result_image.data, expected.data)
+    assert isinstance(result_labels, Labels)
+    assert result_labels.name == "transformed labels"
+    assert result_labels.data.dtype == np.int32
+    assert set(np.unique(result_labels.data)) <= {0, 5, 9}
+
+    points = Points([[1.0, 2.0]])
+    assert (
+        get_er(fixed_image, moving_image, use_masks=True, fixed_mask=points) is None
+    )
+
+
+def test_region_of_interest_registration(images_2D):
+    fixed_image, moving_image = images_2D
+    shapes = Shapes(
+        [np.array([[60.0, 60.0], [60.0, 180.0], [180.0, 180.0], [180.0, 60.0]])],
+        shape_type="rectangle",
+    )
+
+    result_image = get_er(
+        fixed_image,
+        moving_image,
+        preset="translation",
+        region_of_interest="shapes",
+        roi_shapes=shapes,
+        roi_margin=8,
+        use_cache=False,
+    )
+
+    # Only the region of interest and its margin are registered
+    def index(world):
+        return np.floor(
+            (world - np.asarray(fixed_image.translate)) / np.asarray(fixed_image.scale)
+            + 0.5
+        )
+
+    start = index(60) - 8
+    stop = index(180) + 1 + 8
+    assert np.all(stop <= fixed_image.data.shape)
+    assert result_image.data.shape == tuple(stop - start)
+    assert np.allclose(
+        result_image.translate,
+        np.asarray(fixed_image.translate) + start * np.asarray(fixed_image.scale),
+    )
+    # The transform resamples the whole fixed image
+    full_result = elastix_napari.transformix_widget.create_transformix_widget()(
+        image=moving_image, transform=result_image.metadata["transform"]
+    )
+    assert full_result.data.shape == fixed_image.data.shape
+
+    assert (
+        get_er(fixed_image, moving_image, region_of_interest="current view") is None
+    )
+    assert (
+        get_er(fixed_image, moving_image, region_of_interest="shapes", roi_shapes=None)
+        is None
+    )
+
+
+def test_region_of_interest_of_current_view(images_2D):
+    fixed_image, _ = images_2D
+    viewer = ViewerModel()
+    viewer.add_layer(fixed_image)
+    viewer.scene.camera.zoom *= 4
+
+    box = elastix_registration.region_of_interest_box("current view", viewer=viewer)
+
+    # The view is centered on the image, and shows less than all of it
+    center = np.asarray(viewer.scene.camera.center[-2:])
+    assert np.allclose(box.mean(axis=0), center)
+    lower, upper = fixed_image.extent.world
+    assert np.all(box[1] - box[0] < upper - lower)
+    viewer.dims.ndisplay = 3
+    with pytest.raises(ValueError):
+        elastix_registration.region_of_interest_box("current view", viewer=viewer)
+
+
 # Test point set registration
 @pytest.mark.uncollect_if(func=uncollect_if)
 def test_pointset_registration(images, pointsets, default_rigid):
@@ -79,6 +190,7 @@ def test_pointset_registration(images, pointsets, default_rigid):
         preset="rigid",
         use_corresponding_points=True,
         advanced=True,
+        compute_metrics=True,
     )
     default_rigid.SetParameter(
         0, "Registration", "MultiMetricMultiResolutionRegistration"
@@ -101,6 +213,9 @@ def test_pointset_registration(images, pointsets, default_rigid):
     assert np.allclose(
         image_from_image_layer(result_image), reference_result_image, atol=0.5
     )
+    metrics = result_image.metadata["metrics"]
+    assert len(metrics["target_registration_error"]["per_point"]) == 4
+    assert metrics["similarity"]["ncc"] > 0
 
 
 # Test registration with custom parameter textfiles
@@ -198,3 +313,159 @@ def test_writing_result(images, tmpdir):
         output_directory=tmpdir,
     )
     assert (tmpdir / "TransformParameters.0.txt").exists()
+
+
+def test_background_registration(images_2D, qtbot):
+    viewer = ViewerModel()
+    fixed_image, moving_image = images_2D
+    im = get_er(
+        fixed_image, moving_image, preset="rigid", use_cache=False, viewer=viewer
+    )
+    assert im is None
+    qtbot.waitUntil(lambda: "rigid Registration" in viewer.layers, timeout=60000)
+
+    # The progress directory does not receive the result image, which is still
+    # resampled
+    expected = get_er(fixed_image, moving_image, preset="rigid", use_cache=False)
+    assert np.allclose(
+        viewer.layers["rigid Registration"].data, expected.data, atol=1e-3
+    )
+    transform = transform_registry.get(
+        viewer.layers["rigid Registration"].metadata["transform"]
+    )
+    # Later transformix runs of the transform write their result image
+    assert transform.GetParameter(0, "WriteResultImage") == ("true",)
+
+
+def test_cancel_background_registration(images_2D, qtbot):
+    viewer = ViewerModel()
+    fixed_image, moving_image = images_2D
+    get_er(
+        fixed_image,
+        moving_image,
+        preset="bspline",
+        advanced=True,
+        max_iterations=100000,
+        use_cache=False,
+        viewer=viewer,
+    )
+    qtbot.waitUntil(
+        lambda: thread_scheduler.free < thread_scheduler.cores, timeout=60000
+    )
+    cancel_workers("registration")
+    # The process of the run is terminated, which frees its cores right away
+    qtbot.waitUntil(
+        lambda: thread_scheduler.free == thread_scheduler.cores, timeout=10000
+    )
+    assert "bspline Registration" not in viewer.layers
+
+
+def test_preview_registration(images_2D):
+    fixed_image, moving_image = images_2D
+    preview_image = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        preview=True,
+        preview_shrink_factor=2,
+        refine_preview=False,
+    )
+    assert preview_image.data.shape == tuple(
+        size // 2 for size in fixed_image.data.shape
+    )
+    assert np.allclose(preview_image.scale, 2 * np.asarray(fixed_image.scale))
+
+    result_image = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        preview=True,
+        preview_shrink_factor=2,
+    )
+    assert result_image.data.shape == fixed_image.data.shape
+    assert result_image.name == "rigid Registration"
+
+
+def test_deformation_field_and_jacobian(images_2D):
+    fixed_image, moving_image = images_2D
+    result_image, field_layer, jacobian_layer = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        deformation_field=True,
+        jacobian=True,
+    )
+    assert field_layer.metadata["deformation_field"].GetImageDimension() == 2
+    # A rigid transform preserves volume
+    assert np.allclose(jacobian_layer.data, 1, atol=1e-3)
+
+
+def test_profile(images_2D, tmpdir):
+    fixed_image, moving_image = images_2D
+    tmpdir = Path(tmpdir)
+    result_image = get_er(
+        fixed_image,
+        moving_image,
+        preset="rigid",
+        save_output_to_disk=True,
+        output_directory=tmpdir,
+        profile=True,
+    )
+    stages = [stage["name"] for stage in result_image.metadata["profile"]["stages"]]
+    assert stages[:3] == [
+        "convert fixed image",
+        "convert moving image",
+        "create parameter object",
+    ]
+    assert "elastix" in stages
+    assert "create result layer" in stages
+    assert (tmpdir / "profile.json").exists()
+
+
+def test_file_registration(images_2D, tmp_path):
+    fixed_image, moving_image = images_2D
+    np.save(tmp_path / "fixed.npy", fixed_image.data.astype(np.float32))
+    np.save(tmp_path / "moving.npy", moving_image.data.astype(np.float32))
+
+    result_image = get_er(
+        fixed_file=tmp_path / "fixed.npy",
+        moving_file=tmp_path / "moving.npy",
+        result_file=tmp_path / "result.npy",
+        preset="translation",
+    )
+    reference_image = get_er(
+        fixed_image, moving_image, preset="translation", use_cache=False
+    )
+    assert np.allclose(result_image.data, reference_image.data, atol=0.5)
+    assert np.array_equal(np.load(tmp_path / "result.npy"), result_image.data)
+
+    missing = get_er(fixed_file=tmp_path / "missing.npy", moving_image=moving_image)
+    assert missing is None
+
+
+def test_time_series_registration(images_2D):
+    _, moving_image = images_2D
+    # Frames that move a few pixels further each frame
+    frames = np.stack(
+        [np.roll(moving_image.data, shift, axis=1) for shift in range(0, 8, 2)]
+    )
+    series = image_layer_from_image(itk.image_from_array(frames.astype(np.float32)))
+
+    result = get_er(
+        moving_image=series,
+        preset="translation",
+        time_series="reference frame",
+        chain_length=2,
+        advanced=True,
+        max_iterations=100,
+    )
+    assert result.data.shape == frames.shape
+    assert len(result.metadata["transforms"]) == len(frames)
+    for frame in result.data[1:]:
+        # Each frame is moved back onto the reference frame
+        inside = (slice(10, -10), slice(10, -10))
+        assert np.abs(frame[inside] - frames[0][inside]).mean() < np.abs(
+            frames[3][inside] - frames[0][inside]
+        ).mean()
+
+    assert get_er(moving_image=moving_image, time_series="predecessor") is None
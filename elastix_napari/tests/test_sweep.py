@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+from itk_napari_conversion import image_from_image_layer
+from napari.layers import Points
+from elastix_napari.sweep import SweepResult, configurations, fastest, iter_sweep, rank
+from elastix_napari.sweep_widget import elastix_parameter_sweep, parse_values
+
+
+def test_configurations():
+    values = {"max_iterations": [100, 200], "spatial_samples": [512, 1024, 2048]}
+    grid = configurations(values)
+    assert len(grid) == 6
+    assert {"max_iterations": 200, "spatial_samples": 1024} in grid
+
+    subset = configurations(values, samples=3)
+    assert len(subset) == 3
+    assert all(configuration in grid for configuration in subset)
+    assert parse_values("100, 250;500", int) == [100, 250, 500]
+
+
+def test_rank_and_fastest():
+    results = [
+        SweepResult(0, {}, 10.0, -0.9, 0.5, 1.0, [], None),
+        SweepResult(1, {}, 2.0, -0.8, 0.6, 1.5, [], None),
+        SweepResult(2, {}, 1.0, -0.1, 0.7, 5.0, [], None),
+        SweepResult(3, {}, 0.5, None, None, None, None, "failed"),
+    ]
+    assert [result.index for result in rank(results)] == [0, 1, 2]
+    assert fastest(results, max_score=2.0).index == 1
+    assert fastest(results, max_score=0.5) is None
+
+    # Without points, results of different metrics are ranked by their
+    # mutual information, not by their final metric values
+    results = [
+        SweepResult(0, {"metric": "AdvancedMeanSquares"}, 1.0, 20.0, 0.9, None, [], None),
+        SweepResult(
+            1, {"metric": "AdvancedNormalizedCorrelation"}, 1.0, -0.9, 0.4, None, [], None
+        ),
+    ]
+    assert [result.index for result in rank(results)] == [0, 1]
+
+
+def test_parameter_sweep(images_2D):
+    fixed_image, moving_image = images_2D
+    points = Points(np.array([[50.0, 60.0], [120.0, 100.0], [200.0, 180.0]]))
+    result_image = elastix_parameter_sweep()(
+        fixed_image,
+        moving_image,
+        preset="translation",
+        resolutions="1, 2",
+        max_iterations="50",
+        spatial_samples="512",
+        fixed_points=points,
+        moving_points=points,
+    )
+    assert result_image.data.shape == fixed_image.data.shape
+    ranking = result_image.metadata["sweep"]
+    assert len(ranking) == 2
+    assert ranking[0]["landmark error"] <= ranking[1]["landmark error"]
+    assert result_image.metadata["configuration"]["resolutions"] in (1, 2)
+
+
+def test_cancelled_sweep(images_2D):
+    fixed_image, moving_image = images_2D
+    cancelled = threading.Event()
+    cancelled.set()
+    results = iter_sweep(
+        image_from_image_layer(fixed_image),
+        image_from_image_layer(moving_image),
+        configurations({"max_iterations": [50, 100, 150, 200]}),
+        "translation",
+        max_workers=1,
+        cancelled=cancelled,
+    )
+    # Configurations that have not started are cancelled, without results
+    assert list(results) == []
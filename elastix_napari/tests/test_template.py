@@ -0,0 +1,66 @@
+import threading
+
+import itk
+import numpy as np
+from itk_napari_conversion import image_layer_from_image
+from elastix_napari.engine import create_parameter_object
+from elastix_napari.template import StreamingMean, iter_template_building
+from elastix_napari.template_widget import elastix_template_building
+
+
+def test_streaming_mean():
+    images = [
+        itk.image_from_array(np.full((4, 5), value, np.float32)) for value in (1, 2, 6)
+    ]
+    images[0].SetSpacing([2.0, 3.0])
+    mean = StreamingMean(images[0])
+    for image in images:
+        mean.add(image)
+
+    result = mean.mean()
+    assert mean.count == 3
+    assert np.allclose(itk.array_view_from_image(result), 3)
+    assert np.allclose(result.GetSpacing(), [2.0, 3.0])
+
+
+def test_template_building(images_2D):
+    fixed_image, moving_image = images_2D
+    subjects = [
+        image_layer_from_image(itk.image_from_array(data.astype(np.float32)))
+        for data in [
+            fixed_image.data,
+            moving_image.data,
+            np.roll(fixed_image.data, 3, axis=0),
+        ]
+    ]
+    for index, layer in enumerate(subjects):
+        layer.name = f"subject {index}"
+
+    templates = elastix_template_building()(
+        subjects=subjects, preset="translation", rounds=2, max_workers=1
+    )
+    assert [layer.name for layer in templates] == [
+        "template round 1",
+        "template round 2",
+    ]
+    assert templates[-1].data.shape == fixed_image.data.shape
+    assert templates[-1].metadata["registered"] == [layer.name for layer in subjects]
+
+    assert elastix_template_building()(subjects=subjects[:1]) is None
+
+
+def test_cancelled_template_building(images_2D):
+    fixed_image, moving_image = images_2D
+    cancelled = threading.Event()
+    cancelled.set()
+    rounds = iter_template_building(
+        [
+            itk.image_from_array(layer.data.astype(np.float32))
+            for layer in (fixed_image, moving_image)
+        ],
+        create_parameter_object("translation"),
+        rounds=2,
+        max_workers=1,
+        cancelled=cancelled,
+    )
+    assert list(rounds) == []
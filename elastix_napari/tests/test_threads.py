@@ -0,0 +1,95 @@
+import threading
+
+import itk
+import numpy as np
+from elastix_napari import elastix_registration, transformix_widget
+from elastix_napari.cache import registration_cache
+from elastix_napari.threads import ThreadScheduler, limit_threads, threads_per_worker
+from elastix_napari.tiling import tiled_transformix
+
+
+def test_threads_per_worker():
+    assert threads_per_worker(4, cores=16) == 4
+    assert threads_per_worker(3, cores=16) == 5
+    assert threads_per_worker(32, cores=16) == 1
+    assert threads_per_worker(None, cores=16) == 1
+
+
+def test_scheduler_splits_cores():
+    scheduler = ThreadScheduler(cores=8)
+    first = scheduler.acquire()
+    assert first == 8
+    scheduler.release(first)
+
+    first = scheduler.acquire(requested=6)
+    second = scheduler.acquire()
+    assert (first, second) == (6, 4)
+
+    # A run that requests threads waits until a core is free
+    granted = []
+    thread = threading.Thread(target=lambda: granted.append(scheduler.acquire(2)))
+    thread.start()
+    thread.join(timeout=0.2)
+    assert not granted
+    scheduler.release(second)
+    thread.join()
+    assert granted == [2]
+    scheduler.release(first)
+    scheduler.release(granted[0])
+    assert scheduler.free == 8
+
+
+def test_scheduler_shares_cores_with_new_runs():
+    scheduler = ThreadScheduler(cores=8)
+    first = scheduler.acquire()
+    # Runs that start while the first one uses all cores do not wait for it
+    second = scheduler.acquire()
+    third = scheduler.acquire()
+    assert (first, second, third) == (8, 4, 2)
+    for granted in [first, second, third]:
+        scheduler.release(granted)
+    assert scheduler.free == 8
+
+
+def test_grant_is_passed_to_transformix(images_2D, data_dir):
+    _, moving_image = images_2D
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(
+        str(data_dir / "TransformParameters.0_2D.txt")
+    )
+    image = itk.image_view_from_array(np.asarray(moving_image.data, np.float32))
+    default = itk.MultiThreaderBase.GetGlobalDefaultNumberOfThreads()
+    with limit_threads(2, ThreadScheduler(cores=2)) as granted:
+        # The grant is passed to the run, instead of set for the whole process
+        assert itk.MultiThreaderBase.GetGlobalDefaultNumberOfThreads() == default
+        result = tiled_transformix(
+            image, transform_parameter_object, 32, number_of_threads=granted
+        )
+    expected = itk.transformix_filter(image, transform_parameter_object)
+    assert np.allclose(np.asarray(result), np.asarray(expected), atol=1e-4)
+
+
+def test_number_of_threads(images_2D):
+    fixed_image, moving_image = images_2D
+    result_image = elastix_registration.elastix_registration()(
+        fixed_image, moving_image, preset="translation", number_of_threads=1
+    )
+    result_image_trx = transformix_widget.create_transformix_widget()(
+        image=moving_image,
+        transform=result_image.metadata["transform"],
+        number_of_threads=1,
+    )
+    assert np.allclose(result_image_trx.data, result_image.data, atol=1e-3)
+    with limit_threads(1, ThreadScheduler(cores=1)) as granted:
+        assert granted == 1
+
+
+def test_global_threads_are_restored(images_2D):
+    fixed_image, moving_image = images_2D
+    registration_cache.clear()
+    maximum = itk.MultiThreaderBase.GetGlobalMaximumNumberOfThreads()
+    elastix_registration.elastix_registration()(
+        fixed_image, moving_image, preset="translation", number_of_threads=1
+    )
+    # elastix sets the maximum of the whole process to the threads of its run
+    assert itk.MultiThreaderBase.GetGlobalMaximumNumberOfThreads() == maximum
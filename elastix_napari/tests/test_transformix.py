@@ -1,7 +1,10 @@
 import pytest
 import itk
 import numpy as np
-from elastix_napari import transformix_widget
+from napari.layers import Labels, Points
+from elastix_napari import elastix_registration, tiling, transformix_widget
+from elastix_napari.tiling import OutputGrid, block_footprint, tiled_transformix
+from elastix_napari.transforms import transform_registry
 from itk_napari_conversion import image_from_image_layer
 from pathlib import Path
 
@@ -37,3 +40,173 @@ def test_empty_transform_file(images):
         image=image_from_image_layer(images[1]), transform_file=Path()
     )
     assert result is None
+
+
+def test_lazy_transformation(images, data_dir):
+    _, moving_image = images
+    if moving_image.data.ndim == 2:
+        transform_file = data_dir / "TransformParameters.0_2D.txt"
+    else:
+        transform_file = data_dir / "TransformParameters.0_3D.txt"
+    widget = transformix_widget.create_transformix_widget()
+
+    expected = widget(image=moving_image, transform_file=transform_file)
+    result = widget(
+        image=moving_image, transform_file=transform_file, lazy_output=True, block_size=32
+    )
+
+    # The result is read from a file
+    assert isinstance(result.data, np.memmap)
+    assert np.allclose(np.asarray(result.data), expected.data, atol=1e-4)
+    assert np.allclose(result.scale, expected.scale)
+    assert np.allclose(result.translate, expected.translate)
+
+
+def test_tiled_transformation(images, data_dir):
+    _, moving_image = images
+    if moving_image.data.ndim == 2:
+        transform_file = data_dir / "TransformParameters.0_2D.txt"
+    else:
+        transform_file = data_dir / "TransformParameters.0_3D.txt"
+    image = image_from_image_layer(moving_image)
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(str(transform_file))
+
+    expected = itk.transformix_filter(image, transform_parameter_object)
+    result = tiled_transformix(
+        image, transform_parameter_object, block_size=32, max_workers=4
+    )
+
+    assert np.allclose(np.asarray(result), np.asarray(expected), atol=1e-4)
+    assert np.allclose(result.GetSpacing(), expected.GetSpacing())
+    assert np.allclose(result.GetOrigin(), expected.GetOrigin())
+
+
+def test_tiled_transformation_shares_cores(images_2D, data_dir, monkeypatch):
+    _, moving_image = images_2D
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(
+        str(data_dir / "TransformParameters.0_2D.txt")
+    )
+    image = image_from_image_layer(moving_image)
+    block_threads = set()
+    transform_block = tiling.transform_block
+
+    def recording_transform_block(*args):
+        block_threads.add(args[-1])
+        return transform_block(*args)
+
+    monkeypatch.setattr(tiling, "transform_block", recording_transform_block)
+    monkeypatch.setattr(tiling, "available_cores", lambda: 8)
+    tiled_transformix(image, transform_parameter_object, 32, max_workers=4)
+    # Without a number of threads, the blocks divide the cores between them
+    assert block_threads == {2}
+
+
+def test_multiple_layers(images_2D, data_dir):
+    _, moving_image = images_2D
+    transform_file = data_dir / "TransformParameters.0_2D.txt"
+    labels = Labels((moving_image.data > 0).astype(np.uint8) * 3, name="labels")
+    points = Points([[10.0, 20.0], [30.0, 40.0]], name="points")
+
+    result = transformix_widget.create_transformix_widget()(
+        image=moving_image, layers=[labels, points], transform_file=transform_file
+    )
+
+    image_result, labels_result, points_result = result
+    expected = transformix_widget.create_transformix_widget()(
+        image=moving_image, transform_file=transform_file
+    )
+    assert np.allclose(image_result.data, expected.data)
+    assert isinstance(labels_result, Labels)
+    assert set(np.unique(labels_result.data)) <= {0, 3}
+    assert isinstance(points_result, Points)
+    # The transform of the test file is the identity
+    assert np.allclose(points_result.data, points.data, atol=1e-4)
+
+
+def test_transform_from_registry(images_2D):
+    fixed_image, moving_image = images_2D
+    result_image = elastix_registration.elastix_registration()(
+        fixed_image, moving_image, preset="translation"
+    )
+    name = result_image.metadata["transform"]
+    assert name in transform_registry
+
+    result_image_trx = transformix_widget.create_transformix_widget()(
+        image=moving_image, transform=name
+    )
+    assert np.allclose(result_image_trx.data, result_image.data, atol=1e-3)
+
+
+def test_profile(images_2D, tmpdir):
+    fixed_image, moving_image = images_2D
+    result_image = elastix_registration.elastix_registration()(
+        fixed_image, moving_image, preset="translation"
+    )
+    result_images = transformix_widget.create_transformix_widget()(
+        image=moving_image,
+        layers=[fixed_image],
+        transform=result_image.metadata["transform"],
+        profile=True,
+        output_directory=Path(tmpdir),
+    )
+    profile = result_images[0].metadata["profile"]
+    assert result_images[1].metadata["profile"] == profile
+    stages = [stage["name"] for stage in profile["stages"]]
+    assert f"transformix of {moving_image.name}" in stages
+    assert f"transformix of {fixed_image.name}" in stages
+    assert (Path(tmpdir) / "profile.json").exists()
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.int32, np.uint64])
+@pytest.mark.parametrize("lazy_output", [False, True])
+def test_label_types(images_2D, data_dir, dtype, lazy_output):
+    _, moving_image = images_2D
+    # Labels of which an int32 or float round trip would lose values
+    data = np.zeros(moving_image.data.shape, dtype)
+    data[10:30, 20:50] = 7
+    data[40:60, 5:25] = np.iinfo(dtype).max
+    labels = Labels(data, name="labels")
+
+    result = transformix_widget.create_transformix_widget()(
+        layers=[labels],
+        transform_file=data_dir / "TransformParameters.0_2D.txt",
+        lazy_output=lazy_output,
+        block_size=32,
+    )
+
+    # The transform of the test file is the identity, on a 100 x 100 grid
+    assert isinstance(result, Labels)
+    assert result.data.dtype == dtype
+    assert np.array_equal(np.asarray(result.data), data[:100, :100])
+
+
+def test_output_grid_parameter_maps():
+    grid = OutputGrid(
+        (20, 30, 40), (1.0, 2.0, 3.0), (5.0, 6.0, 7.0), np.eye(3)[[1, 0, 2]]
+    )
+
+    parameter_maps = grid.parameter_maps([{"Size": ["1", "1", "1"]}])
+    result = OutputGrid.from_parameter_maps(parameter_maps)
+
+    assert result.shape == grid.shape
+    assert np.allclose(result.spacing, grid.spacing)
+    assert np.allclose(result.origin, grid.origin)
+    assert np.allclose(result.direction, grid.direction)
+
+
+def test_block_footprint(images_2D, data_dir):
+    _, moving_image = images_2D
+    image = image_from_image_layer(moving_image)
+    parameter_maps = transformix_widget.read_parameter_maps(
+        data_dir / "TransformParameters.0_2D.txt"
+    )
+    grid = OutputGrid.from_parameter_maps(parameter_maps)
+
+    # The transform of the test file is the identity, with linear interpolation
+    assert block_footprint(image, parameter_maps, grid, (10, 20), (30, 40)) == [
+        (8, 42),
+        (18, 62),
+    ]
+    assert block_footprint(image, parameter_maps, grid, (300, 300), (5, 5)) is None
@@ -0,0 +1,137 @@
+"""Divides the cores over the elastix and transformix runs at the same time."""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+def available_cores() -> int:
+    """
+    Returns the number of cores that this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def threads_per_worker(max_workers: int = None, cores: int = None) -> int:
+    """
+    Returns the number of threads of each of `max_workers` runs that take
+    place at the same time, so that together they use all cores once.
+    """
+    cores = cores or available_cores()
+    return max(cores // (max_workers or cores), 1)
+
+
+class ThreadScheduler:
+    """
+    Hands out the cores to the runs that take place at the same time. A run
+    that does not request a number of threads starts right away, with the
+    free cores or its fair share of all cores, whichever is more, so that it
+    does not wait for an earlier run that took all cores. The threads of the
+    runs then exceed the cores only until that earlier run finishes. A run
+    that requests a number of threads waits until a core is free, and gets
+    at most the free cores. `reserved` cores are kept free, for example for
+    rendering.
+    """
+
+    def __init__(self, cores: int = None, reserved: int = 0):
+        self.cores = max((cores or available_cores()) - reserved, 1)
+        self._in_use = 0
+        self._runs = 0
+        self._condition = threading.Condition()
+
+    @property
+    def free(self) -> int:
+        with self._condition:
+            return max(self.cores - self._in_use, 0)
+
+    def acquire(self, requested: int = 0) -> int:
+        """
+        Returns the number of threads that the run may use, see the class
+        docstring. Requests of more threads than there are free cores get the
+        free cores.
+        """
+        with self._condition:
+            if requested > 0:
+                self._condition.wait_for(lambda: self._in_use < self.cores)
+                granted = min(requested, self.cores - self._in_use)
+            else:
+                granted = max(
+                    self.cores - self._in_use, self.cores // (self._runs + 1), 1
+                )
+            self._in_use += granted
+            self._runs += 1
+            return granted
+
+    def release(self, granted: int):
+        with self._condition:
+            self._in_use -= granted
+            self._runs -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def threads(self, requested: int = 0) -> Iterator[int]:
+        """
+        Context of a run, which receives its number of threads.
+        """
+        granted = self.acquire(requested)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+
+# Process-wide numbers of threads of ITK from before the elastix runs that
+# currently take place, and the number of those runs
+_global_threads_lock = threading.Lock()
+_global_threads = None
+_elastix_runs = 0
+
+
+@contextmanager
+def global_threads_kept() -> Iterator[None]:
+    """
+    Context of an elastix run within this process, after which the
+    process-wide maximum and default numbers of threads of ITK are restored,
+    once the elastix runs at the same time have all finished.
+    """
+    global _global_threads, _elastix_runs
+    import itk
+
+    multi_threader = itk.MultiThreaderBase
+    with _global_threads_lock:
+        if _elastix_runs == 0:
+            _global_threads = (
+                multi_threader.GetGlobalMaximumNumberOfThreads(),
+                multi_threader.GetGlobalDefaultNumberOfThreads(),
+            )
+        _elastix_runs += 1
+    try:
+        yield
+    finally:
+        with _global_threads_lock:
+            _elastix_runs -= 1
+            if _elastix_runs == 0:
+                maximum, default = _global_threads
+                multi_threader.SetGlobalMaximumNumberOfThreads(maximum)
+                multi_threader.SetGlobalDefaultNumberOfThreads(default)
+
+
+# Scheduler of the runs of the widgets, which keeps a core free for napari
+thread_scheduler = ThreadScheduler(reserved=1)
+
+
+@contextmanager
+def limit_threads(
+    requested: int = 0, scheduler: ThreadScheduler = thread_scheduler
+) -> Iterator[int]:
+    """
+    Context of a run within this process, which waits for its share of the
+    cores of `scheduler`, and receives the number of threads to pass to
+    elastix or transformix. The share is passed to the run, instead of set as
+    the process-wide number of threads of ITK, so that runs at the same time
+    do not change each other's share.
+    """
+    with scheduler.threads(requested) as granted:
+        yield granted
@@ -0,0 +1,323 @@
+"""Runs transformix on blocks of the output grid."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_from_dicts, parameter_object_to_dicts
+from elastix_napari.threads import available_cores, threads_per_worker
+
+DEFAULT_BLOCK_SIZE = 256
+
+# Distance in output pixels between the points of a block that are
+# transformed to find its footprint in the input image
+FOOTPRINT_STRIDE = 8
+
+# Margin in input pixels around the footprint of a block. B-spline
+# coefficients of a cropped input differ from those of the whole input near
+# the crop border, by a factor that decays exponentially with the distance
+# to it (for cubic B-splines, 0.27 per pixel).
+BSPLINE_MARGIN = 16
+LINEAR_MARGIN = 2
+
+
+class OutputGrid:
+    """
+    The output grid of a transform, with all values in NumPy axis order (the
+    reverse of the ITK and elastix order).
+    """
+
+    def __init__(self, shape, spacing, origin, direction):
+        self.shape = tuple(int(size) for size in shape)
+        self.spacing = np.asarray(spacing, float)
+        self.origin = np.asarray(origin, float)
+        self.direction = np.asarray(direction, float)
+
+    @classmethod
+    def from_parameter_maps(cls, parameter_maps: List[dict]) -> "OutputGrid":
+        parameter_map = parameter_maps[-1]
+        size = [int(value) for value in parameter_map["Size"]]
+        dimension = len(size)
+        spacing = [float(value) for value in parameter_map.get("Spacing", [])]
+        origin = [float(value) for value in parameter_map.get("Origin", [])]
+        direction = [float(value) for value in parameter_map.get("Direction", [])]
+        spacing = spacing or [1.0] * dimension
+        origin = origin or [0.0] * dimension
+        # elastix stores the direction cosines column by column
+        direction = (
+            np.reshape(direction, (dimension, dimension)).T
+            if direction
+            else np.eye(dimension)
+        )
+        return cls(
+            size[::-1], spacing[::-1], origin[::-1], direction[::-1, ::-1]
+        )
+
+    @classmethod
+    def from_image(cls, image: "itk.Image", shape=None) -> "OutputGrid":
+        """
+        Returns the grid of an ITK image, or of the same geometry with
+        another `shape`.
+        """
+        if shape is None:
+            shape = itk.array_view_from_image(image).shape
+        return cls(shape, image["spacing"], image["origin"], image["direction"])
+
+    def parameter_maps(self, parameter_maps: List[dict]) -> List[dict]:
+        """
+        Returns a copy of the parameter maps that resamples this grid.
+        """
+        # elastix stores the direction cosines column by column
+        direction = self.direction[::-1, ::-1].T.ravel()
+        grid = {
+            "Size": [str(size) for size in self.shape[::-1]],
+            "Index": ["0"] * len(self.shape),
+            "Spacing": [repr(float(value)) for value in self.spacing[::-1]],
+            "Origin": [repr(float(value)) for value in self.origin[::-1]],
+            "Direction": [repr(float(value)) for value in direction],
+        }
+        return [dict(parameter_map, **grid) for parameter_map in parameter_maps]
+
+    def block_parameter_maps(
+        self, parameter_maps: List[dict], start: Sequence[int], shape: Sequence[int]
+    ) -> List[dict]:
+        """
+        Returns a copy of the parameter maps that resamples only the block of
+        `shape` at pixel index `start` of the grid.
+        """
+        origin = self.origin + self.direction @ (np.asarray(start) * self.spacing)
+        parameter_maps = [dict(parameter_map) for parameter_map in parameter_maps]
+        parameter_maps[-1]["Size"] = [str(size) for size in shape[::-1]]
+        parameter_maps[-1]["Origin"] = [repr(float(value)) for value in origin[::-1]]
+        return parameter_maps
+
+
+def _image_copy_view(image: "itk.Image") -> "itk.Image":
+    # ITK filters update the requested region of their input, so concurrent
+    # transformix calls each get their own view of the shared pixel buffer
+    view = itk.image_view_from_array(itk.array_view_from_image(image))
+    view.CopyInformation(image)
+    return view
+
+
+def _interpolation_margin(parameter_maps: List[dict]) -> int:
+    parameter_map = parameter_maps[-1]
+    interpolator = parameter_map.get("ResampleInterpolator", [""])[0]
+    order = int(parameter_map.get("FinalBSplineInterpolationOrder", ["3"])[0])
+    if interpolator == "FinalBSplineInterpolator" and order > 1:
+        return BSPLINE_MARGIN
+    return LINEAR_MARGIN
+
+
+def block_footprint(
+    image: "itk.Image",
+    parameter_maps: List[dict],
+    grid: OutputGrid,
+    start: Sequence[int],
+    shape: Sequence[int],
+) -> List[Tuple[int, int]]:
+    """
+    Returns the (start, stop) pixel range per axis of `image` that the block
+    of `shape` at pixel index `start` of the output grid samples, with a
+    margin for the interpolation, or None when it samples no part of it.
+    """
+    from elastix_napari.points import transform_point_coordinates
+
+    # A lattice of points of the block, including its last points
+    axes = [
+        np.unique(
+            np.r_[np.arange(first, first + size, FOOTPRINT_STRIDE), first + size - 1]
+        )
+        for first, size in zip(start, shape)
+    ]
+    indices = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(
+        -1, len(shape)
+    )
+    points = grid.origin + (indices * grid.spacing) @ grid.direction.T
+    moving_points = transform_point_coordinates(points, parameter_maps)
+
+    # The continuous pixel indices of the points in the input image
+    origin = np.asarray(image["origin"], float)
+    spacing = np.asarray(image["spacing"], float)
+    direction = np.asarray(image["direction"], float)
+    input_indices = (
+        np.linalg.solve(direction, (moving_points - origin).T).T / spacing
+    )
+
+    margin = _interpolation_margin(parameter_maps)
+    input_shape = itk.array_view_from_image(image).shape
+    lower = np.maximum(np.floor(input_indices.min(axis=0)).astype(int) - margin, 0)
+    upper = np.minimum(
+        np.ceil(input_indices.max(axis=0)).astype(int) + 1 + margin, input_shape
+    )
+    if np.any(lower >= upper):
+        return None
+    return [(int(first), int(last)) for first, last in zip(lower, upper)]
+
+
+def _cropped_image(image: "itk.Image", region: List[Tuple[int, int]]) -> "itk.Image":
+    data = itk.array_view_from_image(image)
+    if [(0, size) for size in data.shape] == list(region):
+        return _image_copy_view(image)
+    data = data[tuple(slice(first, last) for first, last in region)]
+    cropped = itk.image_view_from_array(np.ascontiguousarray(data))
+    start = np.asarray([first for first, _ in region], float)
+    spacing = np.asarray(image["spacing"], float)
+    direction = np.asarray(image["direction"], float)
+    cropped["spacing"] = spacing
+    cropped["origin"] = np.asarray(image["origin"], float) + direction @ (
+        start * spacing
+    )
+    cropped["direction"] = direction
+    return cropped
+
+
+def transform_block(
+    image: "itk.Image",
+    parameter_maps: List[dict],
+    grid: OutputGrid,
+    start: Sequence[int],
+    shape: Sequence[int],
+    number_of_threads: int = 0,
+) -> np.ndarray:
+    """
+    Resamples `image` on the block of `shape` at pixel index `start` of the
+    output grid, and returns it as a NumPy array. Only the footprint of the
+    block in `image` is passed to transformix, which uses `number_of_threads`
+    (or the default number of threads of ITK, when it is 0).
+    """
+    block_maps = grid.block_parameter_maps(parameter_maps, start, shape)
+    region = block_footprint(image, parameter_maps, grid, start, shape)
+    if region is None:
+        default_value = float(parameter_maps[-1].get("DefaultPixelValue", ["0"])[0])
+        return np.full(shape, default_value, itk.array_view_from_image(image).dtype)
+    kwargs = {}
+    if number_of_threads:
+        kwargs["number_of_work_units"] = number_of_threads
+    result = itk.transformix_filter(
+        _cropped_image(image, region),
+        parameter_object_from_dicts(block_maps),
+        **kwargs,
+    )
+    return itk.array_from_image(result)
+
+
+def block_starts_and_shapes(
+    shape: Sequence[int], block_shape: Sequence[int]
+) -> List[Tuple[Tuple[int, ...], Tuple[int, ...]]]:
+    """
+    Splits a grid of `shape` into blocks of at most `block_shape`, and returns
+    the start index and shape of each block.
+    """
+    blocks = []
+    counts = [-(-size // block) for size, block in zip(shape, block_shape)]
+    for index in np.ndindex(*counts):
+        start = tuple(i * block for i, block in zip(index, block_shape))
+        blocks.append(
+            (
+                start,
+                tuple(
+                    min(block, size - first)
+                    for first, block, size in zip(start, block_shape, shape)
+                ),
+            )
+        )
+    return blocks
+
+
+def lazy_transformix(
+    image: "itk.Image",
+    transform_parameter_object: "itk.ParameterObject",
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    number_of_threads: int = 0,
+) -> Tuple["dask.array.Array", OutputGrid]:
+    """
+    Returns the result of transformix as a dask array, of which each block is
+    only resampled when it is computed, with `number_of_threads` per block,
+    together with its output grid. napari computes the blocks of dask layers
+    that it shows on its GUI thread, so layers should rather show the result
+    of store_blocks.
+    """
+    # dask takes half a second to load, so it is only loaded for lazy output
+    import dask
+    import dask.array as da
+
+    parameter_maps = parameter_object_to_dicts(transform_parameter_object)
+    grid = OutputGrid.from_parameter_maps(parameter_maps)
+    dtype = itk.array_view_from_image(image).dtype
+    block_shape = (block_size,) * len(grid.shape)
+
+    counts = [-(-size // block_size) for size in grid.shape]
+    blocks = np.empty(counts, object)
+    for start, shape in block_starts_and_shapes(grid.shape, block_shape):
+        index = tuple(first // block_size for first in start)
+        blocks[index] = da.from_delayed(
+            dask.delayed(transform_block)(
+                image, parameter_maps, grid, start, shape, number_of_threads
+            ),
+            shape,
+            dtype,
+        )
+    return da.block(blocks.tolist()), grid
+
+
+def store_blocks(data: "dask.array.Array", file_name: os.PathLike) -> np.ndarray:
+    """
+    Computes the blocks of a dask array one after another into a NumPy
+    (.npy) file, and returns a read-only memory map of the file, so that the
+    array never has to fit in memory. Reading the memory map only takes the
+    time of reading the file.
+    """
+    import dask.array as da
+
+    output = np.lib.format.open_memmap(
+        file_name, mode="w+", dtype=data.dtype, shape=data.shape
+    )
+    # The blocks use the threads of the run themselves
+    da.store(data, output, lock=False, scheduler="synchronous")
+    output.flush()
+    del output
+    return np.load(file_name, mmap_mode="r")
+
+
+def tiled_transformix(
+    image: "itk.Image",
+    transform_parameter_object: "itk.ParameterObject",
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_workers: int = None,
+    number_of_threads: int = 0,
+) -> "itk.Image":
+    """
+    Like itk.transformix_filter, but resamples blocks of the output grid in
+    parallel, using up to `max_workers` threads, into one preallocated result
+    image. The blocks that are resampled at the same time share
+    `number_of_threads` threads, or the available cores when it is 0, so at
+    most that many blocks are resampled at the same time.
+    """
+    number_of_threads = number_of_threads or available_cores()
+    max_workers = min(max_workers or number_of_threads, number_of_threads)
+    block_threads = threads_per_worker(max_workers, number_of_threads)
+    parameter_maps = parameter_object_to_dicts(transform_parameter_object)
+    grid = OutputGrid.from_parameter_maps(parameter_maps)
+    result = np.empty(grid.shape, itk.array_view_from_image(image).dtype)
+
+    def resample(block):
+        start, shape = block
+        result[
+            tuple(slice(first, first + size) for first, size in zip(start, shape))
+        ] = transform_block(
+            image, parameter_maps, grid, start, shape, block_threads
+        )
+
+    blocks = block_starts_and_shapes(grid.shape, (block_size,) * len(grid.shape))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results, to raise the error of a failing block
+        list(executor.map(resample, blocks))
+
+    result_image = itk.image_view_from_array(result)
+    result_image["spacing"] = grid.spacing
+    result_image["origin"] = grid.origin
+    result_image["direction"] = grid.direction
+    return result_image
@@ -0,0 +1,138 @@
+"""Registers the frames of a time series in chains, in a process pool."""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Iterator, List, NamedTuple, Sequence
+
+import numpy as np
+import itk
+
+from elastix_napari.batch import parameter_object_from_dicts, parameter_object_to_dicts
+from elastix_napari.processes import process_pool, worker_state
+from elastix_napari.threads import threads_per_worker
+
+REFERENCE = "reference frame"
+PREDECESSOR = "predecessor"
+MODES = [REFERENCE, PREDECESSOR]
+
+class FrameResult(NamedTuple):
+    index: int
+    result_image: np.ndarray
+    transform_parameters: List[dict]
+    elapsed: float
+    error: str
+
+
+def chains(number_of_frames: int, chain_length: int) -> List[range]:
+    """
+    Splits the frames into chains of at most `chain_length` consecutive
+    frames.
+    """
+    chain_length = max(chain_length, 1)
+    return [
+        range(start, min(start + chain_length, number_of_frames))
+        for start in range(0, number_of_frames, chain_length)
+    ]
+
+
+def _worker_state(parameter_maps, kwargs) -> dict:
+    return {
+        "parameter_object": parameter_object_from_dicts(parameter_maps),
+        "kwargs": kwargs,
+    }
+
+
+def _register_chain(indices, fixed_images, moving_images):
+    results = []
+    initial_transform = None
+    for index, fixed_image, moving_image in zip(indices, fixed_images, moving_images):
+        start = time.perf_counter()
+        kwargs = dict(worker_state["kwargs"])
+        if initial_transform is not None:
+            # The previous frame already started from the initial transform
+            kwargs.pop("initial_transform_parameter_file_name", None)
+            kwargs["initial_transform_parameter_object"] = initial_transform
+        try:
+            result_image, result_transform_parameters = (
+                itk.elastix_registration_method(
+                    itk.image_from_dict(fixed_image),
+                    itk.image_from_dict(moving_image),
+                    parameter_object=worker_state["parameter_object"],
+                    **kwargs,
+                )
+            )
+        except Exception as error:
+            results.append(
+                FrameResult(index, None, None, time.perf_counter() - start, str(error))
+            )
+            continue
+        initial_transform = result_transform_parameters
+        results.append(
+            FrameResult(
+                index,
+                itk.array_from_image(result_image),
+                parameter_object_to_dicts(result_transform_parameters),
+                time.perf_counter() - start,
+                None,
+            )
+        )
+    return results
+
+
+def iter_time_series(
+    frames: Sequence["itk.Image"],
+    parameter_object: "itk.ParameterObject",
+    mode: str = REFERENCE,
+    reference_frame: int = 0,
+    chain_length: int = 10,
+    max_workers: int = None,
+    **kwargs,
+) -> Iterator[FrameResult]:
+    """
+    Registers each frame to the `reference_frame`, or to its predecessor, in
+    chains of at most `chain_length` frames, using up to `max_workers`
+    processes. The frames of a chain are registered one after the other,
+    each starting from the result transform of the frame before it, which
+    elastix keeps in its result; `chain_length` bounds the number of
+    parameter maps that a transform gets in this way. The first frame has no
+    predecessor, and is registered to itself. Yields a FrameResult per
+    frame, a chain at a time, in the order in which the chains finish.
+    Additional keyword arguments are passed to
+    itk.elastix_registration_method.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown time series mode: {mode}")
+    frame_chains = chains(len(frames), chain_length)
+    workers = min(max_workers or os.cpu_count() or 1, max(len(frame_chains), 1))
+    kwargs = dict(kwargs, log_to_console=False)
+    kwargs.setdefault("number_of_threads", threads_per_worker(workers))
+
+    def fixed_index(index):
+        if mode == REFERENCE:
+            return reference_frame
+        return max(index - 1, 0)
+
+    def submit(executor, chain):
+        # Frames are only copied for the chains that are about to run, and
+        # the same fixed image is sent once per chain
+        images = {}
+        for index in set(chain) | {fixed_index(index) for index in chain}:
+            images[index] = itk.dict_from_image(frames[index])
+        return executor.submit(
+            _register_chain,
+            list(chain),
+            [images[fixed_index(index)] for index in chain],
+            [images[index] for index in chain],
+        )
+
+    with process_pool(
+        workers, _worker_state, (parameter_object_to_dicts(parameter_object), kwargs)
+    ) as executor:
+        waiting = list(frame_chains)
+        running = set()
+        while waiting or running:
+            while waiting and len(running) < 2 * workers:
+                running.add(submit(executor, waiting.pop(0)))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
@@ -1,15 +1,149 @@
-from typing import TYPE_CHECKING
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Union
 from magicgui import magic_factory
-import itk
-from itk_napari_conversion import image_from_image_layer, image_layer_from_image
+import numpy as np
 from pathlib import Path
 
 # For IDE type support and autocompletion
 # https://napari.org/stable/guides/magicgui.html?highlight=type_checking
 if TYPE_CHECKING:
     import napari
+    import itk
 
+from napari.layers import Image, Labels, Points, Vectors
 from napari.utils import notifications
+from magicgui.widgets import PushButton
+from elastix_napari.job_queue_widget import add_queue_button
+from elastix_napari.transforms import transform_registry
+from elastix_napari.workers import preload_in_background, start_worker, cancel_workers
+
+# Choice of the transform widget to read the transform from transform_file
+FROM_FILE = "from file"
+
+# Maximum number of vectors shown along each axis of a deformation field
+MAX_VECTORS_PER_AXIS = 64
+
+# Directory of the files of lazy outputs, which is removed when napari exits
+_lazy_output_directory = None
+
+
+def _lazy_output_file() -> Path:
+    global _lazy_output_directory
+    if _lazy_output_directory is None:
+        _lazy_output_directory = tempfile.TemporaryDirectory(prefix="elastix-napari-")
+    handle, file_name = tempfile.mkstemp(".npy", dir=_lazy_output_directory.name)
+    os.close(handle)
+    return Path(file_name)
+
+
+@lru_cache(maxsize=8)
+def _read_parameter_maps(file_name: str, modified: float) -> List[dict]:
+    # Cached per file and modification time, so that a transform file is only
+    # parsed again after it changed
+    import itk
+    from elastix_napari.batch import parameter_object_to_dicts
+
+    transform_parameter_object = itk.ParameterObject.New()
+    transform_parameter_object.ReadParameterFile(file_name)
+    return parameter_object_to_dicts(transform_parameter_object)
+
+
+def read_parameter_maps(transform_file: Path) -> List[dict]:
+    """
+    Returns the parameter maps of a transform parameter file, as plain
+    dictionaries that may be modified.
+    """
+    parameter_maps = _read_parameter_maps(
+        str(transform_file), Path(transform_file).stat().st_mtime
+    )
+    return [dict(parameter_map) for parameter_map in parameter_maps]
+
+
+def _transform_choices(widget) -> List[str]:
+    return [FROM_FILE] + transform_registry.names()
+
+
+def field_layers(
+    fields, deformation_field: bool = True, jacobian: bool = True
+) -> list:
+    """
+    Returns a vectors layer of the deformation field and an image layer of the
+    spatial Jacobian determinant of `fields` (a TransformFields), as selected.
+    The vectors layer shows a subsampled field and keeps the full field, as an
+    itk.Image, in its metadata.
+    """
+    import itk
+    from itk_napari_conversion import image_layer_from_image
+
+    layers = []
+    if deformation_field:
+        field = fields.deformation_field
+        dimension = field.GetImageDimension()
+        array = itk.array_view_from_image(field)
+        step = [-(-size // MAX_VECTORS_PER_AXIS) for size in array.shape[:dimension]]
+        scale = np.asarray(field["spacing"], float) * step
+        # napari expects the projections in NumPy axis order and data units
+        vectors = array[tuple(slice(None, None, s) for s in step)][..., ::-1] / scale
+        layer = Vectors(
+            vectors,
+            scale=scale,
+            translate=np.asarray(field["origin"], float),
+            name="deformation field",
+        )
+        layer.metadata["deformation_field"] = field
+        layers.append(layer)
+    if jacobian and fields.jacobian_determinant is not None:
+        layer = image_layer_from_image(fields.jacobian_determinant)
+        layer.name = "spatial Jacobian determinant"
+        layers.append(layer)
+    return layers
+
+
+def transform_points(
+    points: "napari.layers.Points", parameter_maps: List[dict]
+) -> "napari.layers.Points":
+    """
+    Transforms the points of a points layer in memory (see
+    points.transform_point_coordinates). Like elastix, the transform maps
+    points from the fixed image to the moving image.
+    """
+    from elastix_napari.points import (
+        physical_points_from_layer,
+        transform_point_coordinates,
+    )
+
+    # The points are transformed in physical (world) coordinates, all at once
+    transformed = transform_point_coordinates(
+        physical_points_from_layer(points), parameter_maps
+    )
+    return Points(
+        transformed, name=f"transformed {points.name}", features=points.features
+    )
+
+
+def labels_layer_from_image(
+    image: "itk.Image", values: np.ndarray, dtype, name: str
+) -> "napari.layers.Labels":
+    """
+    Returns a labels layer of `dtype` of a label image resampled by
+    transformix, of which the pixels are encoded labels; see
+    labels.encode_labels.
+    """
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.labels import decode_labels
+
+    layer = image_layer_from_image(image)
+    return Labels(
+        decode_labels(layer.data, values, dtype),
+        scale=layer.scale,
+        translate=layer.translate,
+        rotate=layer.rotate,
+        name=name,
+    )
+
 
 def on_init(widget):
     """
@@ -18,61 +152,357 @@ def on_init(widget):
     """
     widget.native.setStyleSheet("QWidget{font-size: 12pt;}")
 
-    widget.interpolation_order.visible = False
+    for name in [
+        "interpolation_order",
+        "pyramid_level",
+        "block_size",
+        "max_workers",
+        "number_of_threads",
+        "profile",
+        "output_directory",
+    ]:
+        getattr(widget, name).visible = False
 
     @widget.advanced.changed.connect
     def on_advanced_changed(value):
         widget.interpolation_order.visible = value
+        widget.number_of_threads.visible = value
+        widget.profile.visible = value
+        widget.output_directory.visible = value and widget.profile.value
+
+    @widget.profile.changed.connect
+    def on_profile_changed(value):
+        widget.output_directory.visible = value
+
+    def on_layers_changed(value):
+        widget.pyramid_level.visible = any(
+            getattr(layer, "multiscale", False)
+            for layer in [widget.image.value, *widget.layers.value]
+        )
+
+    widget.image.changed.connect(on_layers_changed)
+    widget.layers.changed.connect(on_layers_changed)
+
+    @widget.transform.changed.connect
+    def on_transform_changed(value):
+        widget.transform_file.visible = value == FROM_FILE
+
+    def on_blocks_changed(value):
+        widget.block_size.visible = widget.lazy_output.value or widget.tiled.value
+        widget.max_workers.visible = widget.tiled.value and not widget.lazy_output.value
+
+    widget.lazy_output.changed.connect(on_blocks_changed)
+    widget.tiled.changed.connect(on_blocks_changed)
+
+    cancel_button = PushButton(text="cancel")
+    cancel_button.tooltip = "Cancel the transformations that are still running"
+    cancel_button.changed.connect(lambda: cancel_workers("transformix"))
+    widget.append(cancel_button)
+
+    add_queue_button(
+        widget,
+        lambda kwargs: "transformix of "
+        + ", ".join(
+            layer.name
+            for layer in [kwargs["image"], *kwargs["layers"]]
+            if layer is not None
+        ),
+    )
 
     widget.native.layout().addStretch()
 
+    preload_in_background()
+
 
 @magic_factory(
     widget_init=on_init,
     layout="vertical",
     call_button="transform",
+    transform={
+        "choices": _transform_choices,
+        "tooltip": "Select a transform of a registration of this session, or "
+        "read the transform from a file",
+    },
     transform_file={
         "filter": "*.txt;*.toml",
         "tooltip": "Load a transformation parameter file",
     },
+    layers={
+        "tooltip": "Optionally select more image, labels and points layers to "
+        "transform. Labels are interpolated by nearest neighbor.",
+    },
     interpolation_order={"min": 0, "max": 5, "tooltip": "Override interpolation order"},
+    pyramid_level={
+        "min": 0,
+        "tooltip": "Level of the multiscale image to transform",
+    },
+    lazy_output={
+        "tooltip": "Resample the result block by block into a temporary file, "
+        "of which only the blocks that are shown are read, so that the result "
+        "does not have to fit in memory",
+    },
+    tiled={
+        "tooltip": "Resample blocks of the result in parallel",
+    },
+    max_workers={
+        "min": 1,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of blocks that are resampled at the same time",
+    },
+    deformation_field={
+        "tooltip": "Also show the deformation field of the transform",
+    },
+    jacobian={
+        "tooltip": "Also show the spatial Jacobian determinant of the transform",
+    },
+    use_stored_field={
+        "tooltip": "Warp images by sampling the deformation field that was "
+        "computed before for this transform, with linear interpolation",
+    },
+    block_size={
+        "min": 16,
+        "max": 4096,
+        "step": 16,
+        "tooltip": "Size of the blocks that are resampled at once",
+    },
+    number_of_threads={
+        "min": 0,
+        "max": os.cpu_count() or 1,
+        "tooltip": "Number of threads of transformix, or 0 to share the cores "
+        "with the other registrations and transformations that run",
+    },
+    profile={
+        "tooltip": "Record the time and memory use of each stage of the run "
+        "in the metadata of the results",
+    },
+    output_directory={
+        "mode": "d",
+        "tooltip": "Optionally specify a directory to write profile.json to",
+    },
 )
 def create_transformix_widget(
     image: "napari.layers.Image" = None,
+    layers: List["napari.layers.Layer"] = (),
+    transform: str = FROM_FILE,
     transform_file: Path = "",
     advanced: bool = False,
     interpolation_order: int = 3,
-) -> "napari.layers.Image":
+    pyramid_level: int = 0,
+    lazy_output: bool = False,
+    tiled: bool = False,
+    max_workers: int = os.cpu_count() or 1,
+    block_size: int = 256,
+    deformation_field: bool = False,
+    jacobian: bool = False,
+    use_stored_field: bool = False,
+    number_of_threads: int = 0,
+    profile: bool = False,
+    output_directory: Path = "",
+    viewer: "napari.viewer.Viewer" = None,
+) -> Union["napari.layers.Image", List["napari.layers.Layer"], None]:
+    """
+    Applies a transformation parameter file, or a transform kept in memory
+    from a registration of this session, to an image and optionally to more
+    layers, using transformix. The transform file is only parsed once, and
+    the layers are transformed concurrently. When the widget is docked in a
+    viewer, the transformation runs in the background and the result layer
+    is added to the viewer when done. With `lazy_output`, the result is
+    resampled block by block in the background, into a temporary
+    memory-mapped file that the result layer reads; napari would compute the
+    blocks of a lazy (dask) layer on its GUI thread. When `tiled` is set,
+    blocks are resampled in parallel. The deformation field and spatial
+    Jacobian determinant are computed by the transformix run of the first
+    image, and stored, so that with `use_stored_field` later warps sample
+    the field instead of rerunning transformix. Runs that take place at the
+    same time share the cores, unless `number_of_threads` is set. With
+    `profile`, the time and memory use of each stage are kept in the
+    "profile" metadata of the results, and optionally written to
+    `output_directory`.
+    """
 
-    if not image:
+    if not image and not layers:
         notifications.show_error("No image selected for transformation")
         return None
 
-    if transform_file == Path():
-        notifications.show_error("Select transformation parameter file")
+    import itk
+    from itk_napari_conversion import image_layer_from_image
+    from elastix_napari.batch import parameter_object_from_dicts
+    from elastix_napari.conversion import image_view_from_layer
+    from elastix_napari.fields import (
+        field_cache,
+        transformix_with_fields,
+        warp_with_field,
+    )
+    from elastix_napari.labels import (
+        background_index,
+        decode_labels,
+        label_image_view_from_layer,
+        label_parameter_maps,
+    )
+    from elastix_napari.profiling import RunProfile
+    from elastix_napari.threads import limit_threads
+    from elastix_napari.tiling import lazy_transformix, store_blocks, tiled_transformix
+
+    if profile and output_directory != Path() and not output_directory.is_dir():
+        notifications.show_error("Output directory is not valid")
         return None
 
-    # Convert image layer to itk image
-    image = image_from_image_layer(image)
-    image = image.astype(itk.F)
+    run_profile = RunProfile("transformix", enabled=profile, trace_allocations=True)
+    stage = run_profile.stage
 
-    # Read transform parameters
-    transform_parameter_object = itk.ParameterObject.New()
-    transform_parameter_object.ReadParameterFile(str(transform_file))
+    if transform != FROM_FILE:
+        parameter_maps = transform_registry.parameter_maps(transform)
+    elif transform_file == Path():
+        notifications.show_error("Select transformation parameter file")
+        return None
+    else:
+        # Read transform parameters
+        with stage("read transform"):
+            parameter_maps = read_parameter_maps(transform_file)
 
     # Override interpolation order if 'advanced' is chosen
     if advanced:
-        transform_parameter_object.SetParameter(
-            0, "ResampleInterpolator", "FinalBSplineInterpolator"
-        )
-        transform_parameter_object.SetParameter(
-            0, "FinalBSplineInterpolationOrder", str(interpolation_order)
+        parameter_maps[0]["ResampleInterpolator"] = ["FinalBSplineInterpolator"]
+        parameter_maps[0]["FinalBSplineInterpolationOrder"] = [
+            str(interpolation_order)
+        ]
+
+    selected = ([image] if image else []) + [
+        layer for layer in layers if layer is not image
+    ]
+    # The layer of which the transformix run also computes the fields
+    field_layer = None
+    if (deformation_field or jacobian) and not lazy_output:
+        field_layer = next(
+            (layer for layer in selected if not isinstance(layer, Points)), None
         )
+    computed_fields = []
+
+    def transform_layer(layer, threads):
+        # `threads` is the number of threads of the transformix run(s) of the
+        # layer
+        if isinstance(layer, Points):
+            with stage(f"transform {layer.name}"):
+                return transform_points(layer, parameter_maps)
+
+        is_labels = isinstance(layer, Labels)
+        name = "transformed image" if layer is image else f"transformed {layer.name}"
+
+        # Convert layer (or a level of a multiscale layer) to itk image.
+        # Labels keep an integer type, with their label values or indices of
+        # them, and are resampled by nearest neighbor interpolation, as
+        # interpolating would mix up label values.
+        values = None
+        with stage(f"convert {layer.name}"):
+            if is_labels:
+                itk_image, values = label_image_view_from_layer(layer, pyramid_level)
+            else:
+                itk_image = image_view_from_layer(layer, np.float32, pyramid_level)
+        layer_maps = parameter_maps
+        if is_labels:
+            layer_maps = label_parameter_maps(parameter_maps, background_index(values))
+        transform_parameter_object = parameter_object_from_dicts(layer_maps)
+
+        if lazy_output:
+            with stage(f"lazy transformix of {layer.name}"):
+                data, grid = lazy_transformix(
+                    itk_image, transform_parameter_object, block_size, threads
+                )
+                if is_labels:
+                    data = data.map_blocks(
+                        decode_labels,
+                        values,
+                        layer.data.dtype,
+                        dtype=layer.data.dtype,
+                    )
+                data = store_blocks(data, _lazy_output_file())
+            layer_type = Labels if is_labels else Image
+            return layer_type(
+                data,
+                scale=grid.spacing,
+                translate=grid.origin,
+                rotate=grid.direction.T,
+                name=name,
+            )
+
+        stored_fields = None
+        if use_stored_field:
+            stored_fields = field_cache.get(transform_parameter_object)
+
+        # Call transformix
+        if layer is field_layer:
+            with stage(f"transformix of {layer.name}, with fields"):
+                result_image_transformix, fields = transformix_with_fields(
+                    itk_image, transform_parameter_object, jacobian, threads
+                )
+            computed_fields.append(fields)
+        elif stored_fields is not None:
+            with stage(f"warp {layer.name} with stored field"):
+                result_image_transformix = warp_with_field(
+                    itk_image,
+                    stored_fields.deformation_field,
+                    order=0 if is_labels else 1,
+                    default_value=background_index(values),
+                )
+        elif tiled:
+            with stage(f"tiled transformix of {layer.name}"):
+                result_image_transformix = tiled_transformix(
+                    itk_image,
+                    transform_parameter_object,
+                    block_size,
+                    max_workers,
+                    threads,
+                )
+        else:
+            with stage(f"transformix of {layer.name}"):
+                result_image_transformix = itk.transformix_filter(
+                    itk_image,
+                    transform_parameter_object,
+                    number_of_work_units=threads,
+                )
+
+        # Convert result (itk.Image) to napari layer
+        with stage(f"create layer {name}"):
+            if is_labels:
+                result = labels_layer_from_image(
+                    result_image_transformix, values, layer.data.dtype, name
+                )
+            else:
+                result = image_layer_from_image(result_image_transformix)
+        result.name = name
+        return result
+
+    def transform():
+        with limit_threads(number_of_threads) as threads:
+            # Transform the first layer before the others, which may then
+            # reuse its deformation field
+            results = [transform_layer(selected[0], threads)]
+            if len(selected) > 1:
+                # The layers that are transformed at the same time share the
+                # threads of the run
+                workers = min(len(selected) - 1, threads)
+                layer_threads = max(threads // workers, 1)
+                with ThreadPoolExecutor(workers) as executor:
+                    results += executor.map(
+                        lambda layer: transform_layer(layer, layer_threads),
+                        selected[1:],
+                    )
+        if computed_fields:
+            with stage("create field layers"):
+                results += field_layers(
+                    computed_fields[0], deformation_field, jacobian
+                )
+        if profile:
+            run_profile.finish()
+            if output_directory != Path():
+                run_profile.write(output_directory)
+            profile_dict = run_profile.as_dict()
+            for result in results:
+                result.metadata["profile"] = profile_dict
+        return results[0] if len(results) == 1 else results
 
-    # Call transformix
-    result_image_transformix = itk.transformix_filter(image, transform_parameter_object)
+    if viewer is None:
+        return transform()
 
-    # Convert result (itk.Image) to napari layer
-    layer = image_layer_from_image(result_image_transformix)
-    layer.name = "transformed image"
-    return layer
+    start_worker(viewer, transform, "transformix")
+    return None
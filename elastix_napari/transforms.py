@@ -0,0 +1,82 @@
+"""Keeps the transforms of the registrations of a session."""
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    import itk
+
+
+class TransformRegistry:
+    """
+    Transforms by name, in the order in which they were added. The parameter
+    maps are stored as plain dictionaries, so that each caller gets its own
+    parameter object.
+    """
+
+    def __init__(self):
+        self._transforms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._transforms)
+
+    def __contains__(self, name: str):
+        return name in self._transforms
+
+    def add(
+        self, name: str, transform_parameter_object: "itk.ParameterObject"
+    ) -> str:
+        """
+        Adds a transform and returns its name, which is `name` with a number
+        appended when that is already taken by another transform. Adding the
+        same transform again returns the name it already has.
+        """
+        from elastix_napari.batch import parameter_object_to_dicts
+        from elastix_napari.cache import content_hash
+
+        parameter_maps = parameter_object_to_dicts(transform_parameter_object)
+        key = content_hash(transform_parameter_object)
+        with self._lock:
+            for existing_name, (existing_key, _) in self._transforms.items():
+                if existing_key == key:
+                    return existing_name
+            unique_name = name
+            number = 2
+            while unique_name in self._transforms:
+                unique_name = f"{name} [{number}]"
+                number += 1
+            self._transforms[unique_name] = (key, parameter_maps)
+            return unique_name
+
+    def get(self, name: str) -> "itk.ParameterObject":
+        """
+        Returns a new parameter object of the transform called `name`.
+        """
+        from elastix_napari.batch import parameter_object_from_dicts
+
+        return parameter_object_from_dicts(self.parameter_maps(name))
+
+    def parameter_maps(self, name: str) -> List[dict]:
+        """
+        Returns a copy of the parameter maps of the transform called `name`.
+        """
+        with self._lock:
+            _, parameter_maps = self._transforms[name]
+        return [dict(parameter_map) for parameter_map in parameter_maps]
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._transforms)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._transforms.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._transforms.clear()
+
+
+# Transforms of the registrations of this session
+transform_registry = TransformRegistry()
@@ -0,0 +1,156 @@
+"""Helpers to run elastix and transformix off the Qt main thread."""
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
+
+from napari.qt.threading import thread_worker
+from napari.utils import notifications
+
+if TYPE_CHECKING:
+    import napari
+
+POLL_INTERVAL = 0.1
+
+# Workers that are currently running per dock widget, so that they can be
+# cancelled from there.
+_running_workers = {}
+
+# Callbacks per dock widget that receive the progress of its workers.
+_progress_listeners = {}
+
+# Modules that take seconds to load, and the ITK attributes that load the
+# elastix and transformix wrappers
+_PRELOAD_MODULES = [
+    "dask.array",
+    "itk",
+    "itk_napari_conversion",
+    "elastix_napari.cache",
+    "elastix_napari.conversion",
+    "elastix_napari.engine",
+    "elastix_napari.fields",
+    "elastix_napari.labels",
+    "elastix_napari.metrics",
+    "elastix_napari.points",
+    "elastix_napari.progress",
+    "elastix_napari.sweep",
+    "elastix_napari.template",
+    "elastix_napari.time_series",
+    "elastix_napari.tiling",
+    "scipy.ndimage",
+]
+_PRELOAD_ITK_ATTRIBUTES = [
+    "ParameterObject",
+    "elastix_registration_method",
+    "TransformixFilter",
+]
+_preload_thread = None
+
+
+@thread_worker
+def _poll(
+    compute: Callable, monitor: Callable = None, poll_interval: float = POLL_INTERVAL
+):
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(compute)
+    executor.shutdown(wait=False)
+    while not future.done():
+        yield monitor() if monitor else None
+        time.sleep(poll_interval)
+    if monitor:
+        yield monitor()
+    return future.result()
+
+
+def add_progress_listener(group: str, callback: Callable):
+    """
+    Calls `callback` with the progress reported by the workers of `group`.
+    """
+    _progress_listeners.setdefault(group, []).append(callback)
+
+
+def remove_progress_listener(group: str, callback: Callable):
+    listeners = _progress_listeners.get(group, [])
+    if callback in listeners:
+        listeners.remove(callback)
+
+
+def start_worker(
+    viewer: "napari.viewer.Viewer",
+    compute: Callable,
+    group: str,
+    monitor: Callable = None,
+    cancelled: threading.Event = None,
+):
+    """
+    Runs `compute` in the background and adds the layer (or list of layers) it
+    returns to `viewer`.
+    While running, the value returned by `monitor` is passed to the progress
+    listeners of `group`. `cancelled` is set when the worker is cancelled, so
+    that `compute` can stop starting new work.
+    """
+    worker = _poll(compute, monitor)
+    if cancelled is not None:
+        worker.aborted.connect(cancelled.set)
+    running = _running_workers.setdefault(group, [])
+    running.append(worker)
+
+    @worker.finished.connect
+    def on_finished():
+        if worker in running:
+            running.remove(worker)
+
+    @worker.yielded.connect
+    def on_yielded(progress):
+        if progress is not None:
+            for callback in list(_progress_listeners.get(group, [])):
+                callback(progress)
+
+    @worker.returned.connect
+    def on_returned(layers):
+        if layers is None:
+            return
+        if not isinstance(layers, list):
+            layers = [layers]
+        for layer in layers:
+            viewer.add_layer(layer)
+
+    @worker.errored.connect
+    def on_errored(error):
+        notifications.show_error(str(error))
+
+    worker.start()
+    return worker
+
+
+def cancel_workers(group: str):
+    """
+    Cancels all running workers of `group`. Results of cancelled runs are
+    discarded.
+    """
+    for worker in list(_running_workers.get(group, [])):
+        worker.quit()
+
+
+def _preload():
+    for name in _PRELOAD_MODULES:
+        importlib.import_module(name)
+    itk = importlib.import_module("itk")
+    for name in _PRELOAD_ITK_ATTRIBUTES:
+        getattr(itk, name)
+
+
+def preload_in_background() -> threading.Thread:
+    """
+    Starts loading ITK, elastix and the modules that use them in a background
+    thread, once per session, so that the first registration or
+    transformation does not have to wait for them.
+    """
+    global _preload_thread
+    if _preload_thread is None:
+        _preload_thread = threading.Thread(
+            target=_preload, name="elastix-napari preload", daemon=True
+        )
+        _preload_thread.start()
+    return _preload_thread
@@ -43,7 +43,7 @@ setup(
     description='A toolbox for rigid and nonrigid registration of images.',
     long_description=read('README.md'),
     long_description_content_type='text/markdown',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     python_requires='>=3.10',
     install_requires=requirements,
     version=get_version("elastix_napari/__init__.py"),
@@ -68,6 +68,9 @@ setup(
         'Source Code': 'https://github.com/SuperElastix/elastix-napari',
         'User Support': 'https://groups.google.com/g/elastix-imageregistration',
     },
-    entry_points={'napari.manifest': ['elastix-napari = elastix_napari:napari.yaml']},
+    entry_points={
+        'napari.manifest': ['elastix-napari = elastix_napari:napari.yaml'],
+        'console_scripts': ['elastix-napari-register = elastix_napari.cli:main'],
+    },
     package_data={'elastix_napari': ['napari.yaml']}
 )